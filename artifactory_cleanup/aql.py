@@ -0,0 +1,729 @@
+"""
+Helpers to build Artifactory Query Language (AQL) queries
+https://www.jfrog.com/confluence/display/JFROG/Artifactory+Query+Language
+"""
+import codecs
+import json
+import re
+import sys
+from typing import Callable, Dict, Iterable, Iterator, Any, List, Optional, Tuple
+
+from artifactory_cleanup.errors import AqlConflictError, AqlNotSupportedError
+
+# Sort pages by the unique identity of an item, so the last row of a page is the cursor for the next one
+KEYSET_FIELDS = ("repo", "path", "name")
+
+# Ask for all fields, all properties and all stats
+INCLUDE_ALL = ("*", "property", "stat")
+
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+_INCLUDE = re.compile(r"\.include\(([^)]*)\)")
+
+
+def keyset_filter(last: Dict) -> Dict:
+    """
+    Get criteria for items that go after the ``last`` item in ``KEYSET_FIELDS`` order
+
+    >>> keyset_filter({"repo": "r", "path": "p", "name": "n"})["$or"][1]
+    {'$and': [{'repo': {'$eq': 'r'}}, {'path': {'$gt': 'p'}}]}
+    """
+    branches = []
+    for i, field in enumerate(KEYSET_FIELDS):
+        equal = [{prev: {"$eq": last[prev]}} for prev in KEYSET_FIELDS[:i]]
+        greater = {field: {"$gt": last[field]}}
+        branches.append({"$and": equal + [greater]} if equal else greater)
+    return {"$or": branches}
+
+
+def include_text(include: Iterable[str]) -> str:
+    """
+    Build arguments for ``.include(...)``: drop duplicates and fields that are already included by a wildcard
+
+    >>> include_text(["repo", "name", "repo", "@build.number", "stat.downloaded"])
+    '"repo", "name", "@build.number", "stat.downloaded"'
+    >>> include_text(["repo", "created", "*", "property", "@build.number", "stat"])
+    '"*", "property", "stat"'
+    """
+    include = list(dict.fromkeys(include))
+    if "*" in include:
+        include = [x for x in include if x == "*" or x.startswith("@") or "." in x or x in INCLUDE_ALL]
+    if "property" in include:
+        include = [x for x in include if not x.startswith("@")]
+    if "stat" in include:
+        include = [x for x in include if not x.startswith("stat.")]
+    return ", ".join(json.dumps(x) for x in include)
+
+
+def has_sort_or_limit(aql: str) -> bool:
+    """
+    Check if a rule has already added sorting or pagination to the AQL text
+
+    >>> has_sort_or_limit('items.find({}).include("*").limit(10)')
+    True
+    """
+    return any(f".{clause}(" in aql for clause in ("sort", "offset", "limit"))
+
+
+def get_unsortable_include(aql: str) -> List[str]:
+    """
+    Fields of other domains (properties, stats) in the include: Artifactory can't sort or limit such a query
+
+    >>> get_unsortable_include('items.find({}).include("repo", "name", "@build", "stat.downloaded")')
+    ['@build', 'stat.downloaded']
+    """
+    # https://www.jfrog.com/confluence/display/JFROG/Artifactory+Query+Language#ArtifactoryQueryLanguage-Limitation
+    match = _INCLUDE.search(aql)
+    include = json.loads(f"[{match.group(1)}]") if match else list(INCLUDE_ALL)
+    return [x for x in include if x.startswith("@") or "." in x or x in INCLUDE_ALL[1:]]
+
+
+def add_sort_limit(
+    aql: str, sort: Dict, offset: Optional[int] = None, limit: Optional[int] = None
+) -> str:
+    """
+    Sort artifacts and get only some of them on Artifactory side.
+    Raise AqlConflictError if it's impossible for the query.
+
+    >>> add_sort_limit('items.find({}).include("repo", "created")', {"$desc": ["created"]}, offset=5)
+    'items.find({}).include("repo", "created").sort({"$desc": ["created"]}).offset(5)'
+    """
+    if has_sort_or_limit(aql):
+        raise AqlConflictError(f"AQL query is already sorted or limited: {aql}")
+
+    other_domains = get_unsortable_include(aql)
+    if other_domains:
+        raise AqlConflictError(f"Artifactory can't sort AQL query that includes {', '.join(other_domains)}")
+
+    aql = f"{aql}.sort({json.dumps(sort)})"
+    if offset is not None:
+        aql = f"{aql}.offset({offset})"
+    if limit is not None:
+        aql = f"{aql}.limit({limit})"
+    return aql
+
+
+def page_aql(aql: str, page_size: int) -> str:
+    """
+    Fetch only one page of items sorted by the keyset.
+    Raise AqlConflictError if Artifactory can't sort the query
+    """
+    return add_sort_limit(aql, {"$asc": list(KEYSET_FIELDS)}, limit=page_size)
+
+
+def repo_shard(repo: str) -> Dict:
+    return {"repo": {"$eq": repo}}
+
+
+def get_repos(criteria: Dict) -> Tuple[List[str], List[str]]:
+    """
+    Find repositories (and masks for them) that the criteria is limited to.
+    Empty lists if the criteria may match artifacts in any repository
+
+    >>> get_repos({"$and": [{"$or": [{"repo": {"$eq": "a"}}, {"repo": {"$match": "b-*"}}]}, {"name": "c"}]})
+    (['a'], ['b-*'])
+    """
+    for clause in _conjuncts(criteria):
+        branches = clause["$or"] if "$or" in clause else [clause]
+        repos, masks = [], []
+        for branch in branches:
+            condition = branch.get("repo")
+            if not isinstance(condition, dict) or len(branch) != 1:
+                break
+            if "$eq" in condition:
+                repos.append(condition["$eq"])
+            elif "$match" in condition:
+                masks.append(condition["$match"])
+            else:
+                break
+        else:
+            return repos, masks
+    return [], []
+
+
+def created_windows(created: List[str], threshold: int) -> List[Dict]:
+    """
+    Split items to time windows with about ``threshold`` items in each one by their creation time.
+    The first and the last windows are open, so we don't miss items created meanwhile.
+    Empty list if items can't be split
+
+    >>> created_windows(["2021-01-01", "2021-01-02", "2021-01-03", "2021-01-04"], 2)
+    [{'created': {'$lt': '2021-01-03'}}, {'created': {'$gte': '2021-01-03'}}]
+    """
+    created = sorted(created)
+    count = -(-len(created) // threshold)
+    bounds = sorted(set(created[len(created) * i // count] for i in range(1, count)))
+    if not bounds:
+        return []
+
+    windows = [{"created": {"$lt": bounds[0]}}]
+    for start, end in zip(bounds, bounds[1:]):
+        windows.append({"$and": [{"created": {"$gte": start}}, {"created": {"$lt": end}}]})
+    windows.append({"created": {"$gte": bounds[-1]}})
+    return windows
+
+
+class JsonStream:
+    """
+    Decode JSON values one by one from a stream of bytes chunks without loading the whole document
+    """
+
+    def __init__(self, chunks: Iterable[bytes]):
+        self._chunks = iter(chunks)
+        self._decoder = json.JSONDecoder(object_pairs_hook=self._object)
+        # json.loads shares keys between all objects in one document, do the same between values
+        self._keys: Dict[str, str] = {}
+        self._utf8 = codecs.getincrementaldecoder("utf-8")()
+        self._buffer = ""
+        self._pos = 0
+        self._eof = False
+
+    def _object(self, pairs) -> Dict:
+        keys = self._keys
+        return {keys.setdefault(key, key): value for key, value in pairs}
+
+    def _fill(self) -> bool:
+        """Read the next chunk to the buffer, drop already decoded part"""
+        if self._eof:
+            return False
+        chunk = next(self._chunks, None)
+        if chunk is None:
+            self._eof = True
+            text = self._utf8.decode(b"", final=True)
+        else:
+            text = self._utf8.decode(chunk)
+        self._buffer = self._buffer[self._pos :] + text
+        self._pos = 0
+        return True
+
+    def peek(self) -> str:
+        """Skip whitespaces and get the next char, empty string at the end of the stream"""
+        while True:
+            self._pos = _WHITESPACE.match(self._buffer, self._pos).end()
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            if not self._fill():
+                return ""
+
+    def expect(self, char: str) -> None:
+        found = self.peek()
+        if found != char:
+            raise ValueError(f"Bad JSON stream: expected '{char}', found '{found}'")
+        self._pos += 1
+
+    def skip(self, char: str) -> bool:
+        """Skip the next char if it's the expected one"""
+        if self.peek() != char:
+            return False
+        self._pos += 1
+        return True
+
+    def value(self) -> Any:
+        self.peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buffer, self._pos)
+            except json.JSONDecodeError:
+                if self._fill():
+                    continue
+                raise
+            # A number at the end of the buffer may continue in the next chunk
+            if end == len(self._buffer) and self._fill():
+                continue
+            self._pos = end
+            return value
+
+
+# Artifacts of one folder share these strings
+INTERNED_FIELDS = ("repo", "path")
+
+
+class ArtifactStream(JsonStream):
+    """
+    Decode AQL items knowing their schema: properties ``[{"key": k1, "value": v1}, ...]`` become
+    one dict ``{k1: v1, ...}`` without a dict per property, ``repo`` and ``path`` values are interned
+    """
+
+    def _object(self, pairs):
+        count = len(pairs)
+        if count == 1 and pairs[0][0] == "key":
+            return pairs[0][1], None
+        if count == 2:
+            (first, first_value), (second, second_value) = pairs
+            if first == "key" and second == "value":
+                return first_value, second_value
+            if first == "value" and second == "key":
+                return second_value, first_value
+        keys = self._keys
+        artifact = {keys.setdefault(key, key): value for key, value in pairs}
+        if "repo" in artifact:
+            for field in INTERNED_FIELDS:
+                value = artifact.get(field)
+                if type(value) is str:
+                    artifact[field] = sys.intern(value)
+            properties = artifact.get("properties")
+            if type(properties) is list and all(type(x) is tuple for x in properties):
+                artifact["properties"] = dict(properties)
+        return artifact
+
+
+def iter_results(chunks: Iterable[bytes], key: str = "results", compact: bool = False) -> Iterator[Dict]:
+    """
+    Get items from AQL response ``{"results": [...], "range": {...}}`` one by one, as soon as they arrive.
+    With ``compact`` decode them with ``ArtifactStream``
+
+    >>> list(iter_results([b'{"results": [{"name": "a"}, {"na', b'me": "b"}], "range": {"total": 2}}']))
+    [{'name': 'a'}, {'name': 'b'}]
+    """
+    stream = ArtifactStream(chunks) if compact else JsonStream(chunks)
+    stream.expect("{")
+    while not stream.skip("}"):
+        name = stream.value()
+        stream.expect(":")
+        if name != key:
+            stream.value()
+            stream.skip(",")
+            continue
+
+        stream.expect("[")
+        while not stream.skip("]"):
+            yield stream.value()
+            stream.skip(",")
+        stream.skip(",")
+
+
+def find(session, filters: Dict, include: Iterable[str], chunk_size: int = 64 * 1024) -> Iterator[Dict]:
+    """Get items by the filters with the include, without rules of a policy, like folder listings of the mirror"""
+    aql_text = f"items.find({json.dumps(filters)}).include({include_text(include)})"
+    with session.post("/api/search/aql", data=aql_text, stream=True) as r:
+        r.raise_for_status()
+        yield from iter_results(r.iter_content(chunk_size=chunk_size), compact=True)
+
+
+def criteria_key(criteria: Dict) -> str:
+    """The same key for the same criteria, whatever order of clauses in "$and" and "$or" """
+    if len(criteria) == 1:
+        (field, value), = criteria.items()
+        if field in ("$and", "$or"):
+            return field + json.dumps(sorted(criteria_key(x) for x in value))
+    return json.dumps(criteria, sort_keys=True)
+
+
+def _split(criteria: Dict) -> List[Dict]:
+    """Split ``{"repo": "a", "name": {"$match": "*.zip", "$nmatch": "*-rc.zip"}}`` to one clause per condition"""
+    clauses = []
+    for field, value in criteria.items():
+        if field.startswith("$"):
+            clauses.append({field: value})
+        elif isinstance(value, dict) and value and all(op.startswith("$") for op in value):
+            clauses.extend({field: {op: op_value}} for op, op_value in value.items())
+        else:
+            clauses.append({field: {"$eq": value}})
+    return clauses
+
+
+def _conjuncts(criteria: Dict) -> List[Dict]:
+    return criteria["$and"] if "$and" in criteria else [criteria]
+
+
+def _and(clauses: List[Dict]) -> Dict:
+    return clauses[0] if len(clauses) == 1 else {"$and": clauses}
+
+
+def _is_single_value(field: str) -> bool:
+    """
+    Item fields and stats have exactly one value, so two different "$eq" for them can never match together.
+    An item may have many properties, archive entries or builds
+    """
+    if field.startswith(("$", "@")):
+        return False
+    return "." not in field or field.startswith("stat.")
+
+
+def _is_true(criteria: Dict) -> bool:
+    return criteria == {"$and": []}
+
+
+def _is_contradictory(clauses: List[Dict]) -> bool:
+    equal, not_equal = {}, set()
+    for clause in clauses:
+        (field, condition), = clause.items()
+        if not _is_single_value(field):
+            continue
+        (op, value), = condition.items()
+        if field == "type" and value == "any":
+            # Not a type of its own: files and folders both match it
+            continue
+        if op == "$eq":
+            if equal.setdefault(field, value) != value:
+                return True
+            if (field, json.dumps(value, sort_keys=True)) in not_equal:
+                return True
+        elif op == "$ne":
+            if field in equal and equal[field] == value:
+                return True
+            not_equal.add((field, json.dumps(value, sort_keys=True)))
+    return False
+
+
+def _dedup(clauses: List[Dict]) -> List[Dict]:
+    unique = {}
+    for clause in clauses:
+        unique.setdefault(criteria_key(clause), clause)
+    return list(unique.values())
+
+
+def _optimize_and(children: List[Dict]) -> Optional[Dict]:
+    clauses = []
+    for child in children:
+        child = optimize(child)
+        if child is None:
+            return None
+        clauses.extend(_conjuncts(child))
+    clauses = _dedup(clauses)
+    if _is_contradictory(clauses):
+        return None
+
+    # a AND (a OR b) => a
+    known = {criteria_key(clause) for clause in clauses}
+    clauses = [
+        clause
+        for clause in clauses
+        if not ("$or" in clause and any(criteria_key(branch) in known for branch in clause["$or"]))
+    ]
+    return _and(clauses)
+
+
+def _optimize_or(children: List[Dict]) -> Optional[Dict]:
+    branches = []
+    for child in children:
+        child = optimize(child)
+        if child is None:
+            continue
+        if _is_true(child):
+            return child
+        branches.extend(child["$or"] if "$or" in child else [child])
+    branches = _dedup(branches)
+    if not branches:
+        return None
+    if len(branches) == 1:
+        return branches[0]
+
+    # a OR (a AND b) => a
+    conjuncts = [{criteria_key(x) for x in _conjuncts(branch)} for branch in branches]
+    branches = [
+        branch
+        for branch, keys in zip(branches, conjuncts)
+        if not any(other < keys for other in conjuncts)
+    ]
+    if len(branches) == 1:
+        return branches[0]
+
+    # (a AND b) OR (a AND c) => a AND (b OR c)
+    common = set.intersection(*({criteria_key(x) for x in _conjuncts(branch)} for branch in branches))
+    if not common:
+        return {"$or": branches}
+    factored = [x for x in _conjuncts(branches[0]) if criteria_key(x) in common]
+    rest = []
+    for branch in branches:
+        remainder = [x for x in _conjuncts(branch) if criteria_key(x) not in common]
+        if not remainder:
+            # One of branches is just the common part
+            return _optimize_and(factored)
+        rest.append(_and(remainder))
+    return _optimize_and(factored + [{"$or": rest}])
+
+
+def optimize(criteria: Dict) -> Optional[Dict]:
+    """
+    Simplify AQL criteria: flatten nested "$and" and "$or", drop duplicated clauses,
+    pull out clauses common for all "$or" branches.
+    Return None if the criteria can never match anything, like two different repositories under "$and".
+
+    >>> optimize({"$and": [{"repo": "a"}, {"$and": [{"repo": {"$eq": "a"}}, {"name": {"$match": "*.zip"}}]}]})
+    {'$and': [{'repo': {'$eq': 'a'}}, {'name': {'$match': '*.zip'}}]}
+    >>> optimize({"$and": [{"repo": {"$eq": "a"}}, {"$or": [{"repo": {"$eq": "b"}}]}]}) is None
+    True
+    """
+    clauses = _split(criteria)
+    if len(clauses) != 1:
+        return _optimize_and(clauses)
+
+    (field, value), = clauses[0].items()
+    if field == "$and":
+        return _optimize_and(value)
+    if field == "$or":
+        return _optimize_or(value)
+    # A field or other operators like "$msp"
+    return clauses[0]
+
+
+def _mask_pattern(mask: str) -> str:
+    """AQL "$match" mask to a regexp: "*" - any characters, "?" - one character"""
+    return "".join(".*" if char == "*" else "." if char == "?" else re.escape(char) for char in mask)
+
+
+def _match_regexp(mask: str) -> "re.Pattern":
+    return re.compile(_mask_pattern(mask), re.DOTALL)
+
+
+class MaskMatcher:
+    """
+    Check a value against many AQL "$match" masks at once, like "$or" of them.
+    Masks are compiled once: masks without wildcards go to a set, "prefix*" and "*suffix" ones
+    to ``str.startswith`` and ``str.endswith`` with a tuple, all others to one regexp alternation
+
+    >>> matcher = MaskMatcher(["*.jar", "tmp-*", "a?c", "README.md", "*-rc*"])
+    >>> [matcher(x) for x in ("x.jar", "tmp-1", "abc", "README.md", "1.0-rc1.zip", "a.zip")]
+    [True, True, True, True, True, False]
+    """
+
+    def __init__(self, masks: Iterable[str]):
+        self.masks = list(dict.fromkeys(masks))
+        self.match_all = False
+        exact, prefixes, suffixes, patterns = set(), [], [], []
+        for mask in self.masks:
+            stars = mask.count("*")
+            if "?" in mask or stars > 1 and mask.strip("*"):
+                patterns.append(_mask_pattern(mask))
+            elif not stars:
+                exact.add(mask)
+            elif stars == len(mask):
+                self.match_all = True
+            elif mask.endswith("*"):
+                prefixes.append(mask[:-1])
+            elif mask.startswith("*"):
+                suffixes.append(mask[1:])
+            else:
+                patterns.append(_mask_pattern(mask))
+        self.exact = frozenset(exact)
+        self.prefixes = tuple(prefixes)
+        self.suffixes = tuple(suffixes)
+        self.regexp = re.compile("|".join(patterns), re.DOTALL) if patterns else None
+
+    def __call__(self, value: str) -> bool:
+        if self.match_all or value in self.exact:
+            return True
+        if self.prefixes and value.startswith(self.prefixes):
+            return True
+        if self.suffixes and value.endswith(self.suffixes):
+            return True
+        return self.regexp is not None and self.regexp.fullmatch(value) is not None
+
+
+class _PredicateCompiler:
+    """
+    Translate AQL criteria to the source of one Python expression over the artifact ``a``,
+    so checking an artifact is a single call without walking the criteria again.
+
+    Checks work like SQL in Artifactory: a missing value matches only "$eq": null.
+    Negative criteria for properties ("$ne", "$nmatch") match artifacts without the property as well.
+    Dates are compared as strings, that works while all of them are ISO 8601 in the same timezone.
+    """
+
+    COMPARE = {"$gt": ">", "$gte": ">=", "$lt": "<", "$lte": "<="}
+    NEGATIVE = {"$ne": "$eq", "$nmatch": "$match"}
+
+    def __init__(self):
+        self.namespace: Dict[str, Any] = {}
+
+    def compile(self, criteria: Dict) -> Callable[[Dict], bool]:
+        if "type" not in criteria_include(criteria):
+            # Artifactory finds only files unless the query asks for a type
+            criteria = {"$and": [criteria, {"type": {"$eq": "file"}}]}
+        source = f"lambda a: {self.expression(criteria)}"
+        return eval(source, self.namespace)
+
+    def constant(self, value: Any) -> str:
+        name = f"_c{len(self.namespace)}"
+        self.namespace[name] = value
+        return name
+
+    def expression(self, criteria: Dict) -> str:
+        clauses = _split(criteria)
+        if len(clauses) != 1:
+            return self.expression({"$and": clauses})
+
+        (field, value), = clauses[0].items()
+        if field in ("$and", "$or"):
+            if not value:
+                return "True" if field == "$and" else "False"
+            value = self.merge_masks(value, "$match" if field == "$or" else "$nmatch")
+            joiner = " and " if field == "$and" else " or "
+            return "(" + joiner.join(self.expression(child) for child in value) + ")"
+        if field.startswith("$"):
+            raise AqlNotSupportedError(f"Can not check '{field}' in memory")
+
+        (op, expected), = value.items()
+        if field.startswith("@"):
+            getter = f'a["properties"].get({field[1:]!r})'
+            if op in self.NEGATIVE:
+                return f"(not {self.check(self.NEGATIVE[op], expected, getter, str)})"
+            return self.check(op, expected, getter, str)
+        if field in ("property.key", "property.value"):
+            items = 'a["properties"]' if field == "property.key" else 'a["properties"].values()'
+            if op in self.NEGATIVE:
+                check = self.check(self.NEGATIVE[op], expected, "x", str)
+                return f"(not any({check} for x in {items}))"
+            return f"any({self.check(op, expected, 'x', str)} for x in {items})"
+        if field.startswith("stat."):
+            return self.check(op, expected, f'a["stats"].get({field[len("stat."):]!r})')
+        if "." in field:
+            raise AqlNotSupportedError(f"Can not check '{field}' in memory")
+        if field == "type":
+            return self.check_type(op, expected)
+        return self.check(op, expected, f"a.get({field!r})")
+
+    def check_type(self, op: str, expected: Any) -> str:
+        """"any" is not a type of an item, but all of them. Items without a type are files"""
+        if expected == "any":
+            if op == "$eq":
+                return "True"
+            if op == "$ne":
+                return "False"
+            raise AqlNotSupportedError(f"Can not check type 'any' by '{op}' in memory")
+        return self.check(op, expected, "a.get('type', 'file')")
+
+    @staticmethod
+    def merge_masks(clauses: List[Dict], op: str) -> List[Dict]:
+        """
+        Merge masks of an item field into one clause with a list of masks, it's checked by one ``MaskMatcher``:
+        "$or" of "$match" and "$and" of "$nmatch", like ``IncludeFilename`` and ``ExcludePath`` with many masks
+        """
+        masks: Dict[str, List[str]] = {}
+        for clause in clauses:
+            field = _mask_field(clause, op)
+            if field is not None:
+                masks.setdefault(field, []).append(clause[field][op])
+
+        merged, done = [], set()
+        for clause in clauses:
+            field = _mask_field(clause, op)
+            if field is None or len(masks[field]) < 2:
+                merged.append(clause)
+            elif field not in done:
+                done.add(field)
+                merged.append({field: {op: masks[field]}})
+        return merged
+
+    def check(self, op: str, expected: Any, getter: str, cast: Optional[type] = None) -> str:
+        """The source that checks the value by ``getter`` with one operator"""
+        if expected is None:
+            if op == "$eq":
+                return f"({getter} is None)"
+            if op == "$ne":
+                return f"({getter} is not None)"
+            raise AqlNotSupportedError(f"Can not compare with null by '{op}'")
+        if cast is not None and op not in ("$match", "$nmatch"):
+            expected = cast(expected)
+
+        if op == "$eq":
+            return f"({getter} == {self.constant(expected)})"
+        if op == "$ne":
+            return f"({getter} is not None and {getter} != {self.constant(expected)})"
+        if op in self.COMPARE:
+            return f"({getter} is not None and {getter} {self.COMPARE[op]} {self.constant(expected)})"
+        if op in ("$match", "$nmatch") and isinstance(expected, list):
+            matcher = self.constant(MaskMatcher(expected))
+            result = "" if op == "$match" else "not "
+            return f"({getter} is not None and {result}{matcher}(str({getter})))"
+        if op in ("$match", "$nmatch"):
+            fullmatch = self.constant(_match_regexp(expected).fullmatch)
+            result = "is not None" if op == "$match" else "is None"
+            return f"({getter} is not None and {fullmatch}(str({getter})) {result})"
+        raise AqlNotSupportedError(f"Unknown operator '{op}'")
+
+
+def _mask_field(clause: Dict, op: str) -> Optional[str]:
+    """The item field of ``{field: {op: mask}}``, None for other clauses"""
+    if len(clause) != 1:
+        return None
+    (field, value), = clause.items()
+    if field[0] in "$@" or "." in field or not isinstance(value, dict) or len(value) != 1:
+        return None
+    if not isinstance(value.get(op), str):
+        return None
+    return field
+
+
+def compile_criteria(criteria: Dict) -> Callable[[Dict], bool]:
+    """
+    Compile AQL criteria to a predicate that checks a prepared artifact in memory, the same way Artifactory does.
+    Supports "$and", "$or" and "$eq", "$ne", "$gt", "$gte", "$lt", "$lte", "$match", "$nmatch"
+    for item fields, "stat.*", "property.key", "property.value" and "@key".
+    Masks of one item field in "$or" ("$nmatch" ones in "$and") are checked by one ``MaskMatcher``.
+    Raise AqlNotSupportedError for criteria that we can't check in memory.
+
+    >>> match = compile_criteria({"name": {"$match": "*.zip"}, "size": {"$gt": 10}})
+    >>> match({"name": "a.zip", "size": 20}), match({"name": "a.zip", "size": 5})
+    (True, False)
+    >>> match = compile_criteria({"@released": {"$ne": "true"}})
+    >>> match({"properties": {}}), match({"properties": {"released": "true"}})
+    (True, False)
+    """
+    return _PredicateCompiler().compile(criteria)
+
+
+def criteria_include(criteria: Dict) -> List[str]:
+    """
+    Fields to include to the query to check the criteria in memory
+
+    >>> criteria_include({"$or": [{"name": "a.zip"}, {"stat.downloads": {"$eq": None}}]})
+    ['name', 'stat.downloads']
+    """
+    include = []
+    for clause in _split(criteria):
+        (field, value), = clause.items()
+        if field in ("$and", "$or"):
+            for child in value:
+                include.extend(criteria_include(child))
+        elif field.startswith("property."):
+            include.append("property")
+        elif not field.startswith("$"):
+            include.append(field)
+    return list(dict.fromkeys(include))
+
+
+def project(artifact: Dict, include: Iterable[str]) -> Dict:
+    """
+    Copy of a prepared artifact with only fields that a query with that include would return,
+    so a policy never sees or changes fields that another query asked for
+
+    >>> artifact = {"name": "a", "size": 1, "properties": {"a": "1", "b": "2"}, "stats": {"downloads": 1}}
+    >>> project(artifact, ["name", "@b"])
+    {'name': 'a', 'properties': {'b': '2'}, 'stats': {}}
+    """
+    include = list(include)
+    if "*" in include:
+        projected = {key: value for key, value in artifact.items() if key not in ("properties", "stats")}
+    else:
+        projected = {field: artifact[field] for field in include if field in artifact}
+
+    properties = artifact["properties"]
+    if "property" in include:
+        projected["properties"] = dict(properties)
+    else:
+        keys = (field[1:] for field in include if field.startswith("@"))
+        projected["properties"] = {key: properties[key] for key in keys if key in properties}
+
+    stats = artifact["stats"]
+    if "stat" in include:
+        projected["stats"] = dict(stats)
+    else:
+        keys = (field[len("stat."):] for field in include if field.startswith("stat."))
+        projected["stats"] = {key: stats[key] for key in keys if key in stats}
+    return projected
+
+
+def split_repo_clause(criteria: Dict) -> Tuple[Optional[Dict], Dict]:
+    """
+    Split optimized criteria to the clause that selects repositories and the rest of criteria
+
+    >>> split_repo_clause({"$and": [{"repo": {"$eq": "a"}}, {"name": {"$match": "*.zip"}}]})
+    ({'repo': {'$eq': 'a'}}, {'name': {'$match': '*.zip'}})
+    """
+    clauses = _conjuncts(criteria)
+    for i, clause in enumerate(clauses):
+        repos, masks = get_repos(clause)
+        if repos or masks:
+            return clause, _and(clauses[:i] + clauses[i + 1:])
+    return None, criteria
@@ -1,12 +1,36 @@
-from concurrent.futures import ThreadPoolExecutor
+import json
+import signal
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
 from datetime import date
-from typing import List, Iterator, Optional
+from typing import Callable, Dict, Iterable, List, Iterator, Optional, Tuple, Union
 
 from attr import dataclass
 from requests import Session
 
+from artifactory_cleanup import aql
+from artifactory_cleanup import columnar as columnar_module
+from artifactory_cleanup.async_delete import AsyncDeleter
+from artifactory_cleanup.base_url_session import BaseUrlSession
+from artifactory_cleanup.budget import POLICY_ORDER, Budget, MixedPolicy, get_order_include, get_order_key
+from artifactory_cleanup.collapse import CheckedFolders, Delete, expand_results, list_affected, plan_deletes
+from artifactory_cleanup.concurrency import AdaptiveLimit
 from artifactory_cleanup.errors import ArtifactoryCleanupException
-from artifactory_cleanup.rules.base import ArtifactsList, CleanupPolicy, ArtifactDict
+from artifactory_cleanup.fusion import QueryFusion
+from artifactory_cleanup.mirror import Mirror
+from artifactory_cleanup.ratelimit import RateLimit, RoundRobin
+from artifactory_cleanup.rules.base import (
+    DELETED,
+    FAILED,
+    NOT_FOUND,
+    ArtifactDict,
+    ArtifactsList,
+    CleanupPolicy,
+    DeleteResult,
+)
 
 
 @dataclass
@@ -15,9 +39,37 @@ class CleanupSummary:
     artifacts_removed: int
     artifacts_size: int
     removed_artifacts: ArtifactsList
+    # The adaptive limit of concurrent deletes after the policy and how it changed during the policy
+    concurrency_limit: Optional[int] = None
+    concurrency_history: Optional[List[int]] = None
+    # Retried requests and circuit breaker trips during the policy
+    retries: int = 0
+    breaker_trips: int = 0
+    # GET requests sent twice because the first one was slow
+    hedged: int = 0
+    # Connections opened and requests sent over already opened connections during the policy
+    connections_opened: int = 0
+    connections_reused: int = 0
+    # What actually happened to artifacts: counts and size of deleted ones, not found, failed, throughput
+    deleted_count: int = 0
+    deleted_size: int = 0
+    not_found_count: int = 0
+    failed_count: int = 0
+    elapsed: float = 0.0
+    deletes_per_second: float = 0.0
+    mb_per_second: float = 0.0
+    delete_results: Optional[List[DeleteResult]] = None
+    # Stopped by SIGINT or SIGTERM before all artifacts were processed
+    interrupted: bool = False
+    # The budget that stopped the run and artifacts that were not processed because of it or SIGINT/SIGTERM
+    budget_exhausted: Optional[str] = None
+    pending_count: int = 0
 
 
 class ArtifactoryCleanup:
+    # Deletes in flight per worker, the rest of artifacts wait for their turn without a future
+    DELETE_WINDOW_PER_WORKER = 2
+
     def __init__(
         self,
         session: Session,
@@ -26,65 +78,418 @@ class ArtifactoryCleanup:
         today: date,
         ignore_not_found: bool,
         worker_count: int,
+        aql_page_size: int = 0,
+        aql_shard: bool = False,
+        aql_shard_threshold: int = 0,
+        aql_workers: int = 1,
+        aql_fuse: bool = False,
+        aql_dump: Optional[str] = None,
+        mirror: Optional[str] = None,
+        mirror_scan_days: int = 0,
+        delete_engine: str = "threads",
+        adaptive_concurrency: bool = False,
+        max_worker_count: int = 64,
+        rate_limit: Optional[RateLimit] = None,
+        collapse_folders: bool = False,
+        delete_order: Union[str, Callable[[ArtifactDict], object]] = POLICY_ORDER,
+        budget: Optional[Budget] = None,
+        columnar: bool = False,
+        aql_include: Iterable[str] = (),
     ):
         self.session = session
         self.policies = policies
         self.destroy = destroy
         self.ignore_not_found = ignore_not_found
         self.worker_count = worker_count
+        self.aql_page_size = aql_page_size
+        self.aql_shard = aql_shard
+        self.aql_shard_threshold = aql_shard_threshold
+        self.aql_workers = aql_workers
+        self.aql_fuse = aql_fuse
+        self.aql_dump = aql_dump
+        self.mirror = mirror
+        self.mirror_scan_days = mirror_scan_days
+        self.delete_engine = delete_engine
+        self.adaptive_concurrency = adaptive_concurrency
+        self.max_worker_count = max_worker_count
+        self.rate_limit = rate_limit
+        self.collapse_folders = collapse_folders
+        self.delete_order = delete_order
+        self.budget = budget or Budget()
+        self.columnar = columnar
+        # Fields that the output needs besides rules
+        self.aql_include = list(aql_include)
+        if columnar and not columnar_module.available():
+            raise ArtifactoryCleanupException(
+                "Columnar filters need numpy, install it with 'pip install artifactory-cleanup[columnar]'"
+            )
+        self._stop = threading.Event()
 
+        self.today = today
         self._init_policies(today)
 
     def _init_policies(self, today):
         for policy in self.policies:
-            policy.init(self.session, today)
+            policy.init(
+                self.session,
+                today,
+                aql_page_size=self.aql_page_size,
+                aql_shard=self.aql_shard,
+                aql_shard_threshold=self.aql_shard_threshold,
+                aql_workers=self.aql_workers,
+                aql_sort=not (self.aql_dump or self.mirror),
+                columnar=self.columnar,
+                aql_include=get_order_include(self.delete_order) + self.aql_include,
+            )
 
     def cleanup(self, block_ctx_mgr, test_ctx_mgr) -> Iterator[Optional[CleanupSummary]]:
+        # Get artifacts for all policies at once
+        source = None
+        if self.aql_fuse:
+            with block_ctx_mgr("Fuse AQL queries"):
+                source = QueryFusion(self.policies)
+        if self.mirror:
+            with block_ctx_mgr("Sync mirror"):
+                source = Mirror(self.mirror, self.session, self.today, self.mirror_scan_days)
+                source.sync_policies(self.policies)
+
+        # Dry run sends no requests, there's nothing to adapt to
+        limiter = None
+        if self.adaptive_concurrency and self.destroy:
+            limiter = AdaptiveLimit(int(self.worker_count), maximum=self.max_worker_count)
+
+        dump = None
+        if self.aql_dump:
+            with block_ctx_mgr("Load AQL dump"):
+                dump = self._load_dump()
+            print(f"Loaded {len(dump)} artifacts from {self.aql_dump}")
+
+        self.budget.start()
+        if self.delete_order == POLICY_ORDER:
+            runs = self._cleanup_by_policies(block_ctx_mgr, test_ctx_mgr, source, dump, limiter)
+        else:
+            runs = self._cleanup_by_priority(block_ctx_mgr, test_ctx_mgr, source, dump, limiter)
+        yield from runs
+
+        if isinstance(source, Mirror):
+            source.close()
+
+    def _cleanup_by_policies(self, block_ctx_mgr, test_ctx_mgr, source, dump, limiter):
+        """Delete artifacts of policies one by one"""
         for policy in self.policies:
+            stats_before = self._get_session_stats()
             with block_ctx_mgr(policy.name):
-                # Prepare
-                with block_ctx_mgr("Check"):
-                    policy.check()
+                artifacts_to_remove, deletes = self._get_artifacts_to_remove(policy, block_ctx_mgr, source, dump)
 
-                with block_ctx_mgr("AQL filter"):
-                    policy.build_aql_query()
+                # Delete artifacts
+                history_start = len(limiter.history) - 1 if limiter else 0
+                started = time.monotonic()
+                targets = [target for target, _ in deletes]
+                deleter = self._check_folders(policy, deletes)
+                with self._stop_on_signals():
+                    results = self._delete_artifacts(deleter, targets, test_ctx_mgr, limiter)
+                results = expand_results(results, deletes)
+                elapsed = time.monotonic() - started
+                self._forget_deleted(source, results)
 
-                # Get artifacts
-                with block_ctx_mgr("Get artifacts"):
-                    artifacts = policy.get_artifacts()
-                print("Found {} artifacts".format(len(artifacts)))
+            stats = self._get_session_stats(since=stats_before)
+            yield self._get_summary(policy, artifacts_to_remove, results, elapsed, stats, limiter, history_start)
+            print()
 
-                # Filter artifacts
-                with block_ctx_mgr("Filter results"):
-                    artifacts_to_remove = policy.filter(artifacts)
-                print(f"Found {len(artifacts_to_remove)} artifacts AFTER filtering")
+            if self._stop.is_set() or self.budget.exhausted:
+                print("Skip the rest of policies")
+                break
 
-                # Delete artifacts
-                def _delete(artifact):
-                    with test_ctx_mgr(get_name_for_ci(artifact)):
-                        policy.delete(artifact, destroy=self.destroy, ignore_not_found=self.ignore_not_found)
+    def _cleanup_by_priority(self, block_ctx_mgr, test_ctx_mgr, source, dump, limiter):
+        """
+        Get artifacts of all policies, then delete them in one queue in the delete order.
+        Repositories still take turns, the order works within a repository
+        """
+        mixed = MixedPolicy()
+        prepared = []
+        for policy in self.policies:
+            stats_before = self._get_session_stats()
+            with block_ctx_mgr(policy.name):
+                artifacts_to_remove, deletes = self._get_artifacts_to_remove(policy, block_ctx_mgr, source, dump)
+            mixed.add(policy, artifacts_to_remove)
+            # Folders that replace deletes of their artifacts
+            mixed.add(policy, (target for target, covered in deletes if covered[0] is not target))
+            prepared.append((policy, artifacts_to_remove, deletes, self._get_session_stats(since=stats_before)))
+            print()
 
-                with ThreadPoolExecutor(max_workers=int(self.worker_count)) as executor:
-                    for artifact in artifacts_to_remove:
-                        executor.submit(_delete, artifact=artifact)
+        all_deletes = [delete for _, _, deletes, _ in prepared for delete in deletes]
+        key = get_order_key(self.delete_order)
+        targets = sorted((target for target, _ in all_deletes), key=key)
+        stats_before = self._get_session_stats()
+        history_start = len(limiter.history) - 1 if limiter else 0
+        with block_ctx_mgr("Delete artifacts"):
+            print(f"Delete {len(targets)} artifacts of {len(prepared)} policies, {self.delete_order} first")
+            started = time.monotonic()
+            deleter = self._check_folders(mixed, all_deletes)
+            with self._stop_on_signals():
+                results = self._delete_artifacts(deleter, targets, test_ctx_mgr, limiter)
+            elapsed = time.monotonic() - started
+        self._show_session_stats(self._get_session_stats(since=stats_before))
+        print()
 
-            # Show summary
-            print(f"Deleted artifacts count: {len(artifacts_to_remove)}")
-            try:
-                artifacts_size = sum([x["size"] for x in artifacts_to_remove])
-                print("Summary size: {}".format(artifacts_size))
-                summary = CleanupSummary(
-                    policy_name=policy.name,
-                    artifacts_size=artifacts_size,
-                    artifacts_removed=len(artifacts_to_remove),
-                    removed_artifacts=artifacts_to_remove
-                )
-                yield summary
-            except KeyError:
-                print("Summary size not defined")
-                yield None
+        results = expand_results(results, all_deletes)
+        self._forget_deleted(source, results)
+        policy_results = defaultdict(list)
+        for result in results:
+            policy_results[id(mixed.get_policy(result.artifact))].append(result)
+        for policy, artifacts_to_remove, _, stats in prepared:
+            results = policy_results[id(policy)]
+            # Policies share the stage, the throughput of a policy counts until its last delete
+            policy_elapsed = get_elapsed(results, started)
+            yield self._get_summary(
+                policy, artifacts_to_remove, results, policy_elapsed, stats, limiter, history_start
+            )
             print()
 
+    @staticmethod
+    def _forget_deleted(source, results: List[DeleteResult]) -> None:
+        """The mirror doesn't get deleted artifacts from Artifactory again, it only forgets them on a full scan"""
+        if isinstance(source, Mirror):
+            source.forget(result.artifact for result in results if result.outcome in (DELETED, NOT_FOUND))
+
+    def _get_artifacts_to_remove(
+        self, policy: CleanupPolicy, block_ctx_mgr, source, dump
+    ) -> Tuple[ArtifactsList, List[Delete]]:
+        """Get and filter artifacts of the policy and plan delete requests for them"""
+        # Prepare, there's nothing to check in Artifactory if we work with a dump.
+        # Fused queries and the mirror check policies before they build queries
+        if dump is None and source is None:
+            with block_ctx_mgr("Check"):
+                policy.check()
+
+        if source is None:
+            with block_ctx_mgr("AQL filter"):
+                policy.build_aql_query()
+
+        # Get artifacts
+        with block_ctx_mgr("Get artifacts"):
+            if dump is not None:
+                artifacts = policy.get_artifacts_from(dump)
+            elif source is not None:
+                artifacts = source.get_artifacts(policy)
+            else:
+                artifacts = policy.get_artifacts()
+        print("Found {} artifacts".format(len(artifacts)))
+
+        # Filter artifacts
+        with block_ctx_mgr("Filter results"):
+            artifacts_to_remove = policy.filter(artifacts)
+        print(f"Found {len(artifacts_to_remove)} artifacts AFTER filtering")
+
+        # Plan folder deletes
+        if self.collapse_folders and artifacts_to_remove:
+            with block_ctx_mgr("Plan folder deletes"):
+                return artifacts_to_remove, self._plan_deletes(artifacts_to_remove)
+        return artifacts_to_remove, [(artifact, [artifact]) for artifact in artifacts_to_remove]
+
+    def _get_summary(
+        self,
+        policy: CleanupPolicy,
+        artifacts_to_remove: ArtifactsList,
+        results: List[DeleteResult],
+        elapsed: float,
+        stats: Dict[str, int],
+        limiter: Optional[AdaptiveLimit],
+        history_start: int,
+    ) -> Optional[CleanupSummary]:
+        """Show the summary of the policy"""
+        interrupted = self._stop.is_set()
+        pending = len(artifacts_to_remove) - len(results)
+        if interrupted:
+            print(f"Interrupted, {pending} artifacts were not processed")
+        elif self.budget.exhausted and pending:
+            print(f"Budget '{self.budget.exhausted}' is exhausted, {pending} artifacts are pending")
+        print(f"Deleted artifacts count: {len(artifacts_to_remove)}")
+        delete_stats = get_delete_stats(results, elapsed)
+        if self.destroy:
+            print(
+                "Actually deleted {deleted_count} artifacts ({deleted_size} bytes), "
+                "not found: {not_found_count}, failed: {failed_count}, "
+                "{deletes_per_second:.1f} deletes/s, {mb_per_second:.2f} MB/s".format(**delete_stats)
+            )
+        concurrency_history = None
+        if limiter:
+            concurrency_history = limiter.history[history_start:]
+            print(f"Delete concurrency limit: {' -> '.join(map(str, concurrency_history))}")
+        self._show_session_stats(stats)
+        try:
+            artifacts_size = sum([x["size"] for x in artifacts_to_remove])
+            print("Summary size: {}".format(artifacts_size))
+            return CleanupSummary(
+                policy_name=policy.name,
+                artifacts_size=artifacts_size,
+                artifacts_removed=len(artifacts_to_remove),
+                removed_artifacts=artifacts_to_remove,
+                concurrency_limit=limiter.limit if limiter else None,
+                concurrency_history=concurrency_history,
+                retries=stats["retries"],
+                breaker_trips=stats["breaker_trips"],
+                hedged=stats["hedged"],
+                connections_opened=stats["connections_opened"],
+                connections_reused=stats["connections_reused"],
+                delete_results=results,
+                interrupted=interrupted,
+                budget_exhausted=self.budget.exhausted,
+                pending_count=pending,
+                **delete_stats,
+            )
+        except KeyError:
+            print("Summary size not defined")
+            return None
+
+    def _delete_artifacts(
+        self,
+        policy: Union[CleanupPolicy, MixedPolicy, CheckedFolders],
+        artifacts: ArtifactsList,
+        test_ctx_mgr,
+        limiter: Optional[AdaptiveLimit],
+    ) -> List[DeleteResult]:
+        """Delete artifacts with the chosen engine and get the result for every one of them"""
+        if self.delete_engine == "asyncio":
+            deleter = AsyncDeleter(
+                self.session,
+                int(self.worker_count),
+                self.ignore_not_found,
+                limiter=limiter,
+                rate_limit=self.rate_limit,
+            )
+            return deleter.delete(
+                policy,
+                artifacts,
+                destroy=self.destroy,
+                test_ctx_mgr=lambda artifact: test_ctx_mgr(get_name_for_ci(artifact)),
+                stop=self._stop,
+                budget=self.budget,
+            )
+
+        def _delete(artifact) -> DeleteResult:
+            started = time.monotonic()
+            try:
+                with test_ctx_mgr(get_name_for_ci(artifact)):
+                    if limiter is None:
+                        outcome = policy.delete(artifact, destroy=self.destroy, ignore_not_found=self.ignore_not_found)
+                    else:
+                        # Every attempt of the delete reports its latency and status, backoff between them doesn't
+                        with limiter.slot(), self.session.observe_deletes(limiter.on_response):
+                            outcome = policy.delete(
+                                artifact, destroy=self.destroy, ignore_not_found=self.ignore_not_found
+                            )
+            except Exception as exc:
+                print(f"ERROR - {exc}")
+                finished = time.monotonic()
+                return DeleteResult(artifact, FAILED, finished - started, str(exc), finished)
+            finished = time.monotonic()
+            return DeleteResult(artifact, outcome, finished - started, finished=finished)
+
+        max_workers = limiter.maximum if limiter else int(self.worker_count)
+        window = max_workers * self.DELETE_WINDOW_PER_WORKER
+        # Repositories take turns, so one of them doesn't get all workers
+        queue = RoundRobin(artifacts, self.rate_limit) if self.destroy else artifacts
+        results = []
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            in_flight = set()
+            for artifact in queue:
+                if self._stop.is_set() or not self.budget.take(artifact):
+                    break
+                if len(in_flight) >= window:
+                    done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                    results.extend(future.result() for future in done)
+                in_flight.add(executor.submit(_delete, artifact=artifact))
+            results.extend(future.result() for future in wait(in_flight).done)
+        return results
+
+    def _plan_deletes(self, artifacts: ArtifactsList) -> List[Delete]:
+        """Replace deletes of all artifacts in a folder with one delete of the folder"""
+        by_repo = defaultdict(list)
+        for artifact in artifacts:
+            by_repo[artifact["repo"]].append(artifact)
+        listing = ArtifactsList()
+        for repo in sorted(by_repo):
+            listing.extend(list_affected(self.session, repo, by_repo[repo]))
+        deletes = plan_deletes(artifacts, listing)
+        for target, covered in deletes:
+            if covered[0] is not target:
+                path = CleanupPolicy.get_artifact_path(target)
+                print(f"Delete folder '{path}' instead of {len(covered)} artifacts")
+        print(f"{len(deletes)} delete requests for {len(artifacts)} artifacts")
+        return deletes
+
+    def _check_folders(self, policy, deletes: List[Delete]):
+        """Make sure nothing was uploaded into collapsed folders before deleting them"""
+        return CheckedFolders(policy, self.session, deletes) if self.collapse_folders else policy
+
+    @contextmanager
+    def _stop_on_signals(self):
+        """
+        The first SIGINT or SIGTERM stops sending new deletes, we wait for deletes in flight and show the summary.
+        The second one interrupts at once
+        """
+        if threading.current_thread() is not threading.main_thread():
+            yield
+            return
+
+        def handler(signum, frame):
+            if self._stop.is_set():
+                raise KeyboardInterrupt
+            print(f"Got {signal.Signals(signum).name}, wait for deletes in flight. Send it again to interrupt at once")
+            self._stop.set()
+
+        previous = {signum: signal.signal(signum, handler) for signum in (signal.SIGINT, signal.SIGTERM)}
+        try:
+            yield
+        finally:
+            for signum, previous_handler in previous.items():
+                signal.signal(signum, previous_handler)
+
+    def _get_session_stats(self, since: Optional[Dict[str, int]] = None) -> Dict[str, int]:
+        """Session counters, or how they changed ``since`` the previous ones"""
+        if isinstance(self.session, BaseUrlSession):
+            connections = self.session.connection_stats()
+            stats = {
+                **self.session.stats(),
+                "connections_opened": connections["opened"],
+                "connections_reused": connections["reused"],
+            }
+        else:
+            stats = {"retries": 0, "breaker_trips": 0, "hedged": 0, "connections_opened": 0, "connections_reused": 0}
+        if since is None:
+            return stats
+
+        return {key: value - since[key] for key, value in stats.items()}
+
+    @staticmethod
+    def _show_session_stats(stats: Dict[str, int]) -> None:
+        if stats["retries"] or stats["breaker_trips"]:
+            print(f"Retries: {stats['retries']}, circuit breaker trips: {stats['breaker_trips']}")
+        if stats["hedged"]:
+            print(f"Hedged GET requests: {stats['hedged']}")
+        if stats["connections_opened"]:
+            print(f"Connections: {stats['connections_opened']} opened, {stats['connections_reused']} reused")
+
+    def _load_dump(self) -> ArtifactsList:
+        """
+        Read a saved AQL response, like the result of ``items.find(...).include("*", "property", "stat")``
+        """
+        with open(self.aql_dump, "rb") as fp:
+            chunks = iter(lambda: fp.read(CleanupPolicy.AQL_CHUNK_SIZE), b"")
+            return ArtifactsList.from_response(aql.iter_results(chunks, compact=True))
+
+    def explain(self, block_ctx_mgr) -> None:
+        """
+        Show optimized AQL queries of policies without calling Artifactory
+        """
+        for policy in self.policies:
+            with block_ctx_mgr(policy.name):
+                policy.build_aql_query()
+                print("Optimized AQL filters:")
+                print(json.dumps(policy.aql_find_filters, indent=2))
+                print()
+
     def only(self, policy_name: str):
         """
         Run only one or few the closest policies to the provided name
@@ -97,6 +502,40 @@ class ArtifactoryCleanup:
         self.policies = policies
 
 
+def get_delete_stats(results: List[DeleteResult], elapsed: float) -> Dict:
+    """
+    Counts, size and throughput of actually deleted artifacts
+
+    >>> artifact = {"size": 1024 * 1024}
+    >>> results = [DeleteResult(artifact, DELETED, 0.1), DeleteResult(artifact, FAILED, 0.1, "503")]
+    >>> stats = get_delete_stats(results, elapsed=0.5)
+    >>> stats["deleted_count"], stats["failed_count"], stats["deletes_per_second"], stats["mb_per_second"]
+    (1, 1, 2.0, 2.0)
+    """
+    deleted = [result.artifact for result in results if result.outcome == DELETED]
+    deleted_size = sum(artifact.get("size", 0) or 0 for artifact in deleted)
+    return {
+        "deleted_count": len(deleted),
+        "deleted_size": deleted_size,
+        "not_found_count": sum(1 for result in results if result.outcome == NOT_FOUND),
+        "failed_count": sum(1 for result in results if result.outcome == FAILED),
+        "elapsed": elapsed,
+        "deletes_per_second": len(deleted) / elapsed if elapsed else 0.0,
+        "mb_per_second": deleted_size / 1024 / 1024 / elapsed if elapsed else 0.0,
+    }
+
+
+def get_elapsed(results: List[DeleteResult], started: float) -> float:
+    """
+    Seconds from ``started`` to the last delete of the results
+
+    >>> get_elapsed([DeleteResult({}, DELETED, 0.1, finished=12.5), DeleteResult({}, DELETED, 0.1, finished=11.0)], 10)
+    2.5
+    """
+    finished = [result.finished for result in results if result.finished is not None]
+    return max(finished) - started if finished else 0.0
+
+
 def get_name_for_ci(artifact: ArtifactDict) -> str:
     return "cleanup.{}.{}_{}".format(
         escape(artifact["repo"]),
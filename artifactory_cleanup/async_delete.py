@@ -0,0 +1,229 @@
+"""
+Delete artifacts with asyncio: thousands of DELETE requests from one thread over a few keep-alive connections.
+Deletes are retried and paused by the circuit breaker of the session, like deletes of the threads engine.
+Needs aiohttp, install it with ``pip install artifactory-cleanup[async]``
+"""
+import asyncio
+import ssl
+import threading
+import time
+from typing import Callable, ContextManager, Iterable, List, Optional, Tuple
+
+from artifactory_cleanup.base_url_session import BaseUrlSession, RetryPolicy
+from artifactory_cleanup.budget import Budget
+from artifactory_cleanup.concurrency import AdaptiveLimit
+from artifactory_cleanup.errors import ArtifactoryCleanupException
+from artifactory_cleanup.ratelimit import RateLimit, RoundRobin
+from artifactory_cleanup.rules.base import (
+    DELETED,
+    DRY_RUN,
+    FAILED,
+    NOT_FOUND,
+    ArtifactDict,
+    CleanupPolicy,
+    DeleteResult,
+)
+
+try:
+    import aiohttp
+except ImportError:  # pragma: no cover
+    aiohttp = None
+
+
+class AsyncDeleter:
+    """
+    Delete artifacts of a policy concurrently, at most ``concurrency`` requests at once.
+    Uses the URL, auth, headers and SSL verification of the ``requests`` session.
+
+    ``concurrency`` workers take artifacts one by one, so we don't keep a task per artifact in memory.
+    With ``limiter`` there are as many workers as its maximum, but only ``limiter.limit`` of them send requests
+    """
+
+    def __init__(
+        self,
+        session: BaseUrlSession,
+        concurrency: int,
+        ignore_not_found: bool,
+        limiter: Optional[AdaptiveLimit] = None,
+        rate_limit: Optional[RateLimit] = None,
+    ):
+        self.session = session
+        self.concurrency = limiter.maximum if limiter else concurrency
+        self.ignore_not_found = ignore_not_found
+        self.limiter = limiter
+        self.rate_limit = rate_limit
+        self._in_flight = 0
+        self._condition: Optional[asyncio.Condition] = None
+        self._stop = threading.Event()
+        self._budget = Budget()
+
+    def delete(
+        self,
+        policy: CleanupPolicy,
+        artifacts: Iterable[ArtifactDict],
+        destroy: bool,
+        test_ctx_mgr: Callable[[ArtifactDict], ContextManager],
+        stop: Optional[threading.Event] = None,
+        budget: Optional[Budget] = None,
+    ) -> List[DeleteResult]:
+        """
+        Delete artifacts and get the result for every one of them.
+        Workers don't take new artifacts after ``stop`` is set or ``budget`` is exhausted, artifacts left have no results
+        """
+        self._stop = stop or threading.Event()
+        self._budget = budget or Budget()
+        if destroy and aiohttp is None:
+            raise ArtifactoryCleanupException(
+                "asyncio delete engine needs aiohttp, install it with 'pip install artifactory-cleanup[async]'"
+            )
+        return asyncio.run(self._delete_all(policy, artifacts, destroy, test_ctx_mgr))
+
+    async def _delete_all(self, policy, artifacts, destroy, test_ctx_mgr) -> List[DeleteResult]:
+        results = []
+        if not destroy:
+            # Nothing to wait for, keep the same output as the threads engine
+            for artifact in artifacts:
+                if self._stop.is_set() or not self._budget.take(artifact):
+                    break
+                with test_ctx_mgr(artifact):
+                    policy.log_delete(artifact, destroy=False)
+                results.append(DeleteResult(artifact, DRY_RUN, 0.0, finished=time.monotonic()))
+            return results
+
+        self._condition = asyncio.Condition()
+        connector = aiohttp.TCPConnector(limit=self.concurrency, ssl=self._get_ssl())
+        async with aiohttp.ClientSession(
+            connector=connector,
+            headers=dict(self.session.headers),
+            auth=self._get_auth(),
+            timeout=self._get_timeout(),
+        ) as client:
+            queue = RoundRobin(artifacts, self.rate_limit)
+            workers = [
+                self._worker(client, queue, policy, test_ctx_mgr, results) for _ in range(self.concurrency)
+            ]
+            await asyncio.gather(*workers)
+        return results
+
+    def _get_ssl(self):
+        verify = self.session.verify
+        if isinstance(verify, str):
+            return ssl.create_default_context(cafile=verify)
+        return None if verify else False
+
+    def _get_timeout(self):
+        timeouts = getattr(self.session, "timeouts", None)
+        if timeouts is None:
+            # Requests wait forever without a timeout, so do we
+            return aiohttp.ClientTimeout(total=None)
+        connect, read = timeouts.delete
+        return aiohttp.ClientTimeout(total=None, sock_connect=connect, sock_read=read)
+
+    def _get_auth(self):
+        auth = self.session.auth
+        if auth is None:
+            return None
+        return aiohttp.BasicAuth(auth.username, auth.password)
+
+    async def _worker(self, client, queue, policy, test_ctx_mgr, results: List[DeleteResult]) -> None:
+        while not self._stop.is_set():
+            artifact, wait = queue.poll()
+            if artifact is None:
+                if not wait:
+                    return
+                await asyncio.sleep(wait)
+                continue
+            if not self._budget.take(artifact):
+                return
+            started = time.monotonic()
+            try:
+                if self.limiter is None:
+                    outcome = await self._delete(client, policy, artifact, test_ctx_mgr)
+                else:
+                    outcome = await self._delete_limited(client, policy, artifact, test_ctx_mgr)
+            except Exception as exc:
+                # A failed delete doesn't stop others
+                print(f"ERROR - {exc}")
+                finished = time.monotonic()
+                results.append(DeleteResult(artifact, FAILED, finished - started, str(exc), finished))
+            else:
+                finished = time.monotonic()
+                results.append(DeleteResult(artifact, outcome, finished - started, finished=finished))
+
+    async def _delete_limited(self, client, policy, artifact, test_ctx_mgr) -> str:
+        async with self._condition:
+            await self._condition.wait_for(lambda: self._in_flight < self.limiter.limit)
+            self._in_flight += 1
+
+        try:
+            # Every attempt reports its latency and status to the limiter
+            return await self._delete(client, policy, artifact, test_ctx_mgr)
+        finally:
+            async with self._condition:
+                self._in_flight -= 1
+                self._condition.notify_all()
+
+    async def _delete(self, client, policy, artifact, test_ctx_mgr) -> str:
+        with test_ctx_mgr(artifact):
+            # log_delete may list the folder again with a blocking AQL query, see CheckedFolders
+            loop = asyncio.get_running_loop()
+            artifact_path = await loop.run_in_executor(None, policy.log_delete, artifact, True)
+            r, attempts = await self._send_delete(client, self.session.base_url + artifact_path)
+            if r.status == 404 and attempts > 1:
+                print(f"DELETED - '{artifact_path}' was deleted by a previous attempt that didn't get the response.")
+                return DELETED
+            if r.status == 404 and self.ignore_not_found:
+                print(f"NOT FOUND - '{artifact_path}' was not found, so not deleted.")
+                return NOT_FOUND
+            r.raise_for_status()
+            return DELETED
+
+    async def _send_delete(self, client, url: str) -> Tuple["aiohttp.ClientResponse", int]:
+        """
+        Send DELETE with the retry policy and the circuit breaker of the session, like BaseUrlSession does.
+        Return the last response and the number of attempts
+        """
+        retry, breaker = self.session.retry, self.session.breaker
+        retries = retry.retries if retry else 0
+        statuses = retry.statuses if retry else RetryPolicy().statuses
+        attempt = 0
+        while True:
+            if breaker:
+                # Don't block the event loop, other workers wait for the breaker too
+                while breaker.delay() > 0:
+                    await asyncio.sleep(breaker.delay())
+
+            response = None
+            started = time.monotonic()
+            try:
+                async with client.delete(url) as response:
+                    pass
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                self._on_attempt(started, None)
+                if breaker:
+                    breaker.on_failure()
+                if attempt >= retries:
+                    raise
+            except Exception:
+                self._on_attempt(started, None)
+                raise
+            else:
+                self._on_attempt(started, response.status)
+                if response.status not in statuses:
+                    if breaker:
+                        breaker.on_success()
+                    return response, attempt + 1
+                if breaker:
+                    breaker.on_failure()
+                if attempt >= retries:
+                    return response, attempt + 1
+
+            delay = retry.delay(attempt, response)
+            self.session.count_retry("DELETE", url, delay, attempt, retries)
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    def _on_attempt(self, started: float, status: Optional[int]) -> None:
+        """Only the time of the request, not backoff between attempts, is the latency of Artifactory"""
+        if self.limiter is not None:
+            self.limiter.on_response(time.monotonic() - started, status)
@@ -1,6 +1,202 @@
+import random
+import socket
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+from typing import Callable, Dict, Iterator, Optional, Tuple
 from urllib.parse import urljoin
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection
+
+from artifactory_cleanup.concurrency import percentile
+
+# Methods that we can send again without side effects, see RFC 9110
+IDEMPOTENT_METHODS = ("GET", "HEAD", "OPTIONS", "PUT", "DELETE")
+# AQL is a read-only query, even if it's a POST
+RETRY_POST_PATHS = ("api/search/aql",)
+
+
+class RetryPolicy:
+    """
+    Retry failed requests with exponential backoff and full jitter, or after ``Retry-After`` if Artifactory asks
+    """
+
+    def __init__(
+        self,
+        retries: int = 3,
+        backoff: float = 0.5,
+        max_backoff: float = 30,
+        statuses=(429, 500, 502, 503, 504),
+    ):
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.statuses = statuses
+
+    def delay(self, attempt: int, response: Optional[requests.Response]) -> float:
+        """Seconds to wait before the next attempt, attempts start from 0"""
+        retry_after = response.headers.get("Retry-After") if response is not None else None
+        if retry_after:
+            delay = parse_retry_after(retry_after)
+            if delay is not None:
+                return min(delay, self.max_backoff)
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+
+def parse_retry_after(value: str) -> Optional[float]:
+    """
+    Retry-After is seconds or an HTTP date
+
+    >>> parse_retry_after("120")
+    120.0
+    >>> parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT") == 0
+    True
+    """
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        date = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, date.timestamp() - time.time())
+
+
+class CircuitBreaker:
+    """
+    Stop sending requests for ``cooldown`` seconds after ``threshold`` failures in a row,
+    so all workers pause while Artifactory is degraded.
+    After the pause the first failure opens the breaker again, the first success closes it.
+    """
+
+    def __init__(self, threshold: int = 10, cooldown: float = 30):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.trips = 0
+        self._failures = 0
+        self._open_until = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self) -> None:
+        """Block while the breaker is open"""
+        while True:
+            delay = self.delay()
+            if delay <= 0:
+                return
+            time.sleep(delay)
+
+    def delay(self) -> float:
+        """Seconds until the breaker closes, 0 if it's closed"""
+        with self._lock:
+            return max(0.0, self._open_until - time.monotonic())
+
+    def on_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+
+    def on_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self._failures < self.threshold or self._open_until > time.monotonic():
+                return
+            self.trips += 1
+            self._open_until = time.monotonic() + self.cooldown
+            # Half-open after the pause: one more failure opens it again
+            self._failures = self.threshold - 1
+        print(f"Artifactory is degraded, pause all requests for {self.cooldown} seconds")
+
+
+class Timeouts:
+    """
+    Connect and read timeouts in seconds for AQL queries, deletes and other API calls (storage, docker, repositories).
+    None waits forever. A timeout passed to the request explicitly wins
+
+    >>> timeouts = Timeouts(aql=(5, 600), api=(5, 30), delete=(5, 60))
+    >>> timeouts.get("POST", "http://example.com/artifactory/api/search/aql")
+    (5, 600)
+    >>> timeouts.get("DELETE", "http://example.com/artifactory/repo/file.zip")
+    (5, 60)
+    >>> timeouts.get("GET", "http://example.com/artifactory/api/storage/repo")
+    (5, 30)
+    """
+
+    def __init__(
+        self,
+        aql: Tuple[Optional[float], Optional[float]] = (10, 600),
+        api: Tuple[Optional[float], Optional[float]] = (10, 60),
+        delete: Tuple[Optional[float], Optional[float]] = (10, 60),
+    ):
+        self.aql = aql
+        self.api = api
+        self.delete = delete
+
+    def get(self, method: str, url: str) -> Tuple[Optional[float], Optional[float]]:
+        method = method.upper()
+        if method == "DELETE":
+            return self.delete
+        if method == "POST" and url.rstrip("/").endswith(RETRY_POST_PATHS):
+            return self.aql
+        return self.api
+
+
+class HedgePolicy:
+    """
+    Send a second GET if the first one is slower than ``percent`` percentile of the last ``window`` GETs.
+    Another node of an HA cluster often answers before a stuck one, so it cuts tail latency.
+    Hedging starts after ``min_samples`` GETs, before that we don't know what slow is
+    """
+
+    def __init__(self, percent: float = 95, min_samples: int = 20, window: int = 1000):
+        self.percent = percent
+        self.min_samples = min_samples
+        self._latencies = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, latency: float) -> None:
+        with self._lock:
+            self._latencies.append(latency)
+
+    def threshold(self) -> Optional[float]:
+        """Seconds to wait for the first request before the second one, None - don't hedge yet"""
+        with self._lock:
+            if len(self._latencies) < self.min_samples:
+                return None
+            return percentile(list(self._latencies), self.percent)
+
+
+class PoolAdapter(HTTPAdapter):
+    """
+    Keep up to ``pool_size`` connections per host, so every worker reuses its keep-alive connection
+    and TLS session instead of a new handshake per request.
+    With ``keepalive`` idle connections send TCP keep-alive probes after that many seconds,
+    so load balancers don't drop them between policies
+    """
+
+    __attrs__ = HTTPAdapter.__attrs__ + ["keepalive"]
+
+    def __init__(self, pool_size: int, keepalive: Optional[int] = None, **kwargs):
+        self.keepalive = keepalive
+        super().__init__(pool_maxsize=pool_size, **kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        if self.keepalive:
+            kwargs["socket_options"] = HTTPConnection.default_socket_options + get_keepalive_options(self.keepalive)
+        super().init_poolmanager(*args, **kwargs)
+
+
+def get_keepalive_options(idle: int):
+    """Socket options for TCP keep-alive probes, the timing ones are not available everywhere"""
+    options = [(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)]
+    for name, value in (("TCP_KEEPIDLE", idle), ("TCP_KEEPINTVL", idle), ("TCP_KEEPCNT", 3)):
+        if hasattr(socket, name):
+            options.append((socket.IPPROTO_TCP, getattr(socket, name), value))
+    return options
 
 
 class BaseUrlSession(requests.Session):
@@ -8,15 +204,182 @@ class BaseUrlSession(requests.Session):
     Perform all queries based on the base URL
 
     If base url is "http://example.com/" then session.get("/api/version/") queries "http://example.com/api/version/"
+
+    With ``retry`` the session sends idempotent requests and AQL queries again on connection errors
+    and on statuses from ``retry.statuses``. ``breaker`` pauses all requests if they fail one after another.
+    ``pool_size`` and ``keepalive`` configure connections, see ``PoolAdapter``.
+    ``timeouts`` limit requests without an explicit timeout, ``hedge`` sends slow GETs twice.
     """
 
-    def __init__(self, base_url=None):
+    def __init__(
+        self,
+        base_url=None,
+        retry: Optional[RetryPolicy] = None,
+        breaker: Optional[CircuitBreaker] = None,
+        pool_size: Optional[int] = None,
+        keepalive: Optional[int] = None,
+        timeouts: Optional[Timeouts] = None,
+        hedge: Optional[HedgePolicy] = None,
+    ):
         super(BaseUrlSession, self).__init__()
         self.base_url = base_url.rstrip("/") + "/"
+        self.retry = retry
+        self.breaker = breaker
+        if pool_size or keepalive:
+            adapter = PoolAdapter(pool_size or requests.adapters.DEFAULT_POOLSIZE, keepalive)
+            self.mount("https://", adapter)
+            self.mount("http://", adapter)
+        self.timeouts = timeouts
+        self.hedge = hedge
+        self.retries = 0
+        self.hedged = 0
+        self._stats_lock = threading.Lock()
+        self._delete_observers = threading.local()
+        self._hedge_executor = None
+        if hedge:
+            # Every request of the pool and its hedge
+            max_workers = 2 * (pool_size or requests.adapters.DEFAULT_POOLSIZE)
+            self._hedge_executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="hedge")
+
+    def stats(self) -> Dict[str, int]:
+        """Retries and circuit breaker trips since the session start"""
+        return {
+            "retries": self.retries,
+            "breaker_trips": self.breaker.trips if self.breaker else 0,
+            "hedged": self.hedged,
+        }
+
+    def connection_stats(self) -> Dict[str, int]:
+        """Connections opened and requests sent over already opened ones since the session start"""
+        opened = sent = 0
+        for adapter in set(self.adapters.values()):
+            pools = getattr(getattr(adapter, "poolmanager", None), "pools", None)
+            if pools is None:
+                continue
+            for key in pools.keys():
+                pool = pools.get(key)
+                if pool is not None:
+                    opened += pool.num_connections
+                    sent += pool.num_requests
+        return {"opened": opened, "reused": max(0, sent - opened)}
 
     def request(self, method, url, *args, **kwargs):
         if not url.startswith("http://") or url.startswith("https://"):
             url = url.lstrip("/")
             url = urljoin(self.base_url, url)
+        if self.timeouts is not None and kwargs.get("timeout") is None:
+            kwargs["timeout"] = self.timeouts.get(method, url)
+
+        if self.retry is None and self.breaker is None:
+            return self._send(method, url, *args, **kwargs)
+        return self._request_with_retries(method, url, *args, **kwargs)
+
+    @contextmanager
+    def observe_deletes(self, callback: Callable[[float, Optional[int]], None]) -> Iterator[None]:
+        """
+        Call ``callback(latency, status)`` after every attempt of a DELETE that this thread sends in the block.
+        The latency is the time of the attempt only, without backoff between retries. The status is None without
+        a response
+        """
+        self._delete_observers.callback = callback
+        try:
+            yield
+        finally:
+            self._delete_observers.callback = None
+
+    def _send(self, method, url, *args, **kwargs):
+        callback = getattr(self._delete_observers, "callback", None)
+        if callback is None or method.upper() != "DELETE":
+            return self._send_attempt(method, url, *args, **kwargs)
+        started = time.monotonic()
+        try:
+            response = self._send_attempt(method, url, *args, **kwargs)
+        except requests.RequestException:
+            callback(time.monotonic() - started, None)
+            raise
+        callback(time.monotonic() - started, response.status_code)
+        return response
+
+    def _send_attempt(self, method, url, *args, **kwargs):
+        if self.hedge is None or method.upper() != "GET" or kwargs.get("stream"):
+            return super(BaseUrlSession, self).request(method, url, *args, **kwargs)
+
+        def send(sending=None):
+            if sending is not None:
+                sending.set()
+            started = time.monotonic()
+            response = super(BaseUrlSession, self).request(method, url, *args, **kwargs)
+            self.hedge.record(time.monotonic() - started)
+            return response
+
+        threshold = self.hedge.threshold()
+        sending = threading.Event()
+        first = self._hedge_executor.submit(send, sending)
+        # Time in the executor queue is not the latency of the node
+        sending.wait()
+        if threshold is None or wait([first], timeout=threshold).done:
+            return first.result()
+
+        with self._stats_lock:
+            self.hedged += 1
+        second = self._hedge_executor.submit(send)
+        done, _ = wait([first, second], return_when=FIRST_COMPLETED)
+        winner = first if first in done else second
+        loser = second if winner is first else first
+        if winner.exception() is not None:
+            return loser.result()
+        loser.add_done_callback(_close_response)
+        return winner.result()
+
+    def _is_retryable(self, method: str, url: str) -> bool:
+        method = method.upper()
+        if method in IDEMPOTENT_METHODS:
+            return True
+        return method == "POST" and url.rstrip("/").endswith(RETRY_POST_PATHS)
+
+    def _request_with_retries(self, method, url, *args, **kwargs):
+        retries = self.retry.retries if self.retry and self._is_retryable(method, url) else 0
+        statuses = self.retry.statuses if self.retry else (429, 500, 502, 503, 504)
+        attempt = 0
+        while True:
+            if self.breaker:
+                self.breaker.wait()
+
+            response = None
+            try:
+                response = self._send(method, url, *args, **kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                if self.breaker:
+                    self.breaker.on_failure()
+                if attempt >= retries:
+                    raise
+            else:
+                if response.status_code not in statuses:
+                    if self.breaker:
+                        self.breaker.on_success()
+                    # A retried DELETE may get 404 because the previous attempt did delete the artifact
+                    response.attempts = attempt + 1
+                    return response
+                if self.breaker:
+                    self.breaker.on_failure()
+                if attempt >= retries:
+                    return response
+
+            delay = self.retry.delay(attempt, response)
+            if response is not None:
+                response.close()
+            self.count_retry(method, url, delay, attempt, retries)
+            time.sleep(delay)
+            attempt += 1
+
+    def count_retry(self, method: str, url: str, delay: float, attempt: int, retries: int) -> None:
+        """Count a retry in stats, for requests sent by other clients too"""
+        with self._stats_lock:
+            self.retries += 1
+        print(f"Retry {method} {url} in {delay:.1f}s, attempt {attempt + 1} of {retries}")
+
 
-        return super(BaseUrlSession, self).request(method, url, *args, **kwargs)
+def _close_response(future) -> None:
+    """Give the connection of the slower hedged request back to the pool"""
+    if future.exception() is None:
+        future.result().close()
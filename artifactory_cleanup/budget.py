@@ -0,0 +1,123 @@
+"""
+Budgets of a run - time, deletes and bytes - and the order of deletes across all policies,
+so the run reclaims the most space it can before a budget runs out
+"""
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Union
+
+from artifactory_cleanup.rules.base import ArtifactDict, CleanupPolicy
+
+# Delete artifacts policy by policy, in the order policies go in the config
+POLICY_ORDER = "policy"
+
+DELETE_ORDERS: Dict[str, Callable[[ArtifactDict], object]] = {
+    "largest": lambda artifact: -(artifact.get("size") or 0),
+    "oldest": lambda artifact: artifact.get("created") or "",
+}
+
+
+# Fields that AQL queries must include for the delete order
+DELETE_ORDER_INCLUDE: Dict[str, List[str]] = {
+    "largest": ["size"],
+    "oldest": ["created"],
+}
+
+
+def get_order_include(order: Union[str, Callable[[ArtifactDict], object]]) -> List[str]:
+    """
+    Fields to include to AQL queries for the delete order, a custom key gets what policies include
+
+    >>> get_order_include("oldest"), get_order_include(POLICY_ORDER)
+    (['created'], [])
+    """
+    if callable(order):
+        return []
+    return list(DELETE_ORDER_INCLUDE.get(order, ()))
+
+
+def get_order_key(order: Union[str, Callable[[ArtifactDict], object]]) -> Callable[[ArtifactDict], object]:
+    """
+    The sort key for the delete order: a name from ``DELETE_ORDERS`` or a custom key
+
+    >>> artifacts = [{"size": 1, "created": "2022"}, {"size": 3, "created": "2023"}, {"size": 2, "created": "2021"}]
+    >>> [x["size"] for x in sorted(artifacts, key=get_order_key("largest"))]
+    [3, 2, 1]
+    >>> [x["size"] for x in sorted(artifacts, key=get_order_key("oldest"))]
+    [2, 1, 3]
+    """
+    if callable(order):
+        return order
+    return DELETE_ORDERS[order]
+
+
+class Budget:
+    """
+    Limits of the delete stage. Every delete takes its share, the first delete that doesn't fit stops the run.
+    None - no limit
+    """
+
+    def __init__(
+        self,
+        max_duration: Optional[float] = None,
+        max_deletes: Optional[int] = None,
+        max_bytes: Optional[int] = None,
+    ):
+        self.max_duration = max_duration
+        self.max_deletes = max_deletes
+        self.max_bytes = max_bytes
+        self.deletes = 0
+        self.bytes = 0
+        # Which limit stopped the run
+        self.exhausted: Optional[str] = None
+        self._deadline: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def __bool__(self):
+        return any(limit is not None for limit in (self.max_duration, self.max_deletes, self.max_bytes))
+
+    def start(self) -> None:
+        """The time budget starts now"""
+        if self.max_duration is not None:
+            self._deadline = time.monotonic() + self.max_duration
+
+    def take(self, artifact: ArtifactDict) -> bool:
+        """Take the budget for the delete, False if it doesn't fit anymore"""
+        size = artifact.get("size") or 0
+        with self._lock:
+            if self.exhausted:
+                return False
+            if self._deadline is not None and time.monotonic() >= self._deadline:
+                self.exhausted = "max duration"
+            elif self.max_deletes is not None and self.deletes >= self.max_deletes:
+                self.exhausted = "max deletes"
+            elif self.max_bytes is not None and self.bytes + size > self.max_bytes:
+                self.exhausted = "max bytes"
+            if self.exhausted:
+                return False
+            self.deletes += 1
+            self.bytes += size
+            return True
+
+
+class MixedPolicy:
+    """
+    Deletes artifacts of several policies in one queue, every artifact with the policy that found it.
+    It quacks like a policy for delete engines
+    """
+
+    def __init__(self):
+        self._policies: Dict[int, CleanupPolicy] = {}
+
+    def add(self, policy: CleanupPolicy, artifacts: Iterable[ArtifactDict]) -> None:
+        for artifact in artifacts:
+            self._policies[id(artifact)] = policy
+
+    def get_policy(self, artifact: ArtifactDict) -> CleanupPolicy:
+        return self._policies[id(artifact)]
+
+    def delete(self, artifact: ArtifactDict, destroy: bool, ignore_not_found: bool = False):
+        return self.get_policy(artifact).delete(artifact, destroy=destroy, ignore_not_found=ignore_not_found)
+
+    def log_delete(self, artifact: ArtifactDict, destroy: bool) -> str:
+        return self.get_policy(artifact).log_delete(artifact, destroy=destroy)
@@ -10,16 +10,25 @@ from plumbum.cli.switches import Set
 from prettytable import PrettyTable
 from requests.auth import HTTPBasicAuth
 
+from artifactory_cleanup import aql
 from artifactory_cleanup.artifactorycleanup import (
     ArtifactoryCleanup,
 )
-from artifactory_cleanup.base_url_session import BaseUrlSession
+from artifactory_cleanup.base_url_session import (
+    BaseUrlSession,
+    CircuitBreaker,
+    HedgePolicy,
+    RetryPolicy,
+    Timeouts,
+)
+from artifactory_cleanup.budget import Budget
 from artifactory_cleanup.context_managers import get_context_managers
 from artifactory_cleanup.errors import InvalidConfigError
 from artifactory_cleanup.loaders import (
     PythonLoader,
     YamlConfigLoader,
 )
+from artifactory_cleanup.ratelimit import RateLimit, parse_repo_rates
 
 requests.packages.urllib3.disable_warnings()
 
@@ -63,12 +72,272 @@ class ArtifactoryCleanupCLI(cli.Application):
 
     _worker_count = cli.SwitchAttr(
         "--worker-count",
+        int,
         help="Number of workers to use",
         mandatory=False,
         default=1,
         envname="ARTIFACTORY_CLEANUP_WORKER_COUNT",
     )
 
+    _retries = cli.SwitchAttr(
+        "--retries",
+        int,
+        help="Retry idempotent requests and AQL queries N times on connection errors, 429 and 5xx, "
+        "with exponential backoff or after Retry-After",
+        mandatory=False,
+        default=3,
+        envname="ARTIFACTORY_CLEANUP_RETRIES",
+    )
+
+    _breaker_threshold = cli.SwitchAttr(
+        "--circuit-breaker-threshold",
+        int,
+        help="Pause all requests after N failed requests in a row, 0 - never pause",
+        mandatory=False,
+        default=10,
+        envname="ARTIFACTORY_CLEANUP_CIRCUIT_BREAKER_THRESHOLD",
+    )
+
+    _breaker_cooldown = cli.SwitchAttr(
+        "--circuit-breaker-cooldown",
+        float,
+        help="Seconds to pause requests for when the circuit breaker opens",
+        mandatory=False,
+        default=30,
+        envname="ARTIFACTORY_CLEANUP_CIRCUIT_BREAKER_COOLDOWN",
+    )
+
+    _connect_timeout = cli.SwitchAttr(
+        "--connect-timeout",
+        float,
+        help="Seconds to wait for a connection to Artifactory",
+        mandatory=False,
+        default=10,
+        envname="ARTIFACTORY_CLEANUP_CONNECT_TIMEOUT",
+    )
+
+    _aql_timeout = cli.SwitchAttr(
+        "--aql-timeout",
+        float,
+        help="Seconds to wait for data of an AQL query",
+        mandatory=False,
+        default=600,
+        envname="ARTIFACTORY_CLEANUP_AQL_TIMEOUT",
+    )
+
+    _api_timeout = cli.SwitchAttr(
+        "--api-timeout",
+        float,
+        help="Seconds to wait for a response of storage, docker and other API calls",
+        mandatory=False,
+        default=60,
+        envname="ARTIFACTORY_CLEANUP_API_TIMEOUT",
+    )
+
+    _delete_timeout = cli.SwitchAttr(
+        "--delete-timeout",
+        float,
+        help="Seconds to wait for a response to a delete",
+        mandatory=False,
+        default=60,
+        envname="ARTIFACTORY_CLEANUP_DELETE_TIMEOUT",
+    )
+
+    _hedge = cli.Flag(
+        "--hedge",
+        help="Send a GET request again if the first one is slower than p95 of previous ones, the first response wins",
+        mandatory=False,
+        envname="ARTIFACTORY_CLEANUP_HEDGE",
+    )
+
+    _delete_order = cli.SwitchAttr(
+        "--delete-order",
+        Set("policy", "largest", "oldest", case_sensitive=False),
+        help="Delete artifacts policy by policy, or get artifacts of all policies first "
+        "and delete the largest or the oldest ones first",
+        mandatory=False,
+        default="policy",
+        envname="ARTIFACTORY_CLEANUP_DELETE_ORDER",
+    )
+
+    _max_duration = cli.SwitchAttr(
+        "--max-duration",
+        float,
+        help="Stop sending deletes after N seconds and show what is left",
+        mandatory=False,
+        envname="ARTIFACTORY_CLEANUP_MAX_DURATION",
+    )
+
+    _max_deletes = cli.SwitchAttr(
+        "--max-deletes",
+        int,
+        help="Stop after N delete requests and show what is left",
+        mandatory=False,
+        envname="ARTIFACTORY_CLEANUP_MAX_DELETES",
+    )
+
+    _max_bytes = cli.SwitchAttr(
+        "--max-bytes",
+        int,
+        help="Stop before deletes of more than N bytes in total and show what is left",
+        mandatory=False,
+        envname="ARTIFACTORY_CLEANUP_MAX_BYTES",
+    )
+
+    _columnar = cli.Flag(
+        "--columnar",
+        help="Sort and group artifacts with NumPy in rules that keep the latest or the most used files. "
+        "Needs 'pip install artifactory-cleanup[columnar]'",
+        mandatory=False,
+        envname="ARTIFACTORY_CLEANUP_COLUMNAR",
+    )
+
+    _collapse_folders = cli.Flag(
+        "--collapse-folders",
+        help="Delete a folder with one request if all artifacts in it are deleted. "
+        "Gets paths and names of all files and folders in repositories of policies",
+        mandatory=False,
+        excludes=["--aql-dump"],
+        envname="ARTIFACTORY_CLEANUP_COLLAPSE_FOLDERS",
+    )
+
+    _pool_size = cli.SwitchAttr(
+        "--pool-size",
+        int,
+        help="Keep-alive connections per host. By default, enough for all delete and AQL workers",
+        mandatory=False,
+        envname="ARTIFACTORY_CLEANUP_POOL_SIZE",
+    )
+
+    _tcp_keepalive = cli.SwitchAttr(
+        "--tcp-keepalive",
+        int,
+        help="Send TCP keep-alive probes on connections idle for N seconds, so load balancers don't drop them",
+        mandatory=False,
+        envname="ARTIFACTORY_CLEANUP_TCP_KEEPALIVE",
+    )
+
+    _rate_limit = cli.SwitchAttr(
+        "--rate-limit",
+        float,
+        help="The maximum number of deletes per second for all repositories, overrides rate_limit.global in the config",
+        mandatory=False,
+        envname="ARTIFACTORY_CLEANUP_RATE_LIMIT",
+    )
+
+    _repo_rate_limit = cli.SwitchAttr(
+        "--repo-rate-limit",
+        str,
+        list=True,
+        help="The maximum number of deletes per second for a repository, like 'libs-release=5'. "
+        "Overrides rate_limit.repos in the config",
+        mandatory=False,
+    )
+
+    _adaptive_concurrency = cli.Flag(
+        "--adaptive-concurrency",
+        help="Start with --worker-count concurrent deletes and adapt it: add one while delete latency is flat, "
+        "halve it on latency spikes, 429 and 5xx",
+        mandatory=False,
+        envname="ARTIFACTORY_CLEANUP_ADAPTIVE_CONCURRENCY",
+    )
+
+    _max_worker_count = cli.SwitchAttr(
+        "--max-worker-count",
+        int,
+        help="The maximum number of concurrent deletes with --adaptive-concurrency",
+        mandatory=False,
+        default=64,
+        requires=["--adaptive-concurrency"],
+        envname="ARTIFACTORY_CLEANUP_MAX_WORKER_COUNT",
+    )
+
+    _delete_engine = cli.SwitchAttr(
+        "--delete-engine",
+        Set("threads", "asyncio", case_sensitive=False),
+        help="Delete artifacts with --worker-count threads, or with --worker-count concurrent requests "
+        "from one thread with asyncio. asyncio needs 'pip install artifactory-cleanup[async]'",
+        mandatory=False,
+        default="threads",
+        envname="ARTIFACTORY_CLEANUP_DELETE_ENGINE",
+    )
+
+    _aql_page_size = cli.SwitchAttr(
+        "--aql-page-size",
+        int,
+        help="Fetch artifacts by pages of N items sorted by repo, path and name. By default, one AQL query gets all of them",
+        mandatory=False,
+        default=0,
+        envname="ARTIFACTORY_CLEANUP_AQL_PAGE_SIZE",
+    )
+
+    _aql_shard = cli.Flag(
+        "--aql-shard",
+        help="Fetch artifacts with one AQL query per repository, in parallel",
+        mandatory=False,
+        envname="ARTIFACTORY_CLEANUP_AQL_SHARD",
+    )
+
+    _aql_shard_threshold = cli.SwitchAttr(
+        "--aql-shard-threshold",
+        int,
+        help="Split a repository query by creation time if it returns more than N artifacts",
+        mandatory=False,
+        default=0,
+        requires=["--aql-shard"],
+        envname="ARTIFACTORY_CLEANUP_AQL_SHARD_THRESHOLD",
+    )
+
+    _aql_workers = cli.SwitchAttr(
+        "--aql-workers",
+        int,
+        help="Number of AQL queries to run in parallel with --aql-shard",
+        mandatory=False,
+        default=4,
+        envname="ARTIFACTORY_CLEANUP_AQL_WORKERS",
+    )
+
+    _aql_fuse = cli.Flag(
+        "--aql-fuse",
+        help="Get artifacts for policies with the same repositories by one AQL query and pick them in memory",
+        mandatory=False,
+        envname="ARTIFACTORY_CLEANUP_AQL_FUSE",
+    )
+
+    _aql_dump = cli.SwitchAttr(
+        "--aql-dump",
+        help="Pick artifacts for policies from a saved AQL response with all fields, properties and stats, "
+        "instead of calling Artifactory",
+        mandatory=False,
+        excludes=["--destroy", "--aql-fuse"],
+        envname="ARTIFACTORY_CLEANUP_AQL_DUMP",
+    )
+
+    _mirror = cli.SwitchAttr(
+        "--mirror",
+        help="SQLite file to keep artifacts between runs, so next runs get only changed artifacts from Artifactory",
+        mandatory=False,
+        excludes=["--aql-dump", "--aql-fuse"],
+        envname="ARTIFACTORY_CLEANUP_MIRROR",
+    )
+
+    _mirror_scan_days = cli.SwitchAttr(
+        "--mirror-scan-days",
+        int,
+        help="List all artifacts of a repository to forget removed ones only once in N days, every run by default",
+        mandatory=False,
+        default=0,
+        requires=["--mirror"],
+        envname="ARTIFACTORY_CLEANUP_MIRROR_SCAN_DAYS",
+    )
+
+    _explain = cli.Flag(
+        "--explain",
+        help="Show optimized AQL queries for policies and exit, do not call Artifactory",
+        mandatory=False,
+        excludes=["--destroy"],
+    )
+
     _days_in_future = cli.SwitchAttr(
         "--days-in-future",
         help="Simulate future behaviour",
@@ -153,6 +422,27 @@ class ArtifactoryCleanupCLI(cli.Application):
         with open(filename, "w", encoding="utf-8") as file:
             file.write(text)
 
+    def _get_rate_limit(self, loader: YamlConfigLoader) -> RateLimit:
+        """Rate limits from the config, updated by the command line"""
+        rate_limit = loader.get_rate_limit()
+        try:
+            repos = parse_repo_rates(self._repo_rate_limit)
+        except ValueError as err:
+            print(str(err), file=sys.stderr)
+            sys.exit(1)
+        return RateLimit(
+            self._rate_limit or rate_limit.global_rate,
+            {**rate_limit.repos, **repos},
+        )
+
+    def _get_pool_size(self) -> int:
+        """A connection for every thread that talks to Artifactory, so no one opens a new connection per request"""
+        if self._pool_size:
+            return self._pool_size
+        delete_workers = self._max_worker_count if self._adaptive_concurrency else self._worker_count
+        aql_workers = self._aql_workers if self._aql_shard else 1
+        return max(requests.adapters.DEFAULT_POOLSIZE, delete_workers + aql_workers)
+
     def main(self):
         today = self._get_today()
         if self._load_rules:
@@ -167,7 +457,23 @@ class ArtifactoryCleanupCLI(cli.Application):
             sys.exit(1)
 
         server, user, password, apikey = loader.get_connection()
-        session = BaseUrlSession(server)
+        rate_limit = self._get_rate_limit(loader)
+        breaker = None
+        if self._breaker_threshold:
+            breaker = CircuitBreaker(self._breaker_threshold, self._breaker_cooldown)
+        session = BaseUrlSession(
+            server,
+            retry=RetryPolicy(self._retries),
+            breaker=breaker,
+            pool_size=self._get_pool_size(),
+            keepalive=self._tcp_keepalive,
+            timeouts=Timeouts(
+                aql=(self._connect_timeout, self._aql_timeout),
+                api=(self._connect_timeout, self._api_timeout),
+                delete=(self._connect_timeout, self._delete_timeout),
+            ),
+            hedge=HedgePolicy() if self._hedge else None,
+        )
         if apikey:
             print("Using API Key")
             headers = {
@@ -187,16 +493,38 @@ class ArtifactoryCleanupCLI(cli.Application):
             today=today,
             ignore_not_found=self._ignore_not_found,
             worker_count=self._worker_count,
+            aql_page_size=self._aql_page_size,
+            aql_shard=self._aql_shard,
+            aql_shard_threshold=self._aql_shard_threshold,
+            aql_workers=self._aql_workers,
+            aql_fuse=self._aql_fuse,
+            aql_dump=self._aql_dump,
+            mirror=self._mirror,
+            mirror_scan_days=self._mirror_scan_days,
+            delete_engine=self._delete_engine.lower(),
+            adaptive_concurrency=self._adaptive_concurrency,
+            max_worker_count=self._max_worker_count,
+            rate_limit=rate_limit,
+            collapse_folders=self._collapse_folders,
+            delete_order=self._delete_order.lower(),
+            budget=Budget(self._max_duration, self._max_deletes, self._max_bytes),
+            columnar=self._columnar,
+            # Removed artifacts in the output have all fields, properties and stats, whatever rules read
+            aql_include=aql.INCLUDE_ALL if self._output_artifacts else (),
         )
 
         # Filter policies by name
         if self._policy:
             cleanup.only(self._policy)
 
+        block_ctx_mgr, test_ctx_mgr = get_context_managers()
+        if self._explain:
+            cleanup.explain(block_ctx_mgr=block_ctx_mgr)
+            return
+
         result = {"policies": [], "total_size": 0}
         total_size = 0
 
-        block_ctx_mgr, test_ctx_mgr = get_context_managers()
         for summary in cleanup.cleanup(
             block_ctx_mgr=block_ctx_mgr, test_ctx_mgr=test_ctx_mgr
         ):
@@ -209,6 +537,37 @@ class ArtifactoryCleanupCLI(cli.Application):
                 "file_count": summary.artifacts_removed,
                 "size": summary.artifacts_size
             }
+            if summary.concurrency_limit is not None:
+                policy["concurrency"] = {
+                    "limit": summary.concurrency_limit,
+                    "history": summary.concurrency_history,
+                }
+            if self._destroy:
+                policy["deleted"] = {
+                    "file_count": summary.deleted_count,
+                    "size": summary.deleted_size,
+                    "not_found": summary.not_found_count,
+                    "failed": summary.failed_count,
+                    "elapsed": round(summary.elapsed, 3),
+                    "deletes_per_second": round(summary.deletes_per_second, 1),
+                    "mb_per_second": round(summary.mb_per_second, 2),
+                }
+            if summary.retries or summary.breaker_trips:
+                policy["retries"] = summary.retries
+                policy["breaker_trips"] = summary.breaker_trips
+            if summary.hedged:
+                policy["hedged"] = summary.hedged
+            if summary.connections_opened:
+                policy["connections"] = {
+                    "opened": summary.connections_opened,
+                    "reused": summary.connections_reused,
+                }
+            if summary.interrupted:
+                policy["interrupted"] = True
+            if summary.budget_exhausted:
+                policy["budget_exhausted"] = summary.budget_exhausted
+            if summary.interrupted or summary.budget_exhausted:
+                policy["pending"] = summary.pending_count
             if self._output_artifacts:
                 policy["removed_artifacts"] = summary.removed_artifacts
             result["policies"].append(policy)
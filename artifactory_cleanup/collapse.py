@@ -0,0 +1,136 @@
+"""
+Delete a folder with one request instead of a request per artifact, when all artifacts in the folder are deleted.
+We compare artifacts to delete with a light listing of folders they're in: paths and names of all files and folders.
+The folder is listed again right before its delete, so we don't delete artifacts uploaded meanwhile
+"""
+from collections import defaultdict
+from typing import Dict, Iterable, List, Tuple
+
+from artifactory_cleanup import aql
+from artifactory_cleanup.errors import ArtifactoryCleanupException
+from artifactory_cleanup.rules.base import ArtifactDict, ArtifactsList, CleanupPolicy, DeleteResult
+from artifactory_cleanup.rules.utils import build_repositories, get_fullpath, split_fullpath
+
+# A delete request and artifacts it removes
+Delete = Tuple[ArtifactDict, ArtifactsList]
+
+
+def get_relative_path(artifact: ArtifactDict) -> str:
+    """
+    The path of the artifact inside its repository
+
+    >>> get_relative_path({"repo": "r", "path": "a/b", "name": "c.zip"})
+    'a/b/c.zip'
+    """
+    _, _, relative = get_fullpath(**artifact).partition("/")
+    return relative
+
+
+def list_folders(session, repo: str, folders: Iterable[str]) -> ArtifactsList:
+    """Paths and names of the folders and all files and folders inside them"""
+    clauses = []
+    for folder in sorted(set(folders)):
+        parent, name = folder.rsplit("/", maxsplit=1) if "/" in folder else (".", folder)
+        clauses.append({"$and": [{"path": {"$eq": parent}}, {"name": {"$eq": name}}]})
+        clauses.append({"path": {"$eq": folder}})
+        clauses.append({"path": {"$match": f"{folder}/*"}})
+    if not clauses:
+        return ArtifactsList()
+    filters = {"$and": [aql.repo_shard(repo), {"$or": clauses}, {"type": "any"}]}
+    return ArtifactsList.from_response(aql.find(session, filters, ["repo", "path", "name", "type"]))
+
+
+def list_affected(session, repo: str, artifacts: Iterable[ArtifactDict]) -> ArtifactsList:
+    """Top folders of the repository that have the artifacts: no higher folder can be deleted instead of them"""
+    tops = [get_relative_path(artifact).split("/", maxsplit=1)[0] for artifact in artifacts]
+    return list_folders(session, repo, tops)
+
+
+def plan_deletes(artifacts: ArtifactsList, listing: Iterable[ArtifactDict]) -> List[Delete]:
+    """
+    Group artifacts under the highest folders that have nothing else inside.
+    Artifacts outside of such folders are deleted one by one
+
+    >>> listing = [
+    ...     {"repo": "r", "path": "build", "name": "1", "type": "folder"},
+    ...     {"repo": "r", "path": "build/1", "name": "a.zip", "type": "file"},
+    ...     {"repo": "r", "path": "build/1", "name": "b.zip", "type": "file"},
+    ...     {"repo": "r", "path": "build", "name": "2", "type": "folder"},
+    ...     {"repo": "r", "path": "build/2", "name": "a.zip", "type": "file"},
+    ... ]
+    >>> artifacts = [dict(x, size=1) for x in listing if x["path"] == "build/1"]
+    >>> [(target["path"], target["name"], len(covered)) for target, covered in plan_deletes(artifacts, listing)]
+    [('build', '1', 2)]
+    """
+    deleted = {get_fullpath(**artifact): artifact for artifact in artifacts}
+    listing = list(listing)
+    listed = {get_fullpath(**item) for item in listing}
+    # Artifacts created after the listing are in the tree too
+    listing.extend(artifact for fullpath, artifact in deleted.items() if fullpath not in listed)
+    repositories = build_repositories(listing)
+    highest = {}
+    for repo in repositories:
+        repo.mark_deleted(set(deleted))
+        highest.update((node.identifier, node) for node in repo.get_highest_deleted())
+
+    covered: Dict[str, ArtifactsList] = defaultdict(ArtifactsList)
+    for fullpath, artifact in deleted.items():
+        target = fullpath
+        while target not in highest:
+            _, target = split_fullpath(target)
+        covered[target].append(artifact)
+
+    plan = []
+    for target, target_artifacts in covered.items():
+        if target in deleted:
+            plan.append((deleted[target], target_artifacts))
+            continue
+        folder = dict(highest[target].get_raw_data(), type="folder")
+        folder["size"] = sum(artifact.get("size") or 0 for artifact in target_artifacts)
+        plan.append((folder, target_artifacts))
+    return plan
+
+
+def expand_results(results: Iterable[DeleteResult], deletes: List[Delete]) -> List[DeleteResult]:
+    """A result for every artifact: artifacts of a folder get the result of the folder delete"""
+    covered = {id(target): target_artifacts for target, target_artifacts in deletes}
+    return [
+        result._replace(artifact=artifact) for result in results for artifact in covered[id(result.artifact)]
+    ]
+
+
+class CheckedFolders:
+    """
+    Lists a collapsed folder again right before its delete, the first listing may be hours old by then.
+    If somebody uploaded an artifact into the folder meanwhile, the folder is not deleted and its delete fails.
+    It quacks like a policy for delete engines
+    """
+
+    def __init__(self, policy, session, deletes: List[Delete]):
+        self.policy = policy
+        self.session = session
+        self._covered = {id(target): covered for target, covered in deletes if covered[0] is not target}
+
+    def delete(self, artifact: ArtifactDict, destroy: bool, ignore_not_found: bool = False) -> str:
+        if destroy:
+            self.check(artifact)
+        return self.policy.delete(artifact, destroy=destroy, ignore_not_found=ignore_not_found)
+
+    def log_delete(self, artifact: ArtifactDict, destroy: bool) -> str:
+        if destroy:
+            self.check(artifact)
+        return self.policy.log_delete(artifact, destroy=destroy)
+
+    def check(self, target: ArtifactDict) -> None:
+        covered = self._covered.get(id(target))
+        if covered is None:
+            return
+        deleted = {get_fullpath(**artifact) for artifact in covered}
+        listing = list_folders(self.session, target["repo"], [get_relative_path(target)])
+        added = [get_fullpath(**item) for item in listing if item["type"] != "folder"]
+        added = [fullpath for fullpath in added if fullpath not in deleted]
+        if added:
+            path = CleanupPolicy.get_artifact_path(target)
+            raise ArtifactoryCleanupException(
+                f"Folder '{path}' has {len(added)} new artifacts since the listing, like '{added[0]}', skip it"
+            )
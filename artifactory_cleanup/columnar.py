@@ -0,0 +1,156 @@
+"""
+Columns of artifacts in NumPy arrays, so rules sort and group millions of artifacts without Python comparisons.
+Needs numpy, install it with ``pip install artifactory-cleanup[columnar]``
+
+Timestamps are parsed once into microseconds since the epoch in UTC. Artifactory returns all of them
+with the same timezone offset, then the order is the same as the order of ISO strings in the dict path.
+Sorts are stable, so ties go the same way as in the dict path
+"""
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Sequence, Tuple
+
+from artifactory_cleanup.errors import ArtifactoryCleanupException
+from artifactory_cleanup.rules.base import ArtifactDict
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover
+    np = None
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+MICROSECOND = timedelta(microseconds=1)
+
+
+def available() -> bool:
+    return np is not None
+
+
+def parse_timestamp(value: str) -> int:
+    """
+    Microseconds since the epoch in UTC
+
+    >>> parse_timestamp("2021-03-21T13:54:52.383+02:00")
+    1616327692383000
+    >>> parse_timestamp("2021-03-21T11:54:52.383Z")
+    1616327692383000
+    """
+    moment = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return (moment - EPOCH) // MICROSECOND
+
+
+class ArtifactTable:
+    """
+    Columns of artifacts, every column is built on the first access.
+    Rows are positions of artifacts in the list
+    """
+
+    def __init__(self, artifacts: Sequence[ArtifactDict]):
+        if np is None:
+            raise ArtifactoryCleanupException(
+                "Columnar filters need numpy, install it with 'pip install artifactory-cleanup[columnar]'"
+            )
+        # Rows stay the same when rules remove artifacts from the list
+        self.artifacts = list(artifacts)
+        self._columns: Dict[str, "np.ndarray"] = {}
+
+    def __len__(self):
+        return len(self.artifacts)
+
+    def rows(self, indices: "np.ndarray") -> List[ArtifactDict]:
+        return [self.artifacts[i] for i in indices.tolist()]
+
+    def _timestamps(self, values) -> "np.ndarray":
+        return np.fromiter((parse_timestamp(value) for value in values), dtype=np.int64, count=len(self))
+
+    @property
+    def created(self) -> "np.ndarray":
+        if "created" not in self._columns:
+            self._columns["created"] = self._timestamps(artifact["created"] for artifact in self.artifacts)
+        return self._columns["created"]
+
+    @property
+    def usage(self) -> "np.ndarray":
+        """The last download, or the creation if nobody downloaded the artifact, like ``sort_by_usage``"""
+        if "usage" not in self._columns:
+            stats = ((artifact.get("stats") or {}, artifact) for artifact in self.artifacts)
+            values = (stat["downloaded"] if "downloaded" in stat else artifact["created"] for stat, artifact in stats)
+            self._columns["usage"] = self._timestamps(values)
+        return self._columns["usage"]
+
+    @property
+    def size(self) -> "np.ndarray":
+        if "size" not in self._columns:
+            sizes = (artifact.get("size") or 0 for artifact in self.artifacts)
+            self._columns["size"] = np.fromiter(sizes, dtype=np.int64, count=len(self))
+        return self._columns["size"]
+
+    @property
+    def path_codes(self) -> "np.ndarray":
+        """Categorical codes of paths: the same path - the same code"""
+        if "path" not in self._columns:
+            self._columns["path"] = self._codes(artifact["path"] for artifact in self.artifacts)
+        return self._columns["path"]
+
+    @property
+    def repo_codes(self) -> "np.ndarray":
+        """Categorical codes of repositories"""
+        if "repo" not in self._columns:
+            self._columns["repo"] = self._codes(artifact["repo"] for artifact in self.artifacts)
+        return self._columns["repo"]
+
+    def _codes(self, values) -> "np.ndarray":
+        codes: Dict[str, int] = {}
+        values = (codes.setdefault(value, len(codes)) for value in values)
+        return np.fromiter(values, dtype=np.int64, count=len(self))
+
+    def others(self, indices: "np.ndarray") -> "np.ndarray":
+        """All rows except ``indices``, in the order of the list"""
+        mask = np.ones(len(self), dtype=bool)
+        mask[indices] = False
+        return np.flatnonzero(mask)
+
+
+def oldest_first(table: ArtifactTable, indices: "np.ndarray") -> "np.ndarray":
+    """Rows sorted by creation, like ``sorted(key=lambda x: x["created"])``"""
+    return indices[np.argsort(table.created[indices], kind="stable")]
+
+
+def usage_order(table: ArtifactTable, reverse: bool = False) -> "np.ndarray":
+    """Rows sorted by ``sort_by_usage``, the most recently used first with ``reverse``"""
+    if reverse:
+        # Negate keys instead of reversing the result, so ties keep their order
+        return np.argsort(-table.usage, kind="stable")
+    return np.argsort(table.usage, kind="stable")
+
+
+def latest_n(table: ArtifactTable, count: int) -> Tuple["np.ndarray", "np.ndarray"]:
+    """
+    Rows to keep - the latest ``count`` by creation, like ``top_n`` - and rows to delete, the oldest first
+    """
+    order = np.argsort(table.created, kind="stable")
+    split = max(0, len(table) - max(0, count))
+    return order[split:], order[:split]
+
+
+def latest_n_in_folder(table: ArtifactTable, count: int) -> Tuple["np.ndarray", "np.ndarray"]:
+    """
+    Rows to keep - the latest ``count`` by creation in every path - and rows to delete, the oldest first
+    """
+    if not len(table):
+        empty = np.array([], dtype=np.int64)
+        return empty, empty
+    # Group by path, then by creation; lexsort is stable, so ties keep their order
+    order = np.lexsort((table.created, table.path_codes))
+    codes = table.path_codes[order]
+    ends = np.cumsum(np.bincount(codes))
+    from_end = ends[codes] - np.arange(len(table)) - 1
+    kept = order[from_end < count]
+    return kept, oldest_first(table, table.others(kept))
+
+
+def most_recently_used(table: ArtifactTable, count: int) -> Tuple["np.ndarray", "np.ndarray"]:
+    """Rows to keep - ``count`` the most recently used - and rows to delete, in the order of the list"""
+    kept = usage_order(table, reverse=True)[: max(0, count)]
+    return kept, table.others(kept)
@@ -0,0 +1,115 @@
+"""
+Adaptive number of concurrent deletes: additive increase while latency is flat, multiplicative decrease on
+latency spikes, 429 and 5xx (AIMD, like TCP congestion control)
+"""
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterator, List, Optional
+
+
+class AdaptiveLimit:
+    """
+    The limit of concurrent deletes that follows how Artifactory copes with them.
+
+    Every ``limit`` responses make a window. If p95 latency of the window stays below ``tolerance`` times
+    the best p95 we have seen, the limit grows by one. A slower window, a 429 or a 5xx cut it by ``backoff``.
+    Errors cut the limit at most once per window, so a burst of errors for requests that are already in flight
+    doesn't drop it to the minimum at once.
+    """
+
+    def __init__(
+        self,
+        initial: int,
+        minimum: int = 1,
+        maximum: int = 64,
+        tolerance: float = 1.5,
+        backoff: float = 0.5,
+    ):
+        self.minimum = minimum
+        self.maximum = max(maximum, initial)
+        self.tolerance = tolerance
+        self.backoff = backoff
+        self.limit = max(minimum, initial)
+        self.history: List[int] = [self.limit]
+
+        self._baseline: Optional[float] = None
+        self._latencies: List[float] = []
+        self._backed_off = False
+        self._in_flight = 0
+        self._condition = threading.Condition()
+
+    @contextmanager
+    def slot(self) -> Iterator[None]:
+        """Wait for a free slot under the current limit"""
+        with self._condition:
+            self._condition.wait_for(lambda: self._in_flight < self.limit)
+            self._in_flight += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._in_flight -= 1
+                self._condition.notify_all()
+
+    def on_response(self, latency: float, status: Optional[int]) -> None:
+        """
+        Record the result of a delete request
+        :param latency: seconds
+        :param status: HTTP status, None if there's no response at all
+        """
+        with self._condition:
+            # No response, too many requests or Artifactory is overloaded
+            if status is None or status == 429 or status >= 500:
+                if not self._backed_off:
+                    self._backed_off = True
+                    self._set_limit(self.limit * self.backoff)
+                return
+
+            self._latencies.append(latency)
+            if len(self._latencies) < self.limit:
+                return
+            p95 = percentile(self._latencies, 95)
+            self._latencies = []
+            backed_off, self._backed_off = self._backed_off, False
+            if self._baseline is None or p95 < self._baseline:
+                self._baseline = p95
+            if p95 > self._baseline * self.tolerance:
+                self._set_limit(self.limit * self.backoff)
+            elif not backed_off:
+                self._set_limit(self.limit + 1)
+
+    def _set_limit(self, limit: float) -> None:
+        limit = min(self.maximum, max(self.minimum, int(limit)))
+        if limit != self.limit:
+            self.limit = limit
+            self.history.append(limit)
+            self._condition.notify_all()
+
+    @contextmanager
+    def measure(self) -> Iterator[None]:
+        """Wait for a slot and record latency and status of the request in the block"""
+        with self.slot():
+            started = time.monotonic()
+            try:
+                yield
+            except Exception as exc:
+                response = getattr(exc, "response", None)
+                self.on_response(time.monotonic() - started, getattr(response, "status_code", None))
+                raise
+            self.on_response(time.monotonic() - started, 200)
+
+
+def percentile(values: List[float], percent: float) -> float:
+    """
+    Nearest-rank percentile
+
+    >>> percentile([1, 2, 3, 4, 5, 6, 7, 8, 9, 10], 95)
+    10
+    >>> percentile([1, 2, 3, 4], 50)
+    2
+    """
+    ordered = sorted(values)
+    rank = max(1, math.ceil(percent / 100 * len(ordered)))
+    return ordered[rank - 1]
@@ -4,3 +4,11 @@ class ArtifactoryCleanupException(Exception):
 
 class InvalidConfigError(ArtifactoryCleanupException):
     pass
+
+
+class AqlConflictError(ArtifactoryCleanupException):
+    pass
+
+
+class AqlNotSupportedError(ArtifactoryCleanupException):
+    pass
@@ -0,0 +1,114 @@
+"""
+Fuse AQL queries of policies that look into the same repositories:
+one query gets artifacts for all of them, then every policy picks its own artifacts in memory
+"""
+from typing import Dict, List, Optional, Tuple
+
+from artifactory_cleanup import aql
+from artifactory_cleanup.errors import AqlNotSupportedError
+from artifactory_cleanup.rules.base import ArtifactsList, CleanupPolicy
+
+
+class FusedPolicy(CleanupPolicy):
+    """
+    A policy without rules that gets artifacts for many policies with one query:
+    the same repositories and any of the policies' criteria
+    """
+
+    def __init__(self, repo_clause: Dict, policies: List[CleanupPolicy], criteria: List[Dict]):
+        super().__init__(f"Fused query for {', '.join(policy.name for policy in policies)}")
+        self.repo_clause = repo_clause
+        self.policies = policies
+        self.criteria = criteria
+
+        first = policies[0]
+        self.init(
+            first.session,
+            first.today,
+            aql_page_size=first.aql_page_size,
+            aql_shard=first.aql_shard,
+            aql_shard_threshold=first.aql_shard_threshold,
+            aql_workers=first.aql_workers,
+        )
+
+    def _get_aql_find_filters(self) -> Dict:
+        return {"$and": [self.repo_clause, {"$or": self.criteria}]}
+
+    def _get_aql_include(self) -> List[str]:
+        include = super()._get_aql_include()
+        for policy, criteria in zip(self.policies, self.criteria):
+            include.extend(policy._get_aql_include())
+            include.extend(aql.criteria_include(criteria))
+        return list(dict.fromkeys(include))
+
+
+class QueryFusion:
+    """
+    Group policies by the repositories they look into and get artifacts for every group with one query.
+    Policies with their own AQL text (sort, limit) or criteria that we can't check in memory are not fused.
+    """
+
+    def __init__(self, policies: List[CleanupPolicy]):
+        self._groups: Dict[int, FusedPolicy] = {}
+        self._results: Dict[int, ArtifactsList] = {}
+        self._pending: Dict[int, int] = {}
+
+        groups: Dict[str, Tuple[Dict, List[CleanupPolicy], List[Dict]]] = {}
+        for policy in policies:
+            # Rules fail with their own errors before we build a query from them
+            policy.check()
+            policy.build_aql_query()
+            fusible = self._split(policy)
+            if fusible is None:
+                continue
+            repo_clause, criteria = fusible
+            group = groups.setdefault(aql.criteria_key(repo_clause), (repo_clause, [], []))
+            group[1].append(policy)
+            group[2].append(criteria)
+
+        for repo_clause, group_policies, criteria in groups.values():
+            if len(group_policies) < 2:
+                continue
+            fused = FusedPolicy(repo_clause, group_policies, criteria)
+            fused.build_aql_query()
+            self._pending[id(fused)] = len(group_policies)
+            for policy in group_policies:
+                self._groups[id(policy)] = fused
+            print(f"Fused {len(group_policies)} policies into one query: {fused.name}")
+
+    @staticmethod
+    def _split(policy: CleanupPolicy) -> Optional[Tuple[Dict, Dict]]:
+        """The repository clause and the rest of criteria of the policy, None if we can't fuse it"""
+        if policy.aql_find_filters is None:
+            return None
+        if policy.DOMAIN != CleanupPolicy.DOMAIN:
+            return None
+        if policy.aql_text != policy._get_aql_base_text(policy.aql_find_filters):
+            return None
+        repo_clause, criteria = aql.split_repo_clause(policy.aql_find_filters)
+        if repo_clause is None:
+            return None
+        try:
+            aql.compile_criteria(criteria)
+        except AqlNotSupportedError as exc:
+            print(f"Policy '{policy.name}' is not fused: {exc}")
+            return None
+        return repo_clause, criteria
+
+    def get_artifacts(self, policy: CleanupPolicy) -> ArtifactsList:
+        """Get artifacts of the policy, from the fused query if the policy is in a group"""
+        fused = self._groups.get(id(policy))
+        if fused is None:
+            return policy.get_artifacts()
+
+        key = id(fused)
+        if key not in self._results:
+            self._results[key] = fused.get_artifacts()
+        artifacts = self._results[key]
+        self._pending[key] -= 1
+        if not self._pending[key]:
+            # The last policy of the group, free the memory
+            del self._results[key]
+
+        print(f"Pick artifacts of the policy from {len(artifacts)} artifacts of the fused query")
+        return policy.get_artifacts_from(artifacts)
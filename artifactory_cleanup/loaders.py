@@ -12,6 +12,7 @@ import yaml
 
 from artifactory_cleanup import rules
 from artifactory_cleanup.errors import InvalidConfigError
+from artifactory_cleanup.ratelimit import RateLimit
 from artifactory_cleanup.rules import Repo
 from artifactory_cleanup.rules.base import CleanupPolicy, Rule
 
@@ -32,6 +33,28 @@ def _get_check_fn(annotation):
     return cfgv.check_any
 
 
+def check_rate(v):
+    cfgv.check_type((int, float), typename="number")(v)
+    if v <= 0:
+        raise cfgv.ValidationError(f"Expected a positive number, got {v}")
+
+
+def check_repo_rates(v):
+    cfgv.check_type(dict, typename="mapping")(v)
+    for repo, rate in v.items():
+        cfgv.check_string(repo)
+        check_rate(rate)
+
+
+RATE_LIMIT_SCHEMA = cfgv.Map(
+    "RateLimit",
+    None,
+    cfgv.NoAdditionalKeys(["global", "repos"]),
+    cfgv.OptionalNoDefault("global", check_rate),
+    cfgv.Optional("repos", check_repo_rates, {}),
+)
+
+
 class SchemaBuilder:
     def _get_rule_conditionals(self, name, rule) -> List[cfgv.Conditional]:
         if rule.schema is not None:
@@ -94,12 +117,13 @@ class SchemaBuilder:
         config_schema = cfgv.Map(
             "Config",
             None,
-            cfgv.NoAdditionalKeys(["server", "user", "password", "policies", "apikey"]),
+            cfgv.NoAdditionalKeys(["server", "user", "password", "policies", "apikey", "rate_limit"]),
             cfgv.Required("server", cfgv.check_string),
             # User and password required, if apikey missing
             cfgv.Conditional("user", cfgv.check_string, "apikey", cfgv.MISSING, False),
             cfgv.Conditional("password", cfgv.check_string, "apikey", cfgv.MISSING, False),
             cfgv.RequiredRecurse("policies", cfgv.Array(policy_schema)),
+            cfgv.OptionalRecurse("rate_limit", RATE_LIMIT_SCHEMA, {}),
         )
 
         root_schema = cfgv.Map(
@@ -198,6 +222,12 @@ class YamlConfigLoader:
         apikey = os.path.expandvars(apikey)
         return server, user, password, apikey
 
+    def get_rate_limit(self) -> RateLimit:
+        """Deletes per second for all repositories and for some of them"""
+        config = self.load(self.filepath)
+        rate_limit = config["artifactory-cleanup"].get("rate_limit", {})
+        return RateLimit(rate_limit.get("global"), rate_limit.get("repos"))
+
 
 class PythonLoader:
     """
@@ -0,0 +1,209 @@
+"""
+Local mirror of artifacts metadata in SQLite.
+The first run gets all artifacts of repositories, next runs get only artifacts that changed since then.
+"""
+import json
+import sqlite3
+from collections import Counter
+from datetime import date, timedelta
+from typing import Dict, Iterable, List, Optional
+
+from artifactory_cleanup import aql
+from artifactory_cleanup.base_url_session import BaseUrlSession
+from artifactory_cleanup.errors import AqlNotSupportedError
+from artifactory_cleanup.rules.base import ArtifactDict, ArtifactsList, CleanupPolicy
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS artifacts (
+    repo TEXT NOT NULL,
+    path TEXT NOT NULL,
+    name TEXT NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (repo, path, name)
+);
+CREATE TABLE IF NOT EXISTS cursors (
+    repo TEXT PRIMARY KEY,
+    modified TEXT,
+    updated TEXT,
+    downloaded TEXT,
+    remote_downloaded TEXT,
+    scanned TEXT
+);
+"""
+
+# Columns that mirrors of older versions don't have yet
+MIGRATIONS = {
+    "remote_downloaded": """
+        UPDATE cursors SET remote_downloaded = (
+            SELECT MAX(json_extract(data, '$.stats.remote_downloaded')) FROM artifacts
+            WHERE artifacts.repo = cursors.repo
+        )
+    """,
+    "scanned": None,
+}
+
+# Cursor columns and AQL fields that change when an artifact changes
+CURSOR_FIELDS = {
+    "modified": "modified",
+    "updated": "updated",
+    "downloaded": "stat.downloaded",
+    "remote_downloaded": "stat.remote_downloaded",
+}
+
+
+class Mirror:
+    """
+    Artifacts of repositories with all fields, properties and stats, kept in SQLite between runs.
+    Policies pick their artifacts from the mirror by their AQL criteria in memory.
+    """
+
+    def __init__(self, filename: str, session: BaseUrlSession, today: Optional[date] = None, scan_days: int = 0):
+        """
+        :param scan_days: list all artifacts of a repository to forget removed ones only once in so many days,
+            every sync if 0. Removed artifacts stay in the mirror until then
+        """
+        self.session = session
+        self.today = today or date.today()
+        self.scan_days = scan_days
+        self.connection = sqlite3.connect(filename)
+        self.connection.executescript(SCHEMA)
+        self._migrate()
+        self._repos: Dict[int, List[str]] = {}
+
+    def _migrate(self) -> None:
+        columns = {row[1] for row in self.connection.execute("PRAGMA table_info(cursors)")}
+        for column, fill in MIGRATIONS.items():
+            if column in columns:
+                continue
+            self.connection.execute(f"ALTER TABLE cursors ADD COLUMN {column} TEXT")
+            if fill:
+                self.connection.execute(fill)
+        self.connection.commit()
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def sync_policies(self, policies: List[CleanupPolicy]) -> None:
+        """Build queries of policies and sync all repositories they look into"""
+        for policy in policies:
+            # Rules fail with their own errors before we build a query from them
+            policy.check()
+            policy.build_aql_query()
+            if policy.aql_find_filters is None:
+                continue
+            try:
+                # Compile criteria and check we can pick artifacts in memory
+                policy.get_artifacts_from([])
+            except AqlNotSupportedError as exc:
+                print(f"Policy '{policy.name}' gets artifacts from Artifactory: {exc}")
+                continue
+            repos = policy._get_shard_repos()
+            if repos:
+                self._repos[id(policy)] = repos
+            else:
+                print(f"Can not find repositories of policy '{policy.name}', it gets artifacts from Artifactory")
+
+        repos = {repo: None for policy_repos in self._repos.values() for repo in policy_repos}
+        for repo in repos:
+            self.sync(repo)
+
+    def sync(self, repo: str) -> None:
+        """Get artifacts that changed since the last sync, and forget removed ones"""
+        cursor = self._get_cursor(repo)
+        filters = aql.repo_shard(repo)
+        if cursor and any(cursor.values()):
+            # Artifacts with the same time as the cursor may come after the last sync, so get them again.
+            # They replace their rows by the primary key
+            changed = [
+                {CURSOR_FIELDS[column]: {"$gte": value}} for column, value in cursor.items() if value
+            ]
+            filters = {"$and": [filters, {"$or": changed}]}
+
+        artifacts = ArtifactsList.from_response(aql.find(self.session, filters, aql.INCLUDE_ALL))
+        self.connection.executemany(
+            "INSERT OR REPLACE INTO artifacts (repo, path, name, data) VALUES (?, ?, ?, ?)",
+            ((x["repo"], x["path"], x["name"], json.dumps(x)) for x in artifacts),
+        )
+        scanned = self._get_scanned(repo)
+        removed = 0
+        if cursor is None:
+            # The first sync got all artifacts
+            scanned = self.today
+        elif scanned is None or self.today - scanned >= timedelta(days=self.scan_days):
+            removed = self._forget_removed(repo)
+            scanned = self.today
+        self._save_cursor(repo, cursor, artifacts, scanned)
+        self.connection.commit()
+        print(f"Mirror '{repo}': {len(artifacts)} new or changed artifacts, {removed} removed")
+
+    def _get_cursor(self, repo: str) -> Optional[Dict[str, Optional[str]]]:
+        columns = ", ".join(CURSOR_FIELDS)
+        row = self.connection.execute(f"SELECT {columns} FROM cursors WHERE repo = ?", (repo,)).fetchone()
+        if row is None:
+            return None
+        return dict(zip(CURSOR_FIELDS, row))
+
+    def _get_scanned(self, repo: str) -> Optional[date]:
+        row = self.connection.execute("SELECT scanned FROM cursors WHERE repo = ?", (repo,)).fetchone()
+        if row is None or row[0] is None:
+            return None
+        return date.fromisoformat(row[0])
+
+    def _save_cursor(self, repo: str, cursor: Optional[Dict], artifacts: ArtifactsList, scanned: date) -> None:
+        cursor = dict(cursor or dict.fromkeys(CURSOR_FIELDS))
+        for artifact in artifacts:
+            stats = artifact["stats"]
+            values = {
+                "modified": artifact.get("modified"),
+                "updated": artifact.get("updated"),
+                "downloaded": stats.get("downloaded"),
+                "remote_downloaded": stats.get("remote_downloaded"),
+            }
+            for column, value in values.items():
+                # ISO 8601 dates in the same timezone compare as strings
+                if value and (cursor[column] is None or value > cursor[column]):
+                    cursor[column] = value
+        columns = ["repo", *CURSOR_FIELDS, "scanned"]
+        self.connection.execute(
+            f"INSERT OR REPLACE INTO cursors ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+            (repo, *(cursor[column] for column in CURSOR_FIELDS), scanned.isoformat()),
+        )
+
+    def _forget_removed(self, repo: str) -> int:
+        """
+        Removed artifacts are not in the delta, so compare paths and names of all artifacts in the repository.
+        It's a light query without properties and stats, but it still lists the whole repository
+        and takes about as long as the first sync of it without stats. Use ``scan_days`` to run it less often
+        """
+        listing = aql.find(self.session, aql.repo_shard(repo), ["repo", "path", "name"])
+        existing = {(x["path"], x["name"]) for x in listing}
+        rows = self.connection.execute("SELECT path, name FROM artifacts WHERE repo = ?", (repo,))
+        removed = [row for row in rows if tuple(row) not in existing]
+        self.connection.executemany(
+            "DELETE FROM artifacts WHERE repo = ? AND path = ? AND name = ?",
+            ((repo, path, name) for path, name in removed),
+        )
+        for path, count in Counter(path for path, _ in removed).items():
+            print(f"Mirror '{repo}': {count} artifacts removed from '{path}'")
+        return len(removed)
+
+    def forget(self, artifacts: Iterable[ArtifactDict]) -> None:
+        """Remove deleted artifacts, so next runs and policies don't delete them again"""
+        self.connection.executemany(
+            "DELETE FROM artifacts WHERE repo = ? AND path = ? AND name = ?",
+            ((x["repo"], x["path"], x["name"]) for x in artifacts),
+        )
+        self.connection.commit()
+
+    def get_artifacts(self, policy: CleanupPolicy) -> ArtifactsList:
+        """Get artifacts of the policy from the mirror, or from Artifactory if we don't know its repositories"""
+        repos = self._repos.get(id(policy))
+        if repos is None:
+            return policy.get_artifacts()
+        return policy.get_artifacts_from(self._iter_artifacts(repos))
+
+    def _iter_artifacts(self, repos: List[str]) -> Iterable[Dict]:
+        for repo in repos:
+            rows = self.connection.execute("SELECT data FROM artifacts WHERE repo = ?", (repo,))
+            for (data,) in rows:
+                yield json.loads(data)
@@ -0,0 +1,115 @@
+"""
+Limit deletes per second, globally and per repository, with token buckets
+"""
+import threading
+import time
+from collections import deque
+from typing import Dict, Iterable, Iterator, Optional, Tuple
+
+from artifactory_cleanup.rules.base import ArtifactDict
+
+
+class TokenBucket:
+    """``rate`` operations per second, with bursts up to one second of them"""
+
+    def __init__(self, rate: float):
+        self.rate = rate
+        self.capacity = max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def wait(self, now: float) -> float:
+        """Seconds to wait for a token, 0 if there's one"""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def take(self) -> None:
+        self.tokens -= 1
+
+
+class RateLimit:
+    """Deletes per second for all repositories and for some of them"""
+
+    def __init__(self, global_rate: Optional[float] = None, repos: Optional[Dict[str, float]] = None):
+        self.global_rate = global_rate
+        self.repos = dict(repos or {})
+        self._global = TokenBucket(global_rate) if global_rate else None
+        self._repos = {repo: TokenBucket(rate) for repo, rate in self.repos.items()}
+
+    def __bool__(self):
+        return bool(self._global or self._repos)
+
+    def take(self, repo: str) -> float:
+        """Take a token for the repository, or get seconds to wait for it"""
+        now = time.monotonic()
+        buckets = [bucket for bucket in (self._repos.get(repo), self._global) if bucket]
+        wait = max((bucket.wait(now) for bucket in buckets), default=0)
+        if wait:
+            return wait
+        for bucket in buckets:
+            bucket.take()
+        return 0
+
+
+class RoundRobin:
+    """
+    Artifacts of repositories in turns, as fast as the rate limit allows.
+    A repository that waits for its limit doesn't stop artifacts of other repositories
+    """
+
+    def __init__(self, artifacts: Iterable[ArtifactDict], rate_limit: Optional[RateLimit] = None):
+        self.rate_limit = rate_limit
+        groups: Dict[str, deque] = {}
+        for artifact in artifacts:
+            groups.setdefault(artifact["repo"], deque()).append(artifact)
+        self._repos = deque(groups.items())
+        self._lock = threading.Lock()
+
+    def poll(self) -> Tuple[Optional[ArtifactDict], float]:
+        """
+        The next artifact, or None and seconds to wait for the next one.
+        None and 0 - there are no artifacts anymore
+        """
+        with self._lock:
+            waits = []
+            for _ in range(len(self._repos)):
+                repo, queue = self._repos.popleft()
+                wait = self.rate_limit.take(repo) if self.rate_limit else 0
+                if wait:
+                    waits.append(wait)
+                    self._repos.append((repo, queue))
+                    continue
+                artifact = queue.popleft()
+                if queue:
+                    self._repos.append((repo, queue))
+                return artifact, 0
+            return None, min(waits, default=0)
+
+    def __iter__(self) -> Iterator[ArtifactDict]:
+        while True:
+            artifact, wait = self.poll()
+            if artifact is not None:
+                yield artifact
+            elif wait:
+                time.sleep(wait)
+            else:
+                return
+
+
+def parse_repo_rates(values: Iterable[str]) -> Dict[str, float]:
+    """
+    Parse ``repo=rate`` values from the command line
+
+    >>> parse_repo_rates(["libs-release=5", "docker=0.5"])
+    {'libs-release': 5.0, 'docker': 0.5}
+    """
+    repos = {}
+    for value in values:
+        repo, sep, rate = value.rpartition("=")
+        if not sep or not repo:
+            raise ValueError(f"Expected 'repo=rate', got '{value}'")
+        repos[repo] = float(rate)
+    return repos
@@ -1,16 +1,20 @@
 import inspect
 import json
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from copy import deepcopy
+from fnmatch import fnmatchcase
 from datetime import date
-from typing import Optional, Union, List, Dict
+from typing import Optional, Union, List, Dict, Iterable, NamedTuple
 from urllib.parse import quote
 from requests import HTTPError
 
 import cfgv
 from hurry.filesize import size
 
+from artifactory_cleanup import aql
 from artifactory_cleanup.base_url_session import BaseUrlSession
+from artifactory_cleanup.errors import AqlConflictError, AqlNotSupportedError
 
 if sys.version_info >= (3, 8):
     from typing import TypedDict
@@ -28,6 +32,24 @@ class ArtifactDict(TypedDict):
     actual_sha1: str
 
 
+# Outcomes of CleanupPolicy.delete
+DELETED = "deleted"
+NOT_FOUND = "not_found"
+DRY_RUN = "dry_run"
+FAILED = "failed"
+
+
+class DeleteResult(NamedTuple):
+    artifact: ArtifactDict
+    # DELETED, NOT_FOUND, DRY_RUN or FAILED
+    outcome: str
+    # Seconds
+    duration: float
+    error: Optional[str] = None
+    # time.monotonic() when the delete finished
+    finished: Optional[float] = None
+
+
 class ArtifactsList(List[ArtifactDict]):
     def keep(self, artifacts):
         """Just a shortcut for better readability"""
@@ -39,13 +61,49 @@ class ArtifactsList(List[ArtifactDict]):
         """
         if not isinstance(artifacts, list):
             artifacts = [artifacts]
+        self.remove_many(artifacts)
+
+    def keep_many(self, artifacts: Iterable[ArtifactDict]) -> None:
+        """Just a shortcut for better readability"""
+        self.remove_many(artifacts)
 
+    def remove_many(self, artifacts: Iterable[ArtifactDict]) -> None:
+        """
+        Remove artifacts and log that. We find artifacts by identity and compact the list once,
+        so it's one pass over the list however many artifacts we remove.
+        Collect artifacts of a rule and remove them with one call instead of a call per artifact
+
+        >>> artifacts = ArtifactsList({"path": "p", "name": str(i)} for i in range(5))
+        >>> artifacts.remove_many([artifacts[3], artifacts[1]])
+        Filter package p/3
+        Filter package p/1
+        >>> [x["name"] for x in artifacts]
+        ['0', '2', '4']
+        """
+        removed: Dict[int, ArtifactDict] = {}
+        counts: Dict[int, int] = {}
         for artifact in artifacts:
             print(f"Filter package {artifact['path']}/{artifact['name']}")
-            super().remove(artifact)
+            removed[id(artifact)] = artifact
+            counts[id(artifact)] = counts.get(id(artifact), 0) + 1
+        if not counts:
+            return
+
+        kept = []
+        for artifact in self:
+            if counts.get(id(artifact)):
+                counts[id(artifact)] -= 1
+            else:
+                kept.append(artifact)
+        self[:] = kept
+
+        # Equal artifacts that are not in the list themselves, like list.remove finds them
+        for key, count in counts.items():
+            for _ in range(count):
+                super().remove(removed[key])
 
     @classmethod
-    def from_response(cls, artifacts: List[Dict]) -> "ArtifactsList":
+    def from_response(cls, artifacts: Iterable[Dict]) -> "ArtifactsList":
         """
         :param artifacts: Pure AQL response
         """
@@ -64,7 +122,7 @@ class ArtifactsList(List[ArtifactDict]):
         else:
             artifact["properties"] = {}
 
-        if "stats" in artifact:
+        if artifact.get("stats"):
             artifact["stats"] = artifact["stats"][0]
         else:
             artifact["stats"] = {}
@@ -86,6 +144,17 @@ class Rule(object):
     # You can overwrite checks for config file
     schema: Optional[List[cfgv.Conditional]] = None
 
+    # CleanupPolicy sets it before `aql_add_text`: no rules before filter artifacts in memory,
+    # so the rule may sort and limit artifacts in AQL and get the same result as in `filter`
+    aql_sort_allowed: bool = False
+
+    # CleanupPolicy sets it before `aql_add_filter`: no rules before filter artifacts in memory only,
+    # so Artifactory may filter artifacts by `aql_pushdown` before them and they see the same artifacts
+    aql_pushdown_allowed: bool = True
+
+    # CleanupPolicy sets it if rules may sort and group artifacts with NumPy, see artifactory_cleanup.columnar
+    columnar: bool = False
+
     @classmethod
     def name(cls) -> str:
         return cls.__name__
@@ -124,8 +193,38 @@ class Rule(object):
 
         You can detect any conflicts with others rules here, if they conflict on AQL level.
         """
+        criteria = self.aql_pushdown() if self.aql_pushdown_allowed else None
+        if criteria is not None:
+            filters.append(criteria)
         return filters
 
+    def pushed_down(self) -> bool:
+        return self.aql_pushdown_allowed and self.aql_pushdown() is not None
+
+    def aql_pushdown(self) -> Optional[Dict]:
+        """
+        Translate the in-memory `filter` to AQL criteria, if it can be expressed in AQL.
+        Artifactory filters out artifacts on its side then, `filter` still runs after that as the exact check.
+
+        Return None if the rule can't be translated - it works in `filter` only.
+        """
+        return None
+
+    def aql_add_include(self, include: List[str]) -> List[str]:
+        """
+        Add fields that the rule reads in `filter` to `.include(<fields>)` AQL part,
+        so Artifactory sends only them and not all fields, properties and stats of an artifact.
+        https://www.jfrog.com/confluence/display/JFROG/Artifactory+Query+Language#ArtifactoryQueryLanguage-DisplayingSpecificFields
+
+        Use "created" for an item field, "@nuget.id" for a property and "stat.downloaded" for a stat.
+        "repo", "path", "name", "type", "size" and "actual_sha1" are always included.
+
+        If the rule has its own `filter` we don't know what it reads there - so we include everything by default.
+        """
+        if self.filters_in_memory():
+            include.extend(aql.INCLUDE_ALL)
+        return include
+
     def aql_add_text(self, aql: str) -> str:
         """
         You can change AQL text after applying all rules filters.
@@ -135,10 +234,13 @@ class Rule(object):
         """
         return aql
 
+    def filters_in_memory(self) -> bool:
+        return type(self).filter is not Rule.filter
+
     def filter(self, artifacts: ArtifactsList) -> ArtifactsList:
         """
         Filter artifacts after performing AQL query.
-        To keep artifacts - use `artifacts.remove(artifacts_to_keep)` method.
+        To keep artifacts - use `artifacts.keep_many(artifacts_to_keep)` method, one call for all of them.
 
         If you have your own logic - please overwrite the method in your Rule class.
         Here you can filter artifacts in memory, make additional calls to Artifactory or even call other services!
@@ -163,9 +265,23 @@ class CleanupPolicy(object):
 
     # domain_query in https://www.jfrog.com/confluence/display/JFROG/Artifactory+Query+Language#usage
     DOMAIN = "items"
+    # Fields that we need for any artifact to remove it and show the summary
+    AQL_INCLUDE = ["repo", "path", "name", "type", "size", "actual_sha1"]
+    # Read AQL response by chunks of that size
+    AQL_CHUNK_SIZE = 64 * 1024
 
     session: Optional[BaseUrlSession] = None
     today: date = None
+    # Fetch artifacts by pages of that size, 0 - fetch all artifacts with one query
+    aql_page_size: int = 0
+    # Fetch artifacts by repositories in parallel, split them by creation time if there are more than threshold
+    aql_shard: bool = False
+    aql_shard_threshold: int = 0
+    aql_workers: int = 1
+    # Let rules sort and limit artifacts in AQL. Off when artifacts come from a dump, not from the query
+    aql_sort: bool = True
+    # Fields that the run needs besides rules
+    aql_include: Iterable[str] = ()
 
     def __init__(self, name: str, *rules: Rule):
         if not isinstance(name, str):
@@ -177,6 +293,8 @@ class CleanupPolicy(object):
         self.name = name
         self.rules = list(rules)
         self.aql_text = None
+        self.aql_find_filters = None
+        self._aql_predicate = None
 
         # init object if passed not initialized class
         # for `rules.repo` rule, see above in the docstring
@@ -214,31 +332,62 @@ class CleanupPolicy(object):
                 "- Read README.md https://github.com/devopshq/artifactory-cleanup#readme"
             )
 
-    def init(self, session, today) -> None:
+    def init(
+        self,
+        session,
+        today,
+        aql_page_size: int = 0,
+        aql_shard: bool = False,
+        aql_shard_threshold: int = 0,
+        aql_workers: int = 1,
+        aql_sort: bool = True,
+        columnar: bool = False,
+        aql_include: Iterable[str] = (),
+    ) -> None:
         """
-        Set properties and apply them to all rules
+        Set properties and apply them to all rules.
+        ``aql_include`` - fields that the run needs besides rules, like ``created`` for the oldest first delete order
         """
         self.session = session
         self.today = today
+        self.aql_page_size = aql_page_size
+        self.aql_shard = aql_shard
+        self.aql_shard_threshold = aql_shard_threshold
+        self.aql_workers = aql_workers
+        self.aql_sort = aql_sort
+        self.aql_include = tuple(aql_include)
 
         for rule in self.rules:
             rule.init(session, today)
+            rule.columnar = columnar
 
     def build_aql_query(self) -> None:
         """
         Collect all aql queries into a single list so that the rules check for conflicts among themselves
         """
         aql_find_filters = self._get_aql_find_filters()
-        self.aql_text = self._get_aql_text(aql_find_filters)
+        self.aql_find_filters = self._optimize_aql_find_filters(aql_find_filters)
+        self.aql_text = self._get_aql_text(self.aql_find_filters or aql_find_filters)
+        self._aql_predicate = None
         print("*" * 80)
         print("Result AQL Query:")
         print(self.aql_text)
+        if self.aql_find_filters is None:
+            print("AQL filters can never match any artifact, the query will be skipped")
+        pushed_down = self._get_pushed_down_rules()
+        if pushed_down:
+            print(f"Rules pushed down to AQL: {', '.join(pushed_down)}")
         print("*" * 80)
 
     def _get_aql_find_filters(self) -> Dict:
         """Go over all rules and get .find filters"""
         filters = []
+        filtered_before = False
         for rule in self.rules:
+            # A rule like KeepLatestNFiles must see all artifacts, not only ones that a rule after it pushes down
+            rule.aql_pushdown_allowed = not filtered_before
+            filtered_before = filtered_before or (rule.filters_in_memory() and not rule.pushed_down())
+
             before_query_list = deepcopy(filters)
             print(f"Add AQL Filter - rule: {rule.name()} - {rule.title()}")
             filters = rule.aql_add_filter(filters)
@@ -248,22 +397,53 @@ class CleanupPolicy(object):
                 print()
         return {"$and": filters}
 
+    @staticmethod
+    def _optimize_aql_find_filters(filters: Dict) -> Optional[Dict]:
+        """Flatten and simplify filters, so Artifactory gets a simpler query. None if filters are contradictory"""
+        optimized = aql.optimize(filters)
+        if optimized != filters:
+            print("Optimize AQL query")
+            print("Before AQL query: {}".format(filters))
+            print("After AQL query: {}".format(optimized))
+            print()
+        return optimized
+
+    def _get_pushed_down_rules(self) -> List[str]:
+        """Rules that filter artifacts in memory and in AQL as well"""
+        return [rule.name() for rule in self.rules if rule.pushed_down()]
+
     def _get_aql_text(self, find_filters: Dict) -> str:
         """
         Collect from all rules additional texts of requests
         """
-        filters_text = json.dumps(find_filters)
-        aql = f'{self.DOMAIN}.find({filters_text}).include("*", "property", "stat")'
+        aql_text = self._get_aql_base_text(find_filters)
 
+        filtered_before = False
         for rule in self.rules:
-            before_aql = aql
+            rule.aql_sort_allowed = self.aql_sort and not filtered_before
+            filtered_before = filtered_before or rule.filters_in_memory()
+
+            before_aql = aql_text
             print(f"Add AQL Text - rule: {rule.name()} - {rule.title()}")
-            aql = rule.aql_add_text(aql)
-            if before_aql != aql:
+            aql_text = rule.aql_add_text(aql_text)
+            if before_aql != aql_text:
                 print("Before AQL text: {}".format(before_aql))
-                print("After AQL text: {}".format(aql))
+                print("After AQL text: {}".format(aql_text))
                 print()
-        return aql
+        return aql_text
+
+    def _get_aql_base_text(self, find_filters: Dict) -> str:
+        """The query before rules add their texts"""
+        filters_text = json.dumps(find_filters)
+        include_text = aql.include_text(self._get_aql_include())
+        return f"{self.DOMAIN}.find({filters_text}).include({include_text})"
+
+    def _get_aql_include(self) -> List[str]:
+        """Go over all rules and get fields they need"""
+        include = list(self.AQL_INCLUDE) + list(self.aql_include)
+        for rule in self.rules:
+            include = rule.aql_add_include(include)
+        return include
 
     def get_artifacts(self) -> ArtifactsList:
         """
@@ -271,11 +451,160 @@ class CleanupPolicy(object):
         :return list of artifacts
         """
         assert self.aql_text, "Call build_aql_query before calling get_artifacts"
-        r = self.session.post("/api/search/aql", data=self.aql_text)
-        r.raise_for_status()
-        content = r.json()
-        artifacts = content["results"]
-        return ArtifactsList.from_response(artifacts)
+        if self.aql_find_filters is None:
+            print("AQL filters are contradictory, skip the query")
+            return ArtifactsList()
+
+        if (self.aql_page_size or self.aql_shard) and aql.has_sort_or_limit(self.aql_text):
+            print("AQL query has its own sort or limit, fetch all artifacts with one query")
+            return self._post_aql(self.aql_text)
+
+        if self.aql_shard:
+            return self._get_artifacts_by_shards()
+        return self._fetch_artifacts(self.aql_find_filters)
+
+    def get_artifacts_from(self, artifacts: Iterable[ArtifactDict]) -> ArtifactsList:
+        """
+        Pick artifacts that the AQL query of the policy would return from already fetched ones, like a repository dump.
+        Artifacts must have all fields that the policy filters and includes.
+        The criteria are compiled once per query, so millions of artifacts take seconds
+        """
+        assert self.aql_text, "Call build_aql_query before calling get_artifacts_from"
+        if self.aql_find_filters is None:
+            return ArtifactsList()
+        if self.aql_text != self._get_aql_base_text(self.aql_find_filters):
+            raise AqlNotSupportedError(f"Policy '{self.name}' has its own AQL text: {self.aql_text}")
+
+        if self._aql_predicate is None:
+            self._aql_predicate = aql.compile_criteria(self.aql_find_filters)
+        match = self._aql_predicate
+        include = self._get_aql_include()
+        return ArtifactsList(aql.project(artifact, include) for artifact in artifacts if match(artifact))
+
+    def _fetch_artifacts(self, filters: Dict) -> ArtifactsList:
+        """Get artifacts by the policy AQL query, but with other filters"""
+        if self.aql_page_size and self._can_page():
+            return self._get_artifacts_by_pages(filters)
+        return self._post_aql(self._get_aql_text_with(filters))
+
+    def _can_page(self) -> bool:
+        unsortable = aql.get_unsortable_include(self.aql_text)
+        if unsortable:
+            print(f"Artifactory can't page AQL query that includes {', '.join(unsortable)}, fetch it with one query")
+        return not unsortable
+
+    def _get_aql_text_with(self, filters: Dict) -> str:
+        return self.aql_text.replace(json.dumps(self.aql_find_filters), json.dumps(filters), 1)
+
+    def _post_aql(self, aql_text: str) -> ArtifactsList:
+        """
+        Decode and prepare artifacts one by one while they're coming,
+        so we never keep the raw response and the decoded one in memory at the same time
+        """
+        with self.session.post("/api/search/aql", data=aql_text, stream=True) as r:
+            r.raise_for_status()
+            chunks = r.iter_content(chunk_size=self.AQL_CHUNK_SIZE)
+            return ArtifactsList.from_response(aql.iter_results(chunks, compact=True))
+
+    def _get_artifacts_by_pages(self, filters: Dict) -> ArtifactsList:
+        """
+        Fetch artifacts page by page, using the last artifact of the page as a cursor for the next one.
+        The next page is already on the way while we prepare the current one.
+        """
+        artifacts = ArtifactsList()
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            page = executor.submit(self._get_page, filters, last=None)
+            while page:
+                results = page.result()
+                page = None
+                if len(results) == self.aql_page_size:
+                    page = executor.submit(self._get_page, filters, last=results[-1])
+                artifacts.extend(results)
+                print(f"Fetched {len(artifacts)} artifacts")
+        return artifacts
+
+    def _get_page(self, filters: Dict, last: Optional[ArtifactDict]) -> ArtifactsList:
+        if last is not None:
+            filters = {"$and": [filters, aql.keyset_filter(last)]}
+        aql_text = aql.page_aql(self._get_aql_text_with(filters), self.aql_page_size)
+        return self._post_aql(aql_text)
+
+    def _get_artifacts_by_shards(self) -> ArtifactsList:
+        """
+        Split the query by repositories, and then by creation time if a repository has too many artifacts.
+        Shards run in parallel, so one slow repository doesn't block others
+        """
+        repos = self._get_shard_repos()
+        if not repos:
+            print("Can not find repositories in AQL filters, fetch all artifacts with one query")
+            return self._fetch_artifacts(self.aql_find_filters)
+
+        shards = [aql.repo_shard(repo) for repo in repos]
+        with ThreadPoolExecutor(max_workers=self.aql_workers) as executor:
+            results = list(executor.map(self._probe_shard, shards))
+
+            # Split large shards by time windows, we know their creation time from a light query
+            for i, (shard, artifacts) in enumerate(zip(shards, results)):
+                if artifacts is not None:
+                    continue
+                windows = aql.created_windows(self._get_shard_created(shard), self.aql_shard_threshold)
+                window_shards = [{"$and": [shard, window]} for window in windows] or [shard]
+                results[i] = ArtifactsList()
+                for window_artifacts in executor.map(self._get_shard, window_shards):
+                    results[i].extend(window_artifacts)
+
+        artifacts = ArtifactsList()
+        for shard_artifacts in results:
+            artifacts.extend(shard_artifacts)
+        return artifacts
+
+    def _probe_shard(self, shard: Dict) -> Optional[ArtifactsList]:
+        """
+        Fetch the shard if it's not larger than the threshold, None if we have to split it.
+        Artifactory stops after threshold + 1 artifacts, so a large shard costs only that much
+        """
+        if not self.aql_shard_threshold:
+            return self._get_shard(shard)
+
+        filters = {"$and": [self.aql_find_filters, shard]}
+        limit = self.aql_shard_threshold + 1
+        try:
+            aql_text = aql.page_aql(self._get_aql_text_with(filters), limit)
+        except AqlConflictError:
+            # Artifactory can't limit the query, count the shard with a light one before fetching it
+            probe = self._post_aql(aql.page_aql(self._get_shard_created_text(filters), limit))
+            return self._get_shard(shard) if len(probe) < limit else None
+
+        artifacts = self._post_aql(aql_text)
+        if len(artifacts) >= limit:
+            print(f"AQL shard {json.dumps(shard)}: more than {self.aql_shard_threshold} artifacts, split it")
+            return None
+        print(f"AQL shard {json.dumps(shard)}: {len(artifacts)} artifacts")
+        return artifacts
+
+    def _get_shard_created(self, shard: Dict) -> List[str]:
+        """Creation time of all artifacts in the shard, without other fields"""
+        artifacts = self._post_aql(self._get_shard_created_text({"$and": [self.aql_find_filters, shard]}))
+        return [artifact["created"] for artifact in artifacts]
+
+    def _get_shard_created_text(self, filters: Dict) -> str:
+        # Artifactory sorts only by included fields, so keep the keyset to limit the query
+        include = list(aql.KEYSET_FIELDS) + ["created"]
+        return f"{self.DOMAIN}.find({json.dumps(filters)}).include({aql.include_text(include)})"
+
+    def _get_shard(self, shard: Dict) -> ArtifactsList:
+        artifacts = self._fetch_artifacts({"$and": [self.aql_find_filters, shard]})
+        print(f"AQL shard {json.dumps(shard)}: {len(artifacts)} artifacts")
+        return artifacts
+
+    def _get_shard_repos(self) -> List[str]:
+        repos, masks = aql.get_repos(self.aql_find_filters)
+        if masks:
+            r = self.session.get("/api/repositories")
+            r.raise_for_status()
+            names = [repo["key"] for repo in r.json()]
+            repos.extend(name for name in names if any(fnmatchcase(name, mask) for mask in masks))
+        return list(dict.fromkeys(repos))
 
     def filter(self, artifacts: ArtifactsList) -> ArtifactsList:
         """
@@ -295,35 +624,49 @@ class CleanupPolicy(object):
                 print()
         return artifacts
 
-    def delete(self, artifact: ArtifactDict, destroy: bool, ignore_not_found: bool = False) -> None:
-        """
-        Delete the artifact
-        :param artifact: artifact to remove
-        :param destroy: if False - just log the action, do not actually remove the artifact
-        :param display_format: specify the format string for the file to delete, for example "'{path}' - {size}"
-        :param ignore_not_found: if True - do not raise an error if the artifact is not found
-        """
-
+    @staticmethod
+    def get_artifact_path(artifact: ArtifactDict) -> str:
+        """Quoted path of the artifact relative to the Artifactory URL"""
         if artifact["path"] == ".":
             path = "{repo}/{name}"
         else:
             path = "{repo}/{path}/{name}"
+        return quote(path.format(**artifact))
 
-        artifact_path = path.format(**artifact)
-        artifact_path = quote(artifact_path)
+    def log_delete(self, artifact: ArtifactDict, destroy: bool) -> str:
+        """Show what we're going to delete and return the path to delete"""
+        artifact_path = self.get_artifact_path(artifact)
         artifact_size = artifact.get("size", 0) or 0
         artifact_hash = artifact.get("actual_sha1", "")
 
         if not destroy:
             print(f"DEBUG - we would delete '{artifact_path}' ({artifact_hash}) - {size(artifact_size)}")
-            return
-        print(f"DESTROY MODE - delete '{artifact_path}' ({artifact_hash}) - {size(artifact_size)}")
+        else:
+            print(f"DESTROY MODE - delete '{artifact_path}' ({artifact_hash}) - {size(artifact_size)}")
+        return artifact_path
+
+    def delete(self, artifact: ArtifactDict, destroy: bool, ignore_not_found: bool = False) -> str:
+        """
+        Delete the artifact
+        :param artifact: artifact to remove
+        :param destroy: if False - just log the action, do not actually remove the artifact
+        :param display_format: specify the format string for the file to delete, for example "'{path}' - {size}"
+        :param ignore_not_found: if True - do not raise an error if the artifact is not found
+        :return DELETED, NOT_FOUND or DRY_RUN
+        """
+        artifact_path = self.log_delete(artifact, destroy)
+        if not destroy:
+            return DRY_RUN
         r = self.session.delete(artifact_path)
         try:
             r.raise_for_status()
         except HTTPError as e:
+            if e.response.status_code == 404 and getattr(e.response, "attempts", 1) > 1:
+                print(f"DELETED - '{artifact_path}' was deleted by a previous attempt that didn't get the response.")
+                return DELETED
             if e.response.status_code == 404 and ignore_not_found:
                 print(f"NOT FOUND - '{artifact_path}' was not found, so not deleted.")
-                return
+                return NOT_FOUND
             raise
+        return DELETED
 
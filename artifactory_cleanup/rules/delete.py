@@ -1,6 +1,7 @@
 from datetime import timedelta
 import re
 
+from artifactory_cleanup import columnar
 from artifactory_cleanup.rules import utils
 from artifactory_cleanup.rules.base import ArtifactsList, Rule
 
@@ -123,6 +124,9 @@ class DeleteEmptyFolders(Rule):
         filters.append(all_files_dict)
         return filters
 
+    def aql_add_include(self, include):
+        return include
+
     def filter(self, artifacts):
         repositories = utils.build_repositories(artifacts)
         folders = utils.get_empty_folders(repositories)
@@ -136,11 +140,20 @@ class DeleteByRegexpName(Rule):
 
     def __init__(self, regex_pattern):
         self.regex_pattern = rf"{regex_pattern}"
+        self._regexp = re.compile(self.regex_pattern)
+
+    def aql_pushdown(self):
+        mask = utils.regexp_to_mask(self.regex_pattern)
+        if mask is None:
+            return None
+        return {"name": {"$match": mask}}
+
+    def aql_add_include(self, include):
+        return include
 
     def filter(self, artifacts: ArtifactsList) -> ArtifactsList:
-        for artifact in artifacts[:]:
-            if re.match(self.regex_pattern, artifact["name"]) is None:
-                artifacts.remove(artifact)
+        match = self._regexp.match
+        artifacts.remove_many([artifact for artifact in artifacts if match(artifact["name"]) is None])
         return artifacts
 
 
@@ -153,9 +166,18 @@ class DeleteLeastRecentlyUsedFiles(Rule):
     def __init__(self, keep: int):
         self.keep = keep
 
+    def aql_add_include(self, include):
+        include.extend(["created", "stat.downloaded"])
+        return include
+
     def filter(self, artifacts: ArtifactsList) -> ArtifactsList:
-        # List will contain fresh files at the beginning
-        artifacts.sort(key=utils.sort_by_usage, reverse=True)
-        kept_artifacts = artifacts[:self.keep]
-        artifacts.keep(kept_artifacts)
+        if self.columnar:
+            table = columnar.ArtifactTable(artifacts)
+            kept, _ = columnar.most_recently_used(table, self.keep)
+            artifacts.keep_many(table.rows(kept))
+            return artifacts
+
+        # The most recently used files
+        kept_artifacts = utils.top_n(artifacts, self.keep, key=utils.sort_by_usage, reverse=True)
+        artifacts.keep_many(kept_artifacts)
         return artifacts
@@ -8,7 +8,7 @@ from artifactory import ArtifactoryPath
 from artifactory_cleanup.context_managers import get_context_managers
 from artifactory_cleanup.rules import Rule
 from artifactory_cleanup.rules.base import ArtifactsList
-from artifactory_cleanup.rules.utils import to_masks
+from artifactory_cleanup.rules.utils import to_masks, top_n
 
 ctx_mgr_block, ctx_mgr_test = get_context_managers()
 
@@ -79,6 +79,9 @@ class RuleForDocker(Rule):
         filters.append({"name": {"$match": self.MANIFEST_FILENAME}})
         return filters
 
+    def aql_add_include(self, include):
+        return include
+
     def filter(self, artifacts):
         """Determines the size of deleted images"""
         artifacts = self._manifest_to_docker_images(artifacts)
@@ -218,6 +221,10 @@ class KeepLatestNDockerImages(RuleForDocker):
     def __init__(self, count: int):
         self.count = count
 
+    def aql_add_include(self, include):
+        include.extend(["updated", "sha256"])
+        return include
+
     def filter(self, artifacts):
         artifacts = self._manifest_to_docker_images(artifacts)
         artifacts_by_path = defaultdict(list)
@@ -226,15 +233,17 @@ class KeepLatestNDockerImages(RuleForDocker):
             path = artifact["path"]
             artifacts_by_path[path].append(artifact)
 
+        good_artifacts = []
         for path, _artifacts in artifacts_by_path.items():
-            sha256s_to_keep = set()
-            _artifacts.sort(reverse=True, key=lambda x: x['updated'])
-            for artifact in _artifacts:
-                if len(sha256s_to_keep) < self.count:
-                    sha256s_to_keep.add(artifact['sha256'])
-                if artifact['sha256'] in sha256s_to_keep:
-                    artifacts.keep(artifact)
-
+            # The latest update of every digest, the first one wins ties
+            updated = {}
+            for index, artifact in enumerate(_artifacts):
+                rank = (artifact['updated'], -index)
+                updated[artifact['sha256']] = max(rank, updated.get(artifact['sha256'], rank))
+            sha256s_to_keep = set(top_n(updated, self.count, key=updated.get))
+            good_artifacts.extend(x for x in _artifacts if x['sha256'] in sha256s_to_keep)
+
+        artifacts.keep_many(good_artifacts)
         return artifacts
 
 class KeepLatestNVersionImagesByProperty(RuleForDocker):
@@ -254,13 +263,18 @@ class KeepLatestNVersionImagesByProperty(RuleForDocker):
     ):
         self.count = count
         self.custom_regexp = custom_regexp
+        self._regexp = re.compile(custom_regexp)
         self.property = r"docker.manifest"
         self.number_of_digits_in_version = number_of_digits_in_version
 
+    def aql_add_include(self, include):
+        include.append(f"@{self.property}")
+        return include
+
     def get_version(self, artifact) -> Tuple:
         """Parse property and get version from it"""
         value = artifact["properties"][self.property]
-        match = re.match(self.custom_regexp, value)
+        match = self._regexp.match(value)
         if not match:
             raise ValueError(f"Can not find version in '{artifact}'")
         version_str = '.'.join(map(str, match.groups()))
@@ -285,11 +299,11 @@ class KeepLatestNVersionImagesByProperty(RuleForDocker):
         # Group artifacts by major/minor or patch
         grouped = pydash.group_by(artifacts, iteratee=_groupby)
 
+        good_artifacts = []
         for main_version, artifacts_ in grouped.items():
-            artifacts_ = list(artifacts_)
-            artifacts_.sort(key=self.get_version, reverse=True)
             # Keep latest N artifacts
-            artifacts.keep(artifacts_[: self.count])
+            good_artifacts.extend(top_n(artifacts_, self.count, key=self.get_version, reverse=True))
+        artifacts.keep_many(good_artifacts)
 
         return super().filter(artifacts)
 
@@ -311,6 +325,10 @@ class DeleteDockerImageIfNotContainedInProperties(RuleForDocker):
         self.image_prefix = image_prefix
         self.full_docker_repo_name = full_docker_repo_name
 
+    def aql_add_include(self, include):
+        include.append("property")
+        return include
+
     def get_properties_dict(self, artifacts):
         properties_dict = defaultdict(dict)
 
@@ -394,6 +412,10 @@ class DeleteDockerImageIfNotContainedInPropertiesValue(RuleForDocker):
         self.image_prefix = image_prefix
         self.full_docker_repo_name = full_docker_repo_name
 
+    def aql_add_include(self, include):
+        include.append("property")
+        return include
+
     def get_properties_values(self, artifacts):
         """Creates a list of artifact property values if the value starts with self.properties_prefix"""
         properties_values = set()
@@ -1,4 +1,4 @@
-from artifactory_cleanup.rules.utils import to_masks
+from artifactory_cleanup.rules.utils import to_masks, regexp_to_mask
 from artifactory_cleanup.rules.base import ArtifactsList, Rule
 import re
 
@@ -77,9 +77,18 @@ class FilterByRegexpPath(Rule):
 
     def __init__(self, path):
         self.path = rf"{path}"
+        self._regexp = re.compile(self.path)
+
+    def aql_pushdown(self):
+        mask = regexp_to_mask(self.path)
+        if mask is None:
+            return None
+        return {"path": {"$match": mask}}
+
+    def aql_add_include(self, include):
+        return include
 
     def filter(self, artifacts: ArtifactsList) -> ArtifactsList:
-        for artifact in artifacts[:]:
-            if re.match(self.path, artifact["path"]) is None:
-                artifacts.keep(artifact)
+        match = self._regexp.match
+        artifacts.keep_many([artifact for artifact in artifacts if match(artifact["path"]) is None])
         return artifacts
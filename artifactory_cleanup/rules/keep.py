@@ -3,7 +3,14 @@ from collections import defaultdict
 from itertools import groupby
 
 
+from artifactory_cleanup import columnar
+from artifactory_cleanup.aql import add_sort_limit
+from artifactory_cleanup.errors import AqlConflictError
 from artifactory_cleanup.rules.base import Rule
+from artifactory_cleanup.rules.utils import top_n
+
+# A feature of a NuGet version: "feature" in "1.2.3-feature"
+NUGET_FEATURE = re.compile(r"-(.*)")
 
 
 class KeepLatestNupkgNVersions(Rule):
@@ -12,6 +19,10 @@ class KeepLatestNupkgNVersions(Rule):
     def __init__(self, count: int):
         self.count = count
 
+    def aql_add_include(self, include):
+        include.extend(["@nuget.id", "@nuget.version"])
+        return include
+
     def filter(self, artifacts):
         artifact_grouped = defaultdict(lambda: defaultdict(lambda: defaultdict(list)))
 
@@ -29,7 +40,7 @@ class KeepLatestNupkgNVersions(Rule):
             major, minor, _ = nuget_version.split(".", maxsplit=2)
             nuget_major_minor = (major, minor)
 
-            nuget_feature = re.findall(r"-(.*)", nuget_version)
+            nuget_feature = NUGET_FEATURE.findall(nuget_version)
             nuget_feature = nuget_feature[0] if nuget_feature else ""
 
             artifact_grouped[nuget_id][nuget_feature][nuget_major_minor].append(
@@ -50,22 +61,15 @@ class KeepLatestNupkgNVersions(Rule):
                     artifacts_by_version = {
                         x["properties"]["nuget.version"]: x for x in _artifacts
                     }
-                    sorted_artifact = sorted(
-                        artifacts_by_version.items(), key=self.keyfunc
+                    latest = top_n(
+                        artifacts_by_version.items(), self.count, key=self.keyfunc
                     )
-                    sorted_artifact = [x[1] for x in sorted_artifact]
-                    artifact_count = len(sorted_artifact)
-                    good_artifact_count = artifact_count - self.count
-                    if good_artifact_count < 0:
-                        good_artifact_count = 0
-
-                    artifact_grouped[package][feature][version] = sorted_artifact[
-                        good_artifact_count:
-                    ]
+                    artifact_grouped[package][feature][version] = [x[1] for x in latest]
         return artifact_grouped
 
     def remove_founded_artifacts(self, artifact_grouped, artifacts):
         # Remove found artifact
+        good_artifacts = []
         for package, features in artifact_grouped.items():
             for feature, versions in features.items():
                 for version, _artifacts in versions.items():
@@ -77,7 +81,8 @@ class KeepLatestNupkgNVersions(Rule):
                                 **locals()
                             )
                         )
-                        artifacts.keep(artifact)
+                        good_artifacts.append(artifact)
+        artifacts.keep_many(good_artifacts)
         return artifacts
 
     @staticmethod
@@ -98,16 +103,37 @@ class KeepLatestNFiles(Rule):
 
     def __init__(self, count: int):
         self.count = count
+        self.kept_by_aql = False
+
+    def aql_add_include(self, include):
+        include.append("created")
+        return include
+
+    def aql_add_text(self, aql):
+        """Ask Artifactory to skip the latest files, so we don't get them at all"""
+        self.kept_by_aql = False
+        if not self.aql_sort_allowed:
+            return aql
+        try:
+            aql = add_sort_limit(aql, sort={"$desc": ["created"]}, offset=self.count)
+        except AqlConflictError as exc:
+            print(f"Keep the latest files in memory: {exc}")
+            return aql
+        self.kept_by_aql = True
+        return aql
 
     def filter(self, artifacts):
+        if self.columnar:
+            table = columnar.ArtifactTable(artifacts)
+            kept, deleted = columnar.latest_n(table, 0 if self.kept_by_aql else self.count)
+            artifacts.keep_many(table.rows(kept))
+            artifacts[:] = table.rows(deleted)
+            return artifacts
+
+        if not self.kept_by_aql:
+            artifacts.keep_many(top_n(artifacts, self.count, key=lambda x: x["created"]))
+        # Delete the oldest first
         artifacts.sort(key=lambda x: x["created"])
-        artifact_count = len(artifacts)
-        good_artifact_count = artifact_count - self.count
-        if good_artifact_count < 0:
-            good_artifact_count = 0
-
-        good_artifacts = artifacts[good_artifact_count:]
-        artifacts.keep(good_artifacts)
         return artifacts
 
 
@@ -117,23 +143,31 @@ class KeepLatestNFilesInFolder(Rule):
     def __init__(self, count: int):
         self.count = count
 
+    def aql_add_include(self, include):
+        include.append("created")
+        return include
+
     def filter(self, artifacts):
-        artifacts.sort(key=lambda x: x["created"])
+        if self.columnar:
+            table = columnar.ArtifactTable(artifacts)
+            kept, deleted = columnar.latest_n_in_folder(table, self.count)
+            artifacts.keep_many(table.rows(kept))
+            artifacts[:] = table.rows(deleted)
+            return artifacts
+
         artifacts_by_path = defaultdict(list)
 
         for artifact in artifacts:
             path = artifact["path"]
             artifacts_by_path[path].append(artifact)
 
+        good_artifacts = []
         for path, _artifacts in artifacts_by_path.items():
-            artifact_count = len(_artifacts)
-            good_artifact_count = artifact_count - self.count
-            if good_artifact_count < 0:
-                good_artifact_count = 0
-
-            good_artifacts = _artifacts[good_artifact_count:]
-            artifacts.keep(good_artifacts)
+            good_artifacts.extend(top_n(_artifacts, self.count, key=lambda x: x["created"]))
 
+        artifacts.keep_many(good_artifacts)
+        # Delete the oldest first
+        artifacts.sort(key=lambda x: x["created"])
         return artifacts
 
 
@@ -146,13 +180,18 @@ class KeepLatestVersionNFilesInFolder(Rule):
     def __init__(self, count, custom_regexp=r"([\d]+\.[\d]+\.[\d]+)"):
         self.count = count
         self.custom_regexp = custom_regexp
+        self._regexp = re.compile(custom_regexp)
+
+    def aql_add_include(self, include):
+        return include
 
     def filter(self, artifacts):
         artifacts_by_path_and_name = defaultdict(list)
+        good_artifacts = []
 
-        for artifact in artifacts[:]:
+        for artifact in artifacts:
             path = artifact["path"]
-            version = re.findall(self.custom_regexp, artifact["name"])
+            version = self._regexp.findall(artifact["name"])
             # save the version only if it was possible to uniquely determine it
             if len(version) == 1:
                 version_str = (
@@ -170,23 +209,17 @@ class KeepLatestVersionNFilesInFolder(Rule):
                         artifact["path"], artifact["name"]
                     )
                 )
-                artifacts.keep(artifact)
+                good_artifacts.append(artifact)
 
         for artifactory_with_version in artifacts_by_path_and_name.values():
-            artifactory_with_version.sort(
-                key=lambda x: [int(x) for x in x[0].split(".")]
-            )
-
-            artifact_count = len(artifactory_with_version)
-            good_artifact_count = artifact_count - self.count
-            if good_artifact_count < 0:
-                good_artifact_count = 0
-
             # artifactory_with_version contains list of (Version, Artifact)  pairs
             # Get the artifacts from that for return to 'keep'
-            good_sets = artifactory_with_version[good_artifact_count:]
-            good_artifacts = [good[1] for good in good_sets]
-
-            artifacts.keep(good_artifacts)
+            good_sets = top_n(
+                artifactory_with_version,
+                self.count,
+                key=lambda x: [int(x) for x in x[0].split(".")],
+            )
+            good_artifacts.extend(good[1] for good in good_sets)
 
+        artifacts.keep_many(good_artifacts)
         return artifacts
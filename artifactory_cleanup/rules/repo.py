@@ -121,6 +121,10 @@ class PropertyNeq(Rule):
         self.property_key = property_key
         self.property_value = str(property_value)
 
+    def aql_add_include(self, include):
+        include.append(f"@{self.property_key}")
+        return include
+
     def filter(self, artifacts):
         good_artifact = [
             x
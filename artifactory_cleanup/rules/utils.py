@@ -1,10 +1,14 @@
+import heapq
 from collections import defaultdict
-from typing import Dict, List, Tuple, Optional, Union
+from operator import itemgetter
+from typing import Any, Callable, Dict, Iterable, List, Set, Tuple, Optional, TypeVar, Union
 
 from treelib import Node, Tree
 
 from artifactory_cleanup.rules.base import ArtifactDict, ArtifactsList
 
+T = TypeVar("T")
+
 
 def is_repository(data):
     return data["path"] == "." and data["name"] == "."
@@ -69,6 +73,7 @@ class ArtifactNode(Node):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.files = 0
+        self.deleted = False
 
     def is_file(self):
         if not self.data:
@@ -153,6 +158,35 @@ class RepositoryTree(Tree):
             folders.extend(_folder)
         return folders
 
+    def mark_deleted(self, deleted: Set[str], nid=None) -> bool:
+        """
+        Mark artifacts from ``deleted`` full paths and folders whose children are all deleted. DFS traversing.
+        An empty folder is deleted only if it's in ``deleted`` itself
+        """
+        nid = nid or self.root
+        node: ArtifactNode = self.get_node(nid)
+        if node.identifier in deleted:
+            node.deleted = True
+            return node.deleted
+
+        children: List[ArtifactNode] = self.children(nid)
+        # Visit all children, not only until the first one that stays
+        marks = [self.mark_deleted(deleted, child.identifier) for child in children]
+        node.deleted = bool(marks) and all(marks)
+        return node.deleted
+
+    def get_highest_deleted(self, nid=None) -> List[ArtifactNode]:
+        """Get the highest deleted folders and files for the repository, the root is never deleted. DFS traversing"""
+        nid = nid or self.root
+        node: ArtifactNode = self.get_node(nid)
+        if not node.is_root() and node.deleted:
+            return [node]
+
+        nodes = []
+        for child in self.children(nid):
+            nodes.extend(self.get_highest_deleted(nid=child.identifier))
+        return nodes
+
 
 def build_repositories(artifacts: List[Dict]) -> List[RepositoryTree]:
     """Build tree-like repository objects from raw Artifactory data"""
@@ -190,8 +224,82 @@ def to_masks(masks: Union[str, List[str]]):
         raise AttributeError("'masks' argument must by list of string OR string")
 
 
+def regexp_to_mask(pattern: str) -> Optional[str]:
+    r"""
+    Translate a regexp for ``re.match`` to AQL ``$match`` mask, if it's a simple one.
+    ``re.match`` anchors only the beginning, so the mask ends with "*" unless the regexp ends with "$"
+
+    >>> regexp_to_mask(r"release-.*\.zip$")
+    'release-*.zip'
+    >>> regexp_to_mask(r"^build.")
+    'build?*'
+    >>> regexp_to_mask(r"build-\d+") is None
+    True
+    """
+    mask = []
+    i = 0
+    if pattern.startswith("^"):
+        i = 1
+    anchored = False
+    while i < len(pattern):
+        char = pattern[i]
+        if char == "\\":
+            escaped = pattern[i + 1 : i + 2]
+            # \d, \w, \b and others are classes, not plain symbols
+            if not escaped or escaped.isalnum() or escaped in "*?":
+                return None
+            mask.append(escaped)
+            i += 2
+        elif pattern.startswith((".*?", ".*"), i):
+            if not mask or mask[-1] != "*":
+                mask.append("*")
+            i += 3 if pattern.startswith(".*?", i) else 2
+        elif char == ".":
+            mask.append("?")
+            i += 1
+        elif char == "$" and i == len(pattern) - 1:
+            anchored = True
+            i += 1
+        elif char in "^$*+?{}[]()|":
+            return None
+        else:
+            mask.append(char)
+            i += 1
+
+    if not anchored and (not mask or mask[-1] != "*"):
+        mask.append("*")
+    mask = "".join(mask)
+    if mask == "*":
+        # Matches everything, nothing to push down
+        return None
+    return mask
+
+
+def top_n(items: Iterable[T], n: int, key: Callable[[T], Any], reverse: bool = False) -> List[T]:
+    """
+    The same as ``sorted(items, key=key)[-n:]``, or ``sorted(items, key=key, reverse=True)[:n]`` with ``reverse``,
+    but without sorting all items: a heap of ``n`` items, O(len(items) * log(n)).
+    The key is computed once per item, equal items keep their order like in the stable sort
+
+    >>> top_n(["bb", "a", "cc", "d"], 2, key=len)
+    ['bb', 'cc']
+    >>> top_n(["bb", "a", "cc", "d"], 2, key=len, reverse=True)
+    ['bb', 'cc']
+    >>> top_n([3, 1, 2], 5, key=lambda x: x)
+    [1, 2, 3]
+    """
+    if n <= 0:
+        return []
+    if reverse:
+        return heapq.nlargest(n, items, key=key)
+    # Later items win ties, like the tail of the stable sort
+    decorated = heapq.nlargest(n, ((key(item), index, item) for index, item in enumerate(items)), key=itemgetter(0, 1))
+    return [item for _, _, item in reversed(decorated)]
+
+
 def sort_by_usage(artifact: ArtifactDict) -> str:
-    try:
-        return artifact["stats"]["downloaded"]
-    except:
-        return artifact["created"]
+    """The last download, or the creation if nobody downloaded the artifact"""
+    stats = artifact.get("stats") or {}
+    if "downloaded" in stats:
+        return stats["downloaded"]
+    return artifact["created"]
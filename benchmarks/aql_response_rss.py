@@ -0,0 +1,90 @@
+"""
+Compare peak RSS of decoding a big AQL response at once (like ``r.json()``), item by item with
+``ArtifactsList.prepare`` and item by item with the schema-aware ``aql.ArtifactStream``.
+
+    python benchmarks/aql_response_rss.py --items 1000000 --properties 5
+
+Every mode runs in a fresh interpreter, so peak RSS of one mode does not affect the other.
+"""
+import argparse
+import json
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+CHUNK_SIZE = 64 * 1024
+MODES = ["json", "prepare", "stream"]
+
+
+def write_response(filename: Path, items: int, properties: int) -> None:
+    with open(filename, "w", encoding="utf-8") as fp:
+        fp.write('{"results": [\n')
+        for i in range(items):
+            artifact = {
+                "repo": "libs-snapshot-local",
+                "path": f"org/acme/project/{i // 100}",
+                "name": f"project-{i}.jar",
+                "type": "file",
+                "size": 1000 + i,
+                "created": "2021-03-21T13:54:52.383+02:00",
+                "created_by": "admin",
+                "modified": "2021-03-21T13:54:32.000+02:00",
+                "modified_by": "admin",
+                "updated": "2021-03-21T13:54:52.384+02:00",
+                "actual_sha1": "11827853eed40e8b60f5d7e45f2a730915d7704d",
+                "properties": [{"key": f"build.p{j}", "value": str(i)} for j in range(properties)],
+                "stats": [{"downloaded": "2021-04-21T13:54:52.383+02:00", "downloads": 3}],
+            }
+            if i:
+                fp.write(",\n")
+            fp.write(json.dumps(artifact))
+        fp.write(f'],\n"range": {{"start_pos": 0, "end_pos": {items}, "total": {items}}}}}')
+
+
+def run_mode(mode: str, filename: Path) -> None:
+    from artifactory_cleanup import aql
+    from artifactory_cleanup.rules.base import ArtifactsList
+
+    started = time.perf_counter()
+    with open(filename, "rb") as fp:
+        if mode == "json":
+            # What requests does for r.json(): the whole body, the text and the decoded document
+            content = fp.read()
+            artifacts = ArtifactsList.from_response(json.loads(content.decode("utf-8"))["results"])
+        elif mode == "prepare":
+            chunks = iter(lambda: fp.read(CHUNK_SIZE), b"")
+            artifacts = ArtifactsList(ArtifactsList.prepare(x) for x in aql.iter_results(chunks))
+        else:
+            chunks = iter(lambda: fp.read(CHUNK_SIZE), b"")
+            artifacts = ArtifactsList.from_response(aql.iter_results(chunks, compact=True))
+    elapsed = time.perf_counter() - started
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"{mode:>6}: {len(artifacts)} artifacts, {elapsed:.1f}s, peak RSS {peak_mb:.0f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--items", type=int, default=1_000_000)
+    parser.add_argument("--properties", type=int, default=1, help="Properties per artifact")
+    parser.add_argument("--mode", choices=MODES)
+    parser.add_argument("--file")
+    args = parser.parse_args()
+
+    if args.mode:
+        run_mode(args.mode, Path(args.file))
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        filename = Path(tmp) / "aql.json"
+        write_response(filename, args.items, args.properties)
+        print(f"Response size: {filename.stat().st_size / 1024 / 1024:.0f} MB")
+        for mode in MODES:
+            cmd = [sys.executable, __file__, "--mode", mode, "--file", str(filename)]
+            subprocess.run(cmd, check=True)
+
+
+if __name__ == "__main__":
+    main()
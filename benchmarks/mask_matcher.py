@@ -0,0 +1,67 @@
+"""
+Compare checking names against many AQL "$match" masks one by one and with one ``MaskMatcher``,
+like ``IncludeFilename`` with a long list of masks checked in memory against a dump or a mirror.
+
+    python benchmarks/mask_matcher.py --names 1000000 --masks 200
+"""
+import argparse
+import random
+import time
+
+from artifactory_cleanup import aql
+
+EXTENSIONS = ["jar", "zip", "pom", "tar.gz", "nupkg", "whl", "json", "txt"]
+
+
+def make_masks(count: int, rnd: random.Random):
+    masks = []
+    for i in range(count):
+        kind = i % 4
+        if kind == 0:
+            masks.append(f"project-{i}-*")
+        elif kind == 1:
+            masks.append(f"*-{i}.{rnd.choice(EXTENSIONS)}")
+        elif kind == 2:
+            masks.append(f"project-{i}-?.?.*.{rnd.choice(EXTENSIONS)}")
+        else:
+            masks.append(f"project-{i}-1.0.0.jar")
+    return masks
+
+
+def make_names(count: int, rnd: random.Random):
+    return [
+        f"project-{rnd.randrange(400)}-{rnd.randrange(10)}.{rnd.randrange(10)}.{rnd.randrange(100)}"
+        f".{rnd.choice(EXTENSIONS)}"
+        for _ in range(count)
+    ]
+
+
+def measure(name: str, match, names) -> int:
+    started = time.perf_counter()
+    matched = sum(1 for value in names if match(value))
+    print(f"{name:>10}: {time.perf_counter() - started:.1f}s, {matched} matched")
+    return matched
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--names", type=int, default=1_000_000)
+    parser.add_argument("--masks", type=int, default=200)
+    args = parser.parse_args()
+
+    rnd = random.Random(0)
+    masks = make_masks(args.masks, rnd)
+    names = make_names(args.names, rnd)
+
+    started = time.perf_counter()
+    regexps = [aql._match_regexp(mask).fullmatch for mask in masks]
+    matcher = aql.MaskMatcher(masks)
+    print(f"Compiled {len(masks)} masks in {time.perf_counter() - started:.2f}s")
+
+    one_by_one = measure("one by one", lambda value: any(fullmatch(value) for fullmatch in regexps), names)
+    merged = measure("merged", matcher, names)
+    assert one_by_one == merged
+
+
+if __name__ == "__main__":
+    main()
@@ -40,15 +40,18 @@ setup(
         "cfgv~=3.3",
         'typing-extensions; python_version < "3.8.0"',
     ],
+    extras_require={
+        "async": ["aiohttp"],
+        "columnar": ["numpy"],
+    },
     classifiers=[
         "Development Status :: 5 - Production/Stable",
         "Intended Audience :: Developers",
         "Topic :: Software Development :: Libraries :: Python Modules",
         "License :: OSI Approved :: MIT License",
         "Natural Language :: English",
-        "Programming Language :: Python :: 3.6",
         "Programming Language :: Python :: 3.7",
     ],
-    python_requires=">=3.6",
+    python_requires=">=3.7",
     include_package_data=True,
 )
@@ -0,0 +1,148 @@
+import json
+import random
+
+import pytest
+
+from artifactory_cleanup import aql
+from artifactory_cleanup.errors import AqlNotSupportedError
+
+
+def chunked(data: bytes, size: int):
+    return [data[i : i + size] for i in range(0, len(data), size)]
+
+
+def test_iter_results_by_small_chunks():
+    results = [
+        {"repo": "repo", "path": "путь", "name": f"{i}.zip", "size": 1000 + i}
+        for i in range(10)
+    ]
+    response = {"results": results, "range": {"start_pos": 0, "end_pos": 10, "total": 10}}
+    data = json.dumps(response, indent=2, ensure_ascii=False).encode("utf-8")
+
+    for size in (1, 3, 7, 1024):
+        assert list(aql.iter_results(chunked(data, size))) == results
+
+
+def test_iter_results_empty():
+    data = b'{"range": {"total": 0}, "results": [ ]}'
+    assert list(aql.iter_results(chunked(data, 2))) == []
+
+
+def test_optimize_flattens_and_deduplicates():
+    criteria = {
+        "$and": [
+            {"$or": [{"repo": {"$eq": "repo1"}}, {"repo": {"$eq": "repo2"}}]},
+            {"$and": [{"created": {"$lt": "2021-01-01"}}]},
+            {"$or": [{"repo": {"$eq": "repo2"}}, {"repo": {"$eq": "repo1"}}]},
+            {"created": {"$lt": "2021-01-01"}},
+        ]
+    }
+    assert aql.optimize(criteria) == {
+        "$and": [
+            {"$or": [{"repo": {"$eq": "repo1"}}, {"repo": {"$eq": "repo2"}}]},
+            {"created": {"$lt": "2021-01-01"}},
+        ]
+    }
+
+
+def test_optimize_or_factors_common_clauses():
+    criteria = {
+        "$or": [
+            {"$and": [{"stat.downloads": {"$eq": None}}, {"created": {"$lte": "2021"}}]},
+            {"$and": [{"stat.downloads": {"$eq": None}}, {"stat.remote_downloaded": {"$lte": "2021"}}]},
+        ]
+    }
+    assert aql.optimize(criteria) == {
+        "$and": [
+            {"stat.downloads": {"$eq": None}},
+            {"$or": [{"created": {"$lte": "2021"}}, {"stat.remote_downloaded": {"$lte": "2021"}}]},
+        ]
+    }
+
+
+def test_optimize_contradictory():
+    assert aql.optimize({"$and": [{"repo": "repo1"}, {"repo": {"$eq": "repo2"}}]}) is None
+    assert aql.optimize({"$or": [{"$and": [{"repo": "a"}, {"repo": "b"}]}, {"name": "c"}]}) == {
+        "name": {"$eq": "c"}
+    }
+    # An artifact may have many properties with the same key
+    criteria = {"$and": [{"@build": "1"}, {"@build": "2"}]}
+    assert aql.optimize(criteria) == {"$and": [{"@build": {"$eq": "1"}}, {"@build": {"$eq": "2"}}]}
+    # Folders are items of any type too
+    criteria = {"$and": [{"type": "any"}, {"type": {"$eq": "folder"}}]}
+    assert aql.optimize(criteria) == {"$and": [{"type": {"$eq": "any"}}, {"type": {"$eq": "folder"}}]}
+
+
+def test_compile_criteria():
+    match = aql.compile_criteria(
+        {
+            "$and": [
+                {"created": {"$lt": "2021-01-02"}},
+                {"$or": [{"stat.downloads": {"$eq": None}}, {"name": {"$nmatch": "*.zip"}}]},
+            ]
+        }
+    )
+    artifact = {"name": "a.zip", "created": "2021-01-01T10:00:00.000Z", "stats": {}}
+    assert match(artifact)
+    assert not match(dict(artifact, stats={"downloads": 1}))
+    assert match(dict(artifact, name="a.tar", stats={"downloads": 1}))
+    assert not match(dict(artifact, created="2021-01-02T00:00:00.000Z"))
+    assert not match(dict(artifact, created=None))
+
+
+def test_compile_criteria_properties():
+    match = aql.compile_criteria(
+        {
+            "$and": [
+                {"property.key": {"$eq": "build.number"}},
+                {"@released": {"$nmatch": "tru?"}},
+                {"property.value": {"$ne": "broken"}},
+            ]
+        }
+    )
+    assert match({"properties": {"build.number": "1"}})
+    assert match({"properties": {"build.number": "1", "released": "false"}})
+    assert not match({"properties": {"build.number": "1", "released": "true"}})
+    assert not match({"properties": {"build.number": "broken"}})
+    assert not match({"properties": {}})
+
+
+def test_compile_criteria_not_supported():
+    with pytest.raises(AqlNotSupportedError):
+        aql.compile_criteria({"archive.entry.name": {"$eq": "a"}})
+    with pytest.raises(AqlNotSupportedError):
+        aql.compile_criteria({"$msp": [{"@a": "1"}]})
+
+
+def test_mask_matcher_like_regexps():
+    rnd = random.Random(0)
+    alphabet = "ab.-*?"
+    for _ in range(300):
+        masks = ["".join(rnd.choice(alphabet) for _ in range(rnd.randrange(5))) for _ in range(rnd.randrange(1, 6))]
+        matcher = aql.MaskMatcher(masks)
+        regexps = [aql._match_regexp(mask) for mask in masks]
+        for _ in range(20):
+            value = "".join(rnd.choice("ab.-") for _ in range(rnd.randrange(6)))
+            expected = any(regexp.fullmatch(value) for regexp in regexps)
+            assert matcher(value) == expected, (masks, value)
+
+
+def test_compile_criteria_merges_masks():
+    criteria = {
+        "$and": [
+            {"$or": [{"name": {"$match": "*.jar"}}, {"name": {"$match": "app-?.zip"}}, {"size": {"$gt": 100}}]},
+            {"$and": [{"path": {"$nmatch": "tmp/*"}}, {"path": {"$nmatch": "*/snapshot"}}]},
+        ]
+    }
+    merged = aql._PredicateCompiler.merge_masks(criteria["$and"][0]["$or"], "$match")
+    assert merged == [{"name": {"$match": ["*.jar", "app-?.zip"]}}, {"size": {"$gt": 100}}]
+
+    match = aql.compile_criteria(criteria)
+    artifact = {"name": "a.jar", "path": "libs/1", "size": 1}
+    assert match(artifact)
+    assert match(dict(artifact, name="app-1.zip"))
+    assert match(dict(artifact, name="a.zip", size=1000))
+    assert not match(dict(artifact, name="app-10.zip"))
+    assert not match(dict(artifact, path="tmp/1"))
+    assert not match(dict(artifact, path="libs/snapshot"))
+    assert not match(dict(artifact, name=None))
@@ -0,0 +1,87 @@
+import os
+import signal
+import threading
+import time
+from contextlib import nullcontext
+from datetime import date
+
+import pytest
+
+from artifactory_cleanup.artifactorycleanup import ArtifactoryCleanup
+from artifactory_cleanup.base_url_session import BaseUrlSession
+from artifactory_cleanup.rules import CleanupPolicy, Repo
+from artifactory_cleanup.rules.base import DRY_RUN
+
+
+class SlowPolicy(CleanupPolicy):
+    def __init__(self, *args, on_delete=None):
+        super().__init__(*args)
+        self.on_delete = on_delete
+        self.finished = 0
+        self._lock = threading.Lock()
+
+    def delete(self, artifact, destroy, ignore_not_found=False):
+        time.sleep(0.001)
+        if self.on_delete:
+            self.on_delete()
+        with self._lock:
+            self.finished += 1
+        return DRY_RUN
+
+
+def make_cleanup(worker_count=2):
+    return ArtifactoryCleanup(
+        session=BaseUrlSession("http://example.com"),
+        policies=[],
+        destroy=False,
+        today=date.today(),
+        ignore_not_found=False,
+        worker_count=worker_count,
+    )
+
+
+def make_artifacts(count):
+    return [{"repo": "repo-name-here", "path": "path", "name": f"{i}.zip", "size": 1} for i in range(count)]
+
+
+def test_delete_window_is_bounded():
+    cleanup = make_cleanup(worker_count=2)
+    policy = SlowPolicy("Slow", Repo("repo-name-here"))
+    window = 2 * cleanup.DELETE_WINDOW_PER_WORKER
+    pending = []
+
+    def queue():
+        for artifact in make_artifacts(50):
+            pending.append(len(pending) + 1 - policy.finished)
+            yield artifact
+
+    results = cleanup._delete_artifacts(policy, queue(), lambda name: nullcontext(), limiter=None)
+
+    assert len(results) == 50
+    assert all(result.outcome == DRY_RUN for result in results)
+    # One more artifact is taken from the queue while we wait for a free place in the window
+    assert max(pending) <= window + 1
+
+
+def test_delete_stops_on_request():
+    cleanup = make_cleanup(worker_count=1)
+    policy = SlowPolicy("Slow", Repo("repo-name-here"), on_delete=cleanup._stop.set)
+
+    results = cleanup._delete_artifacts(policy, make_artifacts(50), lambda name: nullcontext(), limiter=None)
+
+    # Deletes in flight finish, new ones are not sent
+    assert 1 <= len(results) <= 1 + cleanup.DELETE_WINDOW_PER_WORKER
+
+
+def test_stop_on_signals(capsys):
+    cleanup = make_cleanup()
+    previous = signal.getsignal(signal.SIGTERM)
+    with cleanup._stop_on_signals():
+        os.kill(os.getpid(), signal.SIGTERM)
+        assert cleanup._stop.is_set()
+        with pytest.raises(KeyboardInterrupt):
+            os.kill(os.getpid(), signal.SIGINT)
+
+    assert signal.getsignal(signal.SIGTERM) is previous
+    stdout, _ = capsys.readouterr()
+    assert "Got SIGTERM, wait for deletes in flight" in stdout
@@ -0,0 +1,61 @@
+import json
+
+import pytest
+
+from artifactory_cleanup import aql
+from artifactory_cleanup.rules import ArtifactsList
+
+
+def make_artifacts(count):
+    return ArtifactsList({"path": "path", "name": f"{i}.zip"} for i in range(count))
+
+
+def test_keep_many_keeps_order():
+    artifacts = make_artifacts(6)
+    artifacts.keep_many(artifacts[::2])
+    assert [x["name"] for x in artifacts] == ["1.zip", "3.zip", "5.zip"]
+
+
+def test_remove_equal_artifact_like_list():
+    artifacts = make_artifacts(3)
+    artifacts.remove(dict(artifacts[1]))
+    assert [x["name"] for x in artifacts] == ["0.zip", "2.zip"]
+
+    with pytest.raises(ValueError):
+        artifacts.remove({"path": "path", "name": "missing.zip"})
+
+
+def test_remove_one_of_duplicates():
+    artifacts = make_artifacts(2)
+    artifacts.append(artifacts[0])
+    artifacts.remove(artifacts[0])
+    assert [x["name"] for x in artifacts] == ["1.zip", "0.zip"]
+
+
+def test_from_response_with_compact_stream():
+    response = {
+        "results": [
+            {"repo": "repo", "path": "path", "name": f"{i}.zip", "properties": [{"key": "k", "value": str(i)}]}
+            for i in range(3)
+        ]
+    }
+    chunks = [json.dumps(response).encode()]
+    artifacts = ArtifactsList.from_response(aql.iter_results(chunks, compact=True))
+
+    assert [x["properties"] for x in artifacts] == [{"k": "0"}, {"k": "1"}, {"k": "2"}]
+    assert all(x["stats"] == {} for x in artifacts)
+    assert artifacts[0]["path"] is artifacts[2]["path"]
+
+
+def test_compact_stream_properties_in_any_order():
+    properties = [{"value": "1", "key": "a"}, {"key": "b"}, {"key": "c", "value": "3"}]
+    chunks = [json.dumps({"results": [{"repo": "repo", "path": "p", "name": "n", "properties": properties}]}).encode()]
+    artifact, = ArtifactsList.from_response(aql.iter_results(chunks, compact=True))
+    assert artifact["properties"] == {"a": "1", "b": None, "c": "3"}
+
+
+def test_compact_stream_keeps_unknown_properties():
+    properties = [{"key": "a", "value": "1", "extra": "x"}]
+    chunks = [json.dumps({"results": [{"repo": "repo", "path": "p", "name": "n", "properties": properties}]}).encode()]
+    artifact, = ArtifactsList.from_response(aql.iter_results(chunks, compact=True))
+    assert artifact["properties"] == {"a": "1"}
@@ -0,0 +1,130 @@
+import threading
+from contextlib import contextmanager, nullcontext
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from artifactory_cleanup.async_delete import AsyncDeleter
+from artifactory_cleanup.base_url_session import BaseUrlSession, CircuitBreaker, RetryPolicy
+from artifactory_cleanup.rules import CleanupPolicy, Repo
+from artifactory_cleanup.rules.base import DELETED
+
+
+def make_artifacts(count):
+    return [
+        {"repo": "repo-name-here", "path": "path/to/file", "name": f"{i}.zip", "size": 1}
+        for i in range(count)
+    ]
+
+
+@pytest.fixture
+def artifactory():
+    deleted = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_DELETE(self):
+            if self.path.endswith("/missing.zip"):
+                self.send_response(404)
+            else:
+                deleted.append(self.path)
+                self.send_response(204)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}/artifactory", deleted
+    server.shutdown()
+
+
+def test_async_delete_dry_run(capsys):
+    names = []
+
+    @contextmanager
+    def test_ctx_mgr(artifact):
+        names.append(artifact["name"])
+        yield
+
+    policy = CleanupPolicy("Remove", Repo("repo-name-here"))
+    deleter = AsyncDeleter(BaseUrlSession("http://example.com"), concurrency=10, ignore_not_found=False)
+    deleter.delete(policy, make_artifacts(3), destroy=False, test_ctx_mgr=test_ctx_mgr)
+
+    stdout, _ = capsys.readouterr()
+    assert "DEBUG - we would delete 'repo-name-here/path/to/file/2.zip'" in stdout
+    assert names == ["0.zip", "1.zip", "2.zip"]
+
+
+def test_async_delete_destroy(artifactory, capsys):
+    pytest.importorskip("aiohttp")
+    url, deleted = artifactory
+    artifacts = make_artifacts(50) + [dict(make_artifacts(1)[0], name="missing.zip")]
+
+    policy = CleanupPolicy("Remove", Repo("repo-name-here"))
+    deleter = AsyncDeleter(BaseUrlSession(url), concurrency=8, ignore_not_found=True)
+    deleter.delete(policy, artifacts, destroy=True, test_ctx_mgr=lambda artifact: nullcontext())
+
+    stdout, _ = capsys.readouterr()
+    assert len(deleted) == 50
+    assert "/artifactory/repo-name-here/path/to/file/49.zip" in deleted
+    assert "NOT FOUND - 'repo-name-here/path/to/file/missing.zip'" in stdout
+
+
+def test_async_delete_logs_off_the_event_loop(artifactory):
+    pytest.importorskip("aiohttp")
+    url, deleted = artifactory
+    threads = []
+
+    class ListingPolicy(CleanupPolicy):
+        # Like CheckedFolders, that lists the folder again with requests
+        def log_delete(self, artifact, destroy):
+            threads.append(threading.current_thread())
+            return super().log_delete(artifact, destroy)
+
+    policy = ListingPolicy("Remove", Repo("repo-name-here"))
+    deleter = AsyncDeleter(BaseUrlSession(url), concurrency=2, ignore_not_found=False)
+    deleter.delete(policy, make_artifacts(3), destroy=True, test_ctx_mgr=lambda artifact: nullcontext())
+
+    assert len(deleted) == 3
+    assert threading.main_thread() not in threads
+
+
+def test_async_delete_retries(capsys):
+    pytest.importorskip("aiohttp")
+    attempts = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_DELETE(self):
+            attempts.append(self.path)
+            if attempts.count(self.path) == 1:
+                # The first attempt of every delete fails, the first one of gone.zip deletes it anyway
+                self.send_response(503)
+                self.send_header("Retry-After", "0")
+            else:
+                self.send_response(404 if self.path.endswith("/gone.zip") else 204)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    session = BaseUrlSession(
+        f"http://127.0.0.1:{server.server_port}",
+        retry=RetryPolicy(retries=2, backoff=0),
+        breaker=CircuitBreaker(threshold=100),
+    )
+    artifacts = make_artifacts(2) + [dict(make_artifacts(1)[0], name="gone.zip")]
+
+    policy = CleanupPolicy("Remove", Repo("repo-name-here"))
+    deleter = AsyncDeleter(session, concurrency=2, ignore_not_found=False)
+    results = deleter.delete(policy, artifacts, destroy=True, test_ctx_mgr=lambda artifact: nullcontext())
+    server.shutdown()
+
+    assert [result.outcome for result in results] == [DELETED] * 3
+    assert len(attempts) == 6
+    assert session.stats()["retries"] == 3
@@ -0,0 +1,219 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from datetime import date
+
+import pytest
+import requests
+
+from artifactory_cleanup import base_url_session
+from artifactory_cleanup.base_url_session import (
+    BaseUrlSession,
+    CircuitBreaker,
+    HedgePolicy,
+    PoolAdapter,
+    RetryPolicy,
+    Timeouts,
+)
+from artifactory_cleanup.rules import CleanupPolicy
+from artifactory_cleanup.rules.base import DELETED
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    """Sleep moves the clock instead of waiting"""
+    sleeps = []
+    now = [1000.0]
+
+    def sleep(seconds):
+        sleeps.append(seconds)
+        now[0] += seconds
+
+    monkeypatch.setattr(base_url_session.time, "sleep", sleep)
+    monkeypatch.setattr(base_url_session.time, "monotonic", lambda: now[0])
+    return sleeps
+
+
+def test_retry_delete_after_retry_after(requests_mock, sleeps):
+    mock = requests_mock.delete(
+        "http://example.com/repo/file.zip",
+        [
+            {"status_code": 503, "headers": {"Retry-After": "2"}},
+            {"status_code": 502},
+            {"status_code": 204},
+        ],
+    )
+    session = BaseUrlSession("http://example.com", retry=RetryPolicy(retries=3, backoff=1))
+
+    assert session.delete("repo/file.zip").status_code == 204
+    assert mock.call_count == 3
+    assert sleeps[0] == 2
+    assert 0 <= sleeps[1] <= 2, "Full jitter of the second backoff"
+    assert session.stats() == {"retries": 2, "breaker_trips": 0, "hedged": 0}
+
+
+def test_retried_delete_not_found_is_deleted(requests_mock, sleeps):
+    requests_mock.delete("http://example.com/repo/file.zip", [{"status_code": 503}, {"status_code": 404}])
+    session = BaseUrlSession("http://example.com", retry=RetryPolicy(retries=3, backoff=1))
+    policy = CleanupPolicy("Files")
+    policy.init(session, date(2021, 4, 1))
+
+    artifact = {"repo": "repo", "path": ".", "name": "file.zip"}
+    assert policy.delete(artifact, destroy=True) == DELETED, "The first attempt deleted it"
+
+    requests_mock.delete("http://example.com/repo/file.zip", status_code=404)
+    with pytest.raises(requests.HTTPError):
+        policy.delete(artifact, destroy=True)
+
+
+def test_observe_delete_attempts_without_backoff(requests_mock, sleeps):
+    requests_mock.delete(
+        "http://example.com/repo/file.zip",
+        [{"status_code": 503, "headers": {"Retry-After": "5"}}, {"status_code": 204}],
+    )
+    requests_mock.get("http://example.com/api/storage/repo")
+    session = BaseUrlSession("http://example.com", retry=RetryPolicy(retries=3, backoff=1))
+    attempts = []
+
+    with session.observe_deletes(lambda latency, status: attempts.append((latency, status))):
+        session.get("api/storage/repo")
+        session.delete("repo/file.zip")
+    session.delete("repo/file.zip")
+
+    assert sleeps == [5]
+    assert attempts == [(0, 503), (0, 204)], "Only deletes of the block, the backoff is not latency"
+
+
+def test_retry_aql_but_not_other_posts(requests_mock, sleeps):
+    aql = requests_mock.post("http://example.com/api/search/aql", [{"status_code": 502}, {"json": {}}])
+    other = requests_mock.post("http://example.com/api/move/repo/file.zip", status_code=502)
+    session = BaseUrlSession("http://example.com", retry=RetryPolicy())
+
+    assert session.post("/api/search/aql", data="items.find()").status_code == 200
+    assert session.post("/api/move/repo/file.zip").status_code == 502
+    assert aql.call_count == 2
+    assert other.call_count == 1
+
+
+def test_give_up_after_retries(requests_mock, sleeps):
+    mock = requests_mock.get("http://example.com/api/repositories", status_code=500)
+    session = BaseUrlSession("http://example.com", retry=RetryPolicy(retries=2))
+
+    assert session.get("/api/repositories").status_code == 500
+    assert mock.call_count == 3
+
+
+def test_circuit_breaker_pauses_requests(requests_mock, sleeps, capsys):
+    requests_mock.get("http://example.com/api/repositories", status_code=503)
+    breaker = CircuitBreaker(threshold=3, cooldown=60)
+    session = BaseUrlSession("http://example.com", retry=RetryPolicy(retries=0), breaker=breaker)
+
+    for _ in range(3):
+        session.get("/api/repositories")
+
+    assert breaker.trips == 1
+    assert "pause all requests for 60 seconds" in capsys.readouterr().out
+    session.get("/api/repositories")
+    assert sleeps == [60], "The next request waits for the breaker"
+
+
+@pytest.fixture
+def keepalive_server():
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            self.send_response(200)
+            self.send_header("Content-Length", "2")
+            self.end_headers()
+            self.wfile.write(b"{}")
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+
+
+def test_pool_size_and_connection_stats(keepalive_server, requests_mock):
+    requests_mock.get(f"{keepalive_server}/api/version", real_http=True)
+    session = BaseUrlSession(keepalive_server, pool_size=50, keepalive=30)
+    adapter = session.adapters["http://"]
+    assert isinstance(adapter, PoolAdapter)
+    assert adapter._pool_maxsize == 50
+
+    for _ in range(5):
+        assert session.get("api/version").status_code == 200
+
+    assert session.connection_stats() == {"opened": 1, "reused": 4}
+
+
+def test_timeouts_by_request_kind(requests_mock):
+    requests_mock.post("http://example.com/api/search/aql", json={"results": []})
+    requests_mock.get("http://example.com/api/storage/repo")
+    requests_mock.delete("http://example.com/repo/file.zip")
+    session = BaseUrlSession("http://example.com", timeouts=Timeouts(aql=(1, 600), api=(2, 30), delete=(3, 60)))
+
+    session.post("/api/search/aql", data="items.find()")
+    session.get("/api/storage/repo")
+    session.delete("repo/file.zip")
+    session.get("/api/storage/repo", timeout=5)
+
+    timeouts = [request.timeout for request in requests_mock.request_history]
+    assert timeouts == [(1, 600), (2, 30), (3, 60), 5]
+
+
+def test_hedge_slow_get(requests_mock):
+    paths = []
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            paths.append(self.path)
+            if len(paths) == 1:
+                # The first node is stuck
+                time.sleep(1)
+            self.send_response(200)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}"
+    requests_mock.get(f"{url}/api/storage/repo", real_http=True)
+
+    hedge = HedgePolicy(min_samples=1)
+    hedge.record(0.05)
+    session = BaseUrlSession(url, hedge=hedge)
+    started = time.monotonic()
+    assert session.get("api/storage/repo").status_code == 200
+    elapsed = time.monotonic() - started
+    server.shutdown()
+
+    assert elapsed < 1
+    assert len(paths) == 2
+    assert session.stats()["hedged"] == 1
+
+
+def test_hedge_timer_starts_with_the_request(requests_mock):
+    requests_mock.get("http://example.com/api/storage/repo")
+    hedge = HedgePolicy(min_samples=1)
+    hedge.record(0.05)
+    session = BaseUrlSession("http://example.com", pool_size=1, hedge=hedge)
+    assert session._hedge_executor._max_workers == 2, "A request and its hedge"
+    # Workers of the executor are busy with other requests for a while
+    release = threading.Event()
+    for _ in range(session._hedge_executor._max_workers):
+        session._hedge_executor.submit(release.wait)
+    threading.Timer(0.3, release.set).start()
+
+    assert session.get("api/storage/repo").status_code == 200
+    assert session.stats()["hedged"] == 0, "Waiting for a worker is not a slow node"
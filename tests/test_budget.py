@@ -0,0 +1,124 @@
+from datetime import date
+
+import pytest
+
+from artifactory_cleanup import ArtifactoryCleanupCLI
+from artifactory_cleanup.artifactorycleanup import ArtifactoryCleanup
+from artifactory_cleanup import budget as budget_module
+from artifactory_cleanup.base_url_session import BaseUrlSession
+from artifactory_cleanup.budget import POLICY_ORDER, Budget
+from artifactory_cleanup.rules import CleanupPolicy, DeleteByRegexpName, Repo
+
+
+def make_cleanup(policy, delete_order):
+    cleanup = ArtifactoryCleanup(
+        session=BaseUrlSession("http://example.com"),
+        policies=[policy],
+        destroy=False,
+        today=date(2021, 4, 1),
+        ignore_not_found=False,
+        worker_count=1,
+        delete_order=delete_order,
+    )
+    for policy in cleanup.policies:
+        policy.build_aql_query()
+    return cleanup
+
+
+def test_budget_max_deletes():
+    budget = Budget(max_deletes=2)
+    assert [budget.take({"size": 1}) for _ in range(3)] == [True, True, False]
+    assert budget.exhausted == "max deletes"
+
+
+def test_budget_max_bytes_stops_at_the_first_delete_that_does_not_fit():
+    budget = Budget(max_bytes=10)
+    assert budget.take({"size": 6})
+    assert not budget.take({"size": 5})
+    # Smaller ones would fit, but the run stops
+    assert not budget.take({"size": 1})
+    assert budget.exhausted == "max bytes"
+    assert budget.bytes == 6
+
+
+def test_budget_max_duration(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(budget_module.time, "monotonic", lambda: now[0])
+    budget = Budget(max_duration=60)
+    budget.start()
+    assert budget.take({"size": 1})
+    now[0] += 60
+    assert not budget.take({"size": 1})
+    assert budget.exhausted == "max duration"
+
+
+def test_no_budget():
+    budget = Budget()
+    assert not budget
+    assert all(budget.take({"size": 1024}) for _ in range(100))
+
+
+@pytest.mark.usefixtures("requests_repo_name_here")
+def test_priority_order_with_budget(capsys, shared_datadir, requests_mock):
+    _, code = ArtifactoryCleanupCLI.run(
+        [
+            "ArtifactoryCleanupCLI",
+            "--config",
+            str(shared_datadir / "cleanup.yaml"),
+            "--load-rules",
+            str(shared_datadir / "myrule.py"),
+            "--destroy",
+            "--delete-order",
+            "largest",
+            "--max-deletes",
+            "1",
+        ],
+        exit=False,
+    )
+    stdout, _ = capsys.readouterr()
+    assert code == 0, stdout
+    assert "Delete 2 artifacts of 2 policies, largest first" in stdout
+    assert "Budget 'max deletes' is exhausted, 1 artifacts are pending" in stdout
+    deletes = [request for request in requests_mock.request_history if request.method == "DELETE"]
+    assert len(deletes) == 1
+
+
+def test_oldest_order_includes_created():
+    # Neither rule of the policy reads "created"
+    policy = CleanupPolicy("Zips", Repo("repo-name-here"), DeleteByRegexpName(r".*\.zip$"))
+    assert '"created"' not in make_cleanup(policy, POLICY_ORDER).policies[0].aql_text
+
+    policy = CleanupPolicy("Zips", Repo("repo-name-here"), DeleteByRegexpName(r".*\.zip$"))
+    assert '"created"' in make_cleanup(policy, "oldest").policies[0].aql_text
+
+
+@pytest.mark.usefixtures("requests_repo_name_here")
+def test_priority_order_times_policies_separately(capsys, shared_datadir, monkeypatch):
+    elapsed = []
+    get_summary = ArtifactoryCleanup._get_summary
+
+    def spy(self, policy, artifacts_to_remove, results, policy_elapsed, *args):
+        elapsed.append(policy_elapsed)
+        return get_summary(self, policy, artifacts_to_remove, results, policy_elapsed, *args)
+
+    monkeypatch.setattr(ArtifactoryCleanup, "_get_summary", spy)
+    _, code = ArtifactoryCleanupCLI.run(
+        [
+            "ArtifactoryCleanupCLI",
+            "--config",
+            str(shared_datadir / "cleanup.yaml"),
+            "--load-rules",
+            str(shared_datadir / "myrule.py"),
+            "--destroy",
+            "--worker-count",
+            "1",
+            "--delete-order",
+            "largest",
+        ],
+        exit=False,
+    )
+    stdout, _ = capsys.readouterr()
+    assert code == 0, stdout
+    # The policy of the first delete is done before the second delete
+    assert len(elapsed) == 2
+    assert min(elapsed) < max(elapsed)
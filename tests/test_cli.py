@@ -150,6 +150,34 @@ def test_output_json(capsys, shared_datadir, requests_mock, tmp_path):
         }
 
 
+@pytest.mark.usefixtures("requests_repo_name_here")
+def test_output_json_artifacts_with_all_fields(capsys, shared_datadir, requests_mock, tmp_path):
+    output_json = tmp_path / "output.json"
+    _, code = ArtifactoryCleanupCLI.run(
+        [
+            "ArtifactoryCleanupCLI",
+            "--config",
+            str(shared_datadir / "cleanup.yaml"),
+            "--load-rules",
+            str(shared_datadir / "myrule.py"),
+            "--output-format",
+            "json",
+            "--output",
+            str(output_json),
+            "--output-artifacts",
+        ],
+        exit=False,
+    )
+    stdout, stderr = capsys.readouterr()
+    assert code == 0, stdout
+    queries = [request.text for request in requests_mock.request_history if request.method == "POST"]
+    assert all('.include("*", "property", "stat")' in query for query in queries)
+    with open(output_json, "r") as file:
+        artifact = json.load(file)["policies"][0]["removed_artifacts"][0]
+    assert artifact["created_by"] == "admin"
+    assert artifact["properties"] == {"property-1": "property-value-1", "property-2": "property-value-2"}
+
+
 @pytest.mark.usefixtures("requests_repo_name_here")
 def test_require_output_json(capsys, shared_datadir, requests_mock):
     _, code = ArtifactoryCleanupCLI.run(
@@ -190,3 +218,89 @@ def test_display_format_default(capsys, shared_datadir, requests_mock):
             "DEBUG - we would delete 'repo-name-here/path/to/file/filename1.json' (11827853eed40e8b60f5d7e45f2a730915d7704d) - 528B\n"
             in stdout
     )
+
+
+@pytest.mark.usefixtures("requests_repo_name_here")
+def test_explain(capsys, shared_datadir, requests_mock):
+    _, code = ArtifactoryCleanupCLI.run(
+        [
+            "ArtifactoryCleanupCLI",
+            "--config",
+            str(shared_datadir / "cleanup.yaml"),
+            "--load-rules",
+            str(shared_datadir / "myrule.py"),
+            "--explain",
+        ],
+        exit=False,
+    )
+    stdout, stderr = capsys.readouterr()
+    assert code == 0, stdout
+    assert "Optimized AQL filters:" in stdout
+    assert requests_mock.call_count == 0, "Explain does not call Artifactory"
+
+
+def test_aql_dump(capsys, shared_datadir, requests_mock, tmp_path):
+    dump = tmp_path / "aql.json"
+    artifact = {"repo": "repo-name-here", "path": "path/to/file", "type": "file", "size": 1}
+    results = [
+        dict(artifact, name="old.json", created="2000-01-01T00:00:00.000Z"),
+        dict(artifact, name="new.json", created="2999-01-01T00:00:00.000Z"),
+        dict(artifact, repo="other", name="other.json", created="2000-01-01T00:00:00.000Z"),
+    ]
+    dump.write_text(json.dumps({"results": results}))
+
+    _, code = ArtifactoryCleanupCLI.run(
+        [
+            "ArtifactoryCleanupCLI",
+            "--config",
+            str(shared_datadir / "cleanup.yaml"),
+            "--load-rules",
+            str(shared_datadir / "myrule.py"),
+            "--policy",
+            "older then 7 days",
+            "--aql-dump",
+            str(dump),
+        ],
+        exit=False,
+    )
+    stdout, stderr = capsys.readouterr()
+    assert code == 0, stdout
+    assert "we would delete 'repo-name-here/path/to/file/old.json'" in stdout
+    assert "new.json'" not in stdout
+    assert "other.json'" not in stdout
+    assert requests_mock.call_count == 0, "The dump replaces Artifactory"
+
+
+@pytest.mark.usefixtures("requests_repo_name_here")
+def test_output_json_deleted(capsys, shared_datadir, requests_mock, tmp_path):
+    requests_mock.delete(
+        "https://repo.example.com/artifactory/repo-name-here/path/to/file/filename1.json",
+        [{"status_code": 204}, {"status_code": 500}],
+    )
+    output_json = tmp_path / "output.json"
+    _, code = ArtifactoryCleanupCLI.run(
+        [
+            "ArtifactoryCleanupCLI",
+            "--config",
+            str(shared_datadir / "cleanup.yaml"),
+            "--load-rules",
+            str(shared_datadir / "myrule.py"),
+            "--destroy",
+            "--retries",
+            "0",
+            "--output-format",
+            "json",
+            "--output",
+            str(output_json),
+        ],
+        exit=False,
+    )
+    stdout, stderr = capsys.readouterr()
+    assert code == 0, stdout
+    with open(output_json, "r") as file:
+        first, second = json.load(file)["policies"]
+    assert first["deleted"]["file_count"] == 1
+    assert first["deleted"]["size"] == 528
+    assert second["deleted"]["file_count"] == 0
+    assert second["deleted"]["failed"] == 1
+    assert "failed: 1" in stdout
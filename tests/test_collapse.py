@@ -0,0 +1,121 @@
+import pytest
+
+from artifactory_cleanup import ArtifactoryCleanupCLI
+from artifactory_cleanup.base_url_session import BaseUrlSession
+from artifactory_cleanup.collapse import CheckedFolders, expand_results, list_affected, plan_deletes
+from artifactory_cleanup.errors import ArtifactoryCleanupException
+from artifactory_cleanup.rules import CleanupPolicy
+from artifactory_cleanup.rules.base import DELETED, DeleteResult
+
+
+def folder(path, name):
+    return {"repo": "repo", "path": path, "name": name, "type": "folder"}
+
+
+def file(path, name, size=1):
+    return {"repo": "repo", "path": path, "name": name, "type": "file", "size": size}
+
+
+LISTING = [
+    folder(".", "builds"),
+    folder("builds", "1"),
+    folder("builds/1", "docs"),
+    file("builds/1", "app.zip", 10),
+    file("builds/1/docs", "index.html", 2),
+    folder("builds", "2"),
+    file("builds/2", "app.zip"),
+    folder("builds", "3"),
+    file("builds/3", "app.zip"),
+    folder("builds/3", "empty"),
+]
+
+
+def get_plan(artifacts, listing=LISTING):
+    return [(target["path"], target["name"], len(covered)) for target, covered in plan_deletes(artifacts, listing)]
+
+
+def test_collapse_highest_folder():
+    artifacts = [file("builds/1", "app.zip", 10), file("builds/1/docs", "index.html", 2)]
+    deletes = plan_deletes(artifacts, LISTING)
+    assert [(target["path"], target["name"], target["size"]) for target, _ in deletes] == [("builds", "1", 12)]
+
+
+def test_collapse_up_to_repository_root():
+    artifacts = [file("builds/1", "app.zip", 10), file("builds/1/docs", "index.html", 2), file("builds/2", "app.zip")]
+    # An empty folder that we don't delete keeps its parent
+    artifacts.append(file("builds/3", "app.zip"))
+    assert get_plan(artifacts) == [("builds", "1", 2), ("builds", "2", 1), ("builds/3", "app.zip", 1)]
+
+    artifacts.append(folder("builds/3", "empty"))
+    assert get_plan(artifacts) == [(".", "builds", 5)]
+
+
+def test_collapse_keeps_artifacts_not_deleted():
+    artifacts = [file("builds/1", "app.zip", 10)]
+    assert get_plan(artifacts) == [("builds/1", "app.zip", 1)]
+
+
+def test_collapse_artifacts_missing_in_listing():
+    artifacts = [file("builds/4", "app.zip")]
+    assert get_plan(artifacts) == [("builds", "4", 1)]
+
+
+def test_expand_results():
+    artifacts = [file("builds/1", "app.zip", 10), file("builds/1/docs", "index.html", 2)]
+    deletes = plan_deletes(artifacts, LISTING)
+    results = expand_results([DeleteResult(deletes[0][0], DELETED, 0.1)], deletes)
+    assert [result.artifact for result in results] == artifacts
+    assert all(result.outcome == DELETED for result in results)
+
+
+def test_list_affected_top_folders(requests_mock):
+    mock = requests_mock.post("http://example.com/api/search/aql", json={"results": []})
+    artifacts = [file("builds/1", "app.zip"), file("builds/2", "app.zip"), folder(".", "old")]
+    list_affected(BaseUrlSession("http://example.com"), "repo", artifacts)
+
+    query = mock.last_request.text
+    assert '{"path": {"$match": "builds/*"}}' in query and '{"path": {"$match": "old/*"}}' in query
+    assert query.count("$match") == 2, "Other folders of the repository are not listed"
+
+
+def test_checked_folders_skip_changed_folder(requests_mock):
+    artifacts = [file("builds/1", "app.zip", 10), file("builds/1/docs", "index.html", 2)]
+    deletes = plan_deletes(artifacts, LISTING)
+    target = deletes[0][0]
+    listing = [item for item in LISTING if item["path"].startswith("builds/1")]
+    requests_mock.post(
+        "http://example.com/api/search/aql",
+        [{"json": {"results": listing}}, {"json": {"results": listing + [file("builds/1", "new.zip")]}}],
+    )
+    requests_mock.delete("http://example.com/repo/builds/1")
+    session = BaseUrlSession("http://example.com")
+    policy = CleanupPolicy("Builds")
+    policy.init(session, None)
+    checked = CheckedFolders(policy, session, deletes)
+
+    assert checked.delete(target, destroy=True) == DELETED
+    with pytest.raises(ArtifactoryCleanupException, match="1 new artifacts since the listing"):
+        checked.delete(target, destroy=True)
+    assert [request.method for request in requests_mock.request_history] == ["POST", "DELETE", "POST"]
+
+
+@pytest.mark.usefixtures("requests_repo_name_here")
+def test_collapse_folders_cli(capsys, shared_datadir, requests_mock):
+    requests_mock.delete("https://repo.example.com/artifactory/repo-name-here/path")
+    _, code = ArtifactoryCleanupCLI.run(
+        [
+            "ArtifactoryCleanupCLI",
+            "--config",
+            str(shared_datadir / "cleanup.yaml"),
+            "--load-rules",
+            str(shared_datadir / "myrule.py"),
+            "--destroy",
+            "--collapse-folders",
+        ],
+        exit=False,
+    )
+    stdout, _ = capsys.readouterr()
+    assert code == 0, stdout
+    assert "Delete folder 'repo-name-here/path' instead of 1 artifacts" in stdout
+    deletes = [request.url for request in requests_mock.request_history if request.method == "DELETE"]
+    assert deletes == ["https://repo.example.com/artifactory/repo-name-here/path"] * 2
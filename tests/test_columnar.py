@@ -0,0 +1,75 @@
+import random
+from copy import deepcopy
+
+import pytest
+
+from artifactory_cleanup.rules import (
+    ArtifactsList,
+    DeleteLeastRecentlyUsedFiles,
+    KeepLatestNFiles,
+    KeepLatestNFilesInFolder,
+)
+
+np = pytest.importorskip("numpy")
+
+from artifactory_cleanup import columnar  # noqa: E402
+
+
+def make_artifacts(rnd: random.Random, count: int) -> ArtifactsList:
+    """Few folders and few timestamps, so there are groups and ties"""
+    artifacts = []
+    for i in range(count):
+        day = rnd.randint(1, 5)
+        artifact = {
+            "repo": "repo",
+            "path": f"folder{rnd.randint(1, 4)}",
+            "name": f"{i}.zip",
+            "size": rnd.randint(0, 100),
+            "created": f"2021-03-0{day}T13:54:52.383+02:00",
+        }
+        if rnd.random() < 0.5:
+            artifact["stats"] = [{"downloaded": f"2021-04-0{rnd.randint(1, 5)}T10:00:00.000+02:00"}]
+        artifacts.append(artifact)
+    return ArtifactsList.from_response(artifacts)
+
+
+@pytest.mark.parametrize(
+    "make_rule",
+    [
+        lambda count: KeepLatestNFiles(count),
+        lambda count: KeepLatestNFilesInFolder(count),
+        lambda count: DeleteLeastRecentlyUsedFiles(keep=count),
+    ],
+    ids=["KeepLatestNFiles", "KeepLatestNFilesInFolder", "DeleteLeastRecentlyUsedFiles"],
+)
+def test_columnar_matches_dict_path(make_rule):
+    rnd = random.Random(42)
+    for _ in range(200):
+        artifacts = make_artifacts(rnd, rnd.randint(0, 30))
+        count = rnd.randint(0, 8)
+
+        expected = make_rule(count).filter(deepcopy(artifacts))
+        rule = make_rule(count)
+        rule.columnar = True
+        actual = rule.filter(deepcopy(artifacts))
+
+        assert [x["name"] for x in actual] == [x["name"] for x in expected]
+
+
+def test_usage_order_matches_sort_by_usage():
+    from artifactory_cleanup.rules.utils import sort_by_usage
+
+    artifacts = make_artifacts(random.Random(7), 50)
+    table = columnar.ArtifactTable(artifacts)
+    for reverse in (False, True):
+        expected = sorted(artifacts, key=sort_by_usage, reverse=reverse)
+        assert table.rows(columnar.usage_order(table, reverse=reverse)) == expected
+
+
+def test_timestamps_are_normalized():
+    artifacts = [
+        {"repo": "r", "path": "p", "name": "a", "created": "2021-03-21T13:54:52.383+02:00"},
+        {"repo": "r", "path": "p", "name": "b", "created": "2021-03-21T12:00:00.000Z"},
+    ]
+    table = columnar.ArtifactTable(artifacts)
+    assert table.created.tolist() == [1616327692383000, 1616328000000000]
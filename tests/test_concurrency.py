@@ -0,0 +1,45 @@
+import pytest
+from requests import HTTPError, Response
+
+from artifactory_cleanup.concurrency import AdaptiveLimit
+
+
+def respond(limit, count, latency=0.1, status=200):
+    for _ in range(count):
+        limit.on_response(latency, status)
+
+
+def test_adaptive_limit_grows_while_latency_is_flat():
+    limit = AdaptiveLimit(2, maximum=5)
+    respond(limit, 2 + 3 + 4 + 5 + 5)
+    assert limit.limit == 5
+    assert limit.history == [2, 3, 4, 5]
+
+
+def test_adaptive_limit_backs_off_once_per_window_on_errors():
+    limit = AdaptiveLimit(8)
+    respond(limit, 5, status=503)
+    assert limit.history == [8, 4]
+
+    # The window after errors doesn't grow the limit
+    respond(limit, 4)
+    assert limit.limit == 4
+    respond(limit, 4, status=429)
+    assert limit.history == [8, 4, 2]
+
+
+def test_adaptive_limit_backs_off_on_latency_spike():
+    limit = AdaptiveLimit(4)
+    respond(limit, 4, latency=0.1)
+    respond(limit, 5, latency=1)
+    assert limit.history == [4, 5, 2]
+
+
+def test_adaptive_limit_measures_http_errors():
+    response = Response()
+    response.status_code = 503
+    limit = AdaptiveLimit(4)
+    with pytest.raises(HTTPError):
+        with limit.measure():
+            raise HTTPError(response=response)
+    assert limit.limit == 2
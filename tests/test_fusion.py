@@ -0,0 +1,75 @@
+from datetime import date
+
+import pytest
+
+from artifactory_cleanup.base_url_session import BaseUrlSession
+from artifactory_cleanup.fusion import QueryFusion
+from artifactory_cleanup.rules import (
+    CleanupPolicy,
+    DeleteByRegexpName,
+    DeleteOlderThan,
+    KeepLatestNFiles,
+    Repo,
+)
+
+ARTIFACTS = [
+    {"repo": "repo1", "path": "a", "name": "1.zip", "size": 1, "created": "2021-01-01T00:00:00.000Z"},
+    {"repo": "repo1", "path": "a", "name": "2.tar", "size": 1, "created": "2021-01-01T00:00:00.000Z"},
+    {"repo": "repo1", "path": "a", "name": "3.zip", "size": 1, "created": "2021-03-31T00:00:00.000Z"},
+]
+
+
+def make_policies(*policies):
+    for policy in policies:
+        policy.init(BaseUrlSession("http://example.com"), date(2021, 4, 1))
+    return list(policies)
+
+
+def test_fuse_policies_with_the_same_repo(requests_mock):
+    mock = requests_mock.post("http://example.com/api/search/aql", json={"results": ARTIFACTS})
+    requests_mock.get("http://example.com/api/storage/repo1")
+    old, zips = make_policies(
+        CleanupPolicy("Old", Repo("repo1"), DeleteOlderThan(days=30)),
+        CleanupPolicy("Zip", Repo("repo1"), DeleteByRegexpName(r".*\.zip$")),
+    )
+
+    fusion = QueryFusion([old, zips])
+    old_artifacts = fusion.get_artifacts(old)
+    zip_artifacts = fusion.get_artifacts(zips)
+
+    assert mock.call_count == 1
+    assert '"$or"' in mock.last_request.text
+    assert '"created"' in mock.last_request.text
+    assert [x["name"] for x in old_artifacts] == ["1.zip", "2.tar"]
+    assert [x["name"] for x in zip_artifacts] == ["1.zip", "3.zip"]
+    # Only fields that the policy asks for
+    assert "created" not in zip_artifacts[0]
+    assert zip_artifacts[0] is not old_artifacts[0]
+
+
+def test_do_not_fuse_policies_with_own_aql_text(requests_mock):
+    mock = requests_mock.post("http://example.com/api/search/aql", json={"results": ARTIFACTS})
+    requests_mock.get("http://example.com/api/storage/repo1")
+    old, latest = make_policies(
+        CleanupPolicy("Old", Repo("repo1"), DeleteOlderThan(days=30)),
+        CleanupPolicy("Latest", Repo("repo1"), KeepLatestNFiles(count=1)),
+    )
+
+    fusion = QueryFusion([old, latest])
+    fusion.get_artifacts(old)
+    fusion.get_artifacts(latest)
+
+    assert mock.call_count == 2
+    assert ".sort(" in mock.last_request.text
+
+
+def test_check_policies_before_building_queries(requests_mock, capsys):
+    requests_mock.get("http://example.com/api/storage/repo1", status_code=404)
+    policies = make_policies(CleanupPolicy("Old", Repo("repo1"), DeleteOlderThan(days=30)))
+
+    with pytest.raises(SystemExit):
+        QueryFusion(policies)
+
+    stdout, _ = capsys.readouterr()
+    assert "404 Client Error" in stdout
+    assert "Result AQL Query" not in stdout
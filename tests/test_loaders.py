@@ -19,3 +19,23 @@ class TestYamlLoader:
         assert user == "UserName"
         assert password == "P@ssw0rd"
         assert apikey == "Ap1Key"
+
+    def test_rate_limit(self, tmp_path):
+        config = tmp_path / "cleanup.yaml"
+        config.write_text(
+            "artifactory-cleanup:\n"
+            "  server: https://repo.example.com/artifactory\n"
+            "  apikey: key\n"
+            "  rate_limit:\n"
+            "    global: 50\n"
+            "    repos:\n"
+            "      libs-release: 2.5\n"
+            "  policies: []\n"
+        )
+        rate_limit = YamlConfigLoader(config).get_rate_limit()
+        assert rate_limit.global_rate == 50
+        assert rate_limit.repos == {"libs-release": 2.5}
+
+    def test_no_rate_limit(self, shared_datadir):
+        rate_limit = YamlConfigLoader(shared_datadir / "all-built-in-rules.yaml").get_rate_limit()
+        assert not rate_limit
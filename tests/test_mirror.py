@@ -0,0 +1,104 @@
+import json
+from contextlib import nullcontext
+from datetime import date
+
+from artifactory_cleanup.artifactorycleanup import ArtifactoryCleanup
+
+from artifactory_cleanup.base_url_session import BaseUrlSession
+from artifactory_cleanup.mirror import Mirror
+from artifactory_cleanup.rules import CleanupPolicy, DeleteOlderThan, Repo
+
+
+def make_artifact(name, created, updated=None):
+    return {
+        "repo": "repo1",
+        "path": "a",
+        "name": name,
+        "type": "file",
+        "size": 1,
+        "created": created,
+        "modified": created,
+        "updated": updated or created,
+    }
+
+
+def test_mirror_sync_changed_and_removed(requests_mock, tmp_path):
+    old = make_artifact("old.zip", "2021-01-01T00:00:00.000Z")
+    new = make_artifact("new.zip", "2021-03-31T00:00:00.000Z")
+    changed = make_artifact("old.zip", "2021-01-01T00:00:00.000Z", updated="2021-04-01T00:00:00.000Z")
+    mock = requests_mock.post(
+        "http://example.com/api/search/aql",
+        [
+            {"json": {"results": [old, new]}},
+            {"json": {"results": [changed]}},
+            {"json": {"results": [{"repo": "repo1", "path": "a", "name": "old.zip"}]}},
+        ],
+    )
+    requests_mock.get("http://example.com/api/storage/repo1")
+    session = BaseUrlSession("http://example.com")
+    policy = CleanupPolicy("Old", Repo("repo1"), DeleteOlderThan(days=30))
+    policy.init(session, date(2021, 4, 1), aql_sort=False)
+
+    mirror = Mirror(str(tmp_path / "mirror.db"), session)
+    mirror.sync_policies([policy])
+    assert [x["name"] for x in mirror.get_artifacts(policy)] == ["old.zip"]
+    mirror.close()
+
+    mirror = Mirror(str(tmp_path / "mirror.db"), session)
+    mirror.sync_policies([policy])
+    artifacts = mirror.get_artifacts(policy)
+
+    assert mock.call_count == 3, "Full sync, then changed artifacts and names of all artifacts"
+    delta = mock.request_history[1].text
+    assert '{"updated": {"$gte": "2021-03-31T00:00:00.000Z"}}' in delta
+    assert '"stat.downloaded"' not in delta, "Nothing was downloaded yet"
+    assert [x["name"] for x in artifacts] == ["old.zip"]
+    rows = mirror.connection.execute("SELECT data FROM artifacts").fetchall()
+    assert [json.loads(data) for data, in rows] == [
+        dict(changed, properties={}, stats={})
+    ], "old.zip was updated, new.zip was removed"
+
+
+def test_mirror_sync_remote_downloads_and_scan_days(requests_mock, tmp_path):
+    artifact = make_artifact("old.zip", "2021-01-01T00:00:00.000Z")
+    remote = dict(artifact, stats=[{"remote_downloaded": "2021-03-01T00:00:00.000Z", "remote_downloads": 1}])
+    mock = requests_mock.post(
+        "http://example.com/api/search/aql",
+        [{"json": {"results": [remote]}}, {"json": {"results": []}}],
+    )
+    requests_mock.get("http://example.com/api/storage/repo1")
+    session = BaseUrlSession("http://example.com")
+    policy = CleanupPolicy("Old", Repo("repo1"), DeleteOlderThan(days=30))
+    policy.init(session, date(2021, 4, 1), aql_sort=False)
+
+    mirror = Mirror(str(tmp_path / "mirror.db"), session, date(2021, 4, 1), scan_days=7)
+    mirror.sync_policies([policy])
+    mirror.close()
+
+    mirror = Mirror(str(tmp_path / "mirror.db"), session, date(2021, 4, 2), scan_days=7)
+    mirror.sync_policies([policy])
+
+    assert mock.call_count == 2, "The first sync listed all artifacts a day ago"
+    assert '{"stat.remote_downloaded": {"$gte": "2021-03-01T00:00:00.000Z"}}' in mock.request_history[1].text
+
+
+def test_mirror_forgets_deleted_artifacts(requests_mock, tmp_path):
+    old = make_artifact("old.zip", "2021-01-01T00:00:00.000Z")
+    requests_mock.post("http://example.com/api/search/aql", json={"results": [old]})
+    requests_mock.delete("http://example.com/repo1/a/old.zip", status_code=204)
+    requests_mock.get("http://example.com/api/storage/repo1")
+    filename = str(tmp_path / "mirror.db")
+    cleanup = ArtifactoryCleanup(
+        session=BaseUrlSession("http://example.com"),
+        policies=[CleanupPolicy("Old", Repo("repo1"), DeleteOlderThan(days=30))],
+        destroy=True,
+        today=date(2021, 4, 1),
+        ignore_not_found=False,
+        worker_count=1,
+        mirror=filename,
+    )
+    summaries = list(cleanup.cleanup(nullcontext, lambda name: nullcontext()))
+
+    assert summaries[0].deleted_count == 1
+    mirror = Mirror(filename, BaseUrlSession("http://example.com"))
+    assert mirror.connection.execute("SELECT COUNT(*) FROM artifacts").fetchone() == (0,)
@@ -0,0 +1,227 @@
+import json
+from datetime import date
+
+from artifactory_cleanup.base_url_session import BaseUrlSession
+from artifactory_cleanup.rules import (
+    CleanupPolicy,
+    DeleteByRegexpName,
+    DeleteOlderThan,
+    FilterByRegexpPath,
+    KeepLatestNFiles,
+    KeepLatestNFilesInFolder,
+    PropertyNeq,
+    Repo,
+    RepoByMask,
+    Rule,
+)
+
+
+def make_artifact(name):
+    return {"repo": "repo-name-here", "path": "path/to/file", "name": name, "size": 1}
+
+
+def make_policy(**kwargs):
+    policy = CleanupPolicy(
+        "Remove old files", Repo("repo-name-here"), DeleteOlderThan(days=7)
+    )
+    policy.init(BaseUrlSession("http://example.com"), date(2021, 4, 1), **kwargs)
+    policy.build_aql_query()
+    return policy
+
+
+def test_get_artifacts_by_pages(requests_mock):
+    pages = [
+        [make_artifact("1.zip"), make_artifact("2.zip")],
+        [make_artifact("3.zip"), make_artifact("4.zip")],
+        [make_artifact("5.zip")],
+    ]
+    mock = requests_mock.post(
+        "http://example.com/api/search/aql",
+        [{"json": {"results": page}} for page in pages],
+    )
+    policy = make_policy(aql_page_size=2)
+
+    artifacts = policy.get_artifacts()
+
+    assert [x["name"] for x in artifacts] == ["1.zip", "2.zip", "3.zip", "4.zip", "5.zip"]
+    assert mock.call_count == 3
+    first, second, _ = [request.text for request in mock.request_history]
+    assert first.endswith('.sort({"$asc": ["repo", "path", "name"]}).limit(2)')
+    assert '{"name": {"$gt": "2.zip"}}' in second
+
+
+def test_get_artifacts_by_pages_stops_on_empty_page(requests_mock):
+    mock = requests_mock.post(
+        "http://example.com/api/search/aql",
+        [
+            {"json": {"results": [make_artifact("1.zip"), make_artifact("2.zip")]}},
+            {"json": {"results": []}},
+        ],
+    )
+    policy = make_policy(aql_page_size=2)
+
+    assert len(policy.get_artifacts()) == 2
+    assert mock.call_count == 2
+
+
+def test_get_artifacts_without_pages_for_properties_and_stats(requests_mock):
+    mock = requests_mock.post(
+        "http://example.com/api/search/aql",
+        json={"results": [make_artifact("1.zip"), make_artifact("2.zip")]},
+    )
+    policy = CleanupPolicy("Not released", Repo("repo-name-here"), PropertyNeq("released", "true"))
+    policy.init(BaseUrlSession("http://example.com"), date(2021, 4, 1), aql_page_size=2)
+    policy.build_aql_query()
+
+    assert len(policy.get_artifacts()) == 2
+    assert mock.call_count == 1
+    assert ".sort(" not in mock.last_request.text and ".limit(" not in mock.last_request.text
+
+
+def test_get_artifacts_without_pages(requests_mock):
+    mock = requests_mock.post(
+        "http://example.com/api/search/aql",
+        json={"results": [make_artifact("1.zip")]},
+    )
+    policy = make_policy()
+
+    assert len(policy.get_artifacts()) == 1
+    assert ".limit(" not in mock.last_request.text
+    assert json.dumps(policy.aql_find_filters) in mock.last_request.text
+
+
+def test_aql_include_only_needed_fields():
+    policy = make_policy()
+    assert policy.aql_text.endswith(
+        '.include("repo", "path", "name", "type", "size", "actual_sha1")'
+    )
+
+
+def test_aql_include_properties_by_key():
+    policy = CleanupPolicy(
+        "Keep released", Repo("repo-name-here"), PropertyNeq("released", "true")
+    )
+    policy.build_aql_query()
+    assert policy.aql_text.endswith('"actual_sha1", "@released")')
+
+
+def test_aql_include_everything_for_custom_rules():
+    class CustomRule(Rule):
+        def filter(self, artifacts):
+            return artifacts
+
+    policy = CleanupPolicy("Custom", Repo("repo-name-here"), CustomRule())
+    policy.build_aql_query()
+    assert policy.aql_text.endswith('.include("*", "property", "stat")')
+
+
+def test_aql_pushdown_rules(capsys):
+    policy = CleanupPolicy(
+        "Remove releases",
+        Repo("repo-name-here"),
+        DeleteByRegexpName(r"release-.*\.zip$"),
+        FilterByRegexpPath(r"build-\d+"),
+    )
+    policy.build_aql_query()
+    assert policy.aql_find_filters == {
+        "$and": [
+            {"repo": {"$eq": "repo-name-here"}},
+            {"name": {"$match": "release-*.zip"}},
+        ]
+    }
+    stdout, _ = capsys.readouterr()
+    assert "Rules pushed down to AQL: DeleteByRegexpName\n" in stdout
+
+
+def test_aql_pushdown_after_keep_rules(monkeypatch):
+    artifacts = [
+        dict(make_artifact("release-1.zip"), type="file", created="2021-01-01T00:00:00.000Z", properties={}, stats={}),
+        dict(make_artifact("release-2.zip"), type="file", created="2021-01-02T00:00:00.000Z", properties={}, stats={}),
+        dict(make_artifact("nightly.zip"), type="file", created="2021-01-03T00:00:00.000Z", properties={}, stats={}),
+    ]
+
+    def get_removed():
+        policy = CleanupPolicy(
+            "Remove releases", Repo("repo-name-here"), KeepLatestNFilesInFolder(1), DeleteByRegexpName("release-.*")
+        )
+        policy.init(BaseUrlSession("http://example.com"), date(2021, 4, 1), aql_sort=False)
+        policy.build_aql_query()
+        return [x["name"] for x in policy.filter(policy.get_artifacts_from(artifacts))]
+
+    removed = get_removed()
+    monkeypatch.setattr(DeleteByRegexpName, "aql_pushdown", lambda self: None)
+    assert removed == get_removed() == ["release-1.zip", "release-2.zip"], "nightly.zip is the latest one"
+
+
+def test_keep_latest_files_sorted_by_aql():
+    rule = KeepLatestNFiles(count=10)
+    policy = CleanupPolicy("Keep latest", Repo("repo-name-here"), rule)
+    policy.build_aql_query()
+    assert policy.aql_text.endswith('.sort({"$desc": ["created"]}).offset(10)')
+    assert rule.kept_by_aql
+
+
+def test_keep_latest_files_in_memory_after_other_filters():
+    rule = KeepLatestNFiles(count=10)
+    policy = CleanupPolicy(
+        "Keep latest", Repo("repo-name-here"), PropertyNeq("released", "true"), rule
+    )
+    policy.build_aql_query()
+    assert ".sort(" not in policy.aql_text
+    assert not rule.kept_by_aql
+
+
+def test_get_artifacts_by_shards(requests_mock):
+    def aql_callback(request, context):
+        if '"repo": {"$eq": "repo1"}' in request.text:
+            return {"results": [make_artifact("1.zip")]}
+        if '"repo": {"$eq": "repo2"}' in request.text:
+            return {"results": [make_artifact("2.zip")]}
+        raise AssertionError(request.text)
+
+    requests_mock.get(
+        "http://example.com/api/repositories",
+        json=[{"key": "repo1"}, {"key": "repo2"}, {"key": "other"}],
+    )
+    mock = requests_mock.post("http://example.com/api/search/aql", json=aql_callback)
+    policy = CleanupPolicy("Remove old files", RepoByMask("repo*"), DeleteOlderThan(days=7))
+    policy.init(BaseUrlSession("http://example.com"), date(2021, 4, 1), aql_shard=True)
+    policy.build_aql_query()
+
+    artifacts = policy.get_artifacts()
+
+    assert sorted(x["name"] for x in artifacts) == ["1.zip", "2.zip"]
+    assert mock.call_count == 2
+
+
+def test_get_artifacts_by_shards_split_by_time(requests_mock):
+    artifacts = [
+        dict(make_artifact(f"{i}.zip"), created=f"2021-01-0{i}T00:00:00.000Z")
+        for i in range(1, 5)
+    ]
+
+    def aql_callback(request, context):
+        if '{"$gte": "2021-01-03T00:00:00.000Z"}' in request.text:
+            return {"results": artifacts[2:]}
+        if '{"$lt": "2021-01-03T00:00:00.000Z"}' in request.text:
+            return {"results": artifacts[:2]}
+        if request.text.endswith(".limit(3)"):
+            return {"results": artifacts[:3]}
+        return {"results": artifacts}
+
+    mock = requests_mock.post("http://example.com/api/search/aql", json=aql_callback)
+    policy = make_policy(aql_shard=True, aql_shard_threshold=2)
+
+    assert [x["name"] for x in policy.get_artifacts()] == ["1.zip", "2.zip", "3.zip", "4.zip"]
+    probe, created, *windows = [request.text for request in mock.request_history]
+    assert probe.endswith(".limit(3)"), "Artifactory stops right after the threshold"
+    assert '.include("repo", "path", "name", "created")' in created and ".limit(" not in created
+    assert len(windows) == 2
+
+
+def test_get_artifacts_by_shards_small_shard(requests_mock):
+    mock = requests_mock.post("http://example.com/api/search/aql", json={"results": [make_artifact("1.zip")]})
+    policy = make_policy(aql_shard=True, aql_shard_threshold=2)
+
+    assert [x["name"] for x in policy.get_artifacts()] == ["1.zip"]
+    assert mock.call_count == 1, "The probe is the whole shard"
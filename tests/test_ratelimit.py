@@ -0,0 +1,31 @@
+from artifactory_cleanup.ratelimit import RateLimit, RoundRobin
+
+
+def make_artifacts(repo, count):
+    return [{"repo": repo, "path": "path", "name": f"{repo}-{i}.zip"} for i in range(count)]
+
+
+def test_round_robin_by_repos():
+    artifacts = make_artifacts("a", 3) + make_artifacts("b", 1) + make_artifacts("c", 2)
+    names = [x["name"] for x in RoundRobin(artifacts)]
+    assert names == ["a-0.zip", "b-0.zip", "c-0.zip", "a-1.zip", "c-1.zip", "a-2.zip"]
+
+
+def test_round_robin_skips_repo_waiting_for_rate_limit():
+    artifacts = make_artifacts("slow", 2) + make_artifacts("fast", 3)
+    queue = RoundRobin(artifacts, RateLimit(repos={"slow": 0.001}))
+
+    polled = [queue.poll() for _ in range(4)]
+
+    assert [artifact["name"] for artifact, _ in polled[:3]] == ["slow-0.zip", "fast-0.zip", "fast-1.zip"]
+    assert polled[3][0]["name"] == "fast-2.zip"
+    artifact, wait = queue.poll()
+    assert artifact is None
+    assert wait > 100, "The slow repository waits for the next token"
+
+
+def test_global_rate_limit():
+    rate_limit = RateLimit(global_rate=2, repos={"a": 10})
+    assert rate_limit.take("a") == 0
+    assert rate_limit.take("b") == 0
+    assert rate_limit.take("b") > 0
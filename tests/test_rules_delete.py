@@ -1,8 +1,17 @@
 import json
+from datetime import date
 
 import pytest
 
-from artifactory_cleanup.rules import DeleteEmptyFolders
+from artifactory_cleanup.base_url_session import BaseUrlSession
+from artifactory_cleanup.rules import (
+    ArtifactsList,
+    CleanupPolicy,
+    DeleteEmptyFolders,
+    DeleteLeastRecentlyUsedFiles,
+    DeleteOlderThan,
+    Repo,
+)
 
 
 @pytest.fixture
@@ -108,3 +117,45 @@ def test_delete_empty_folders(artifacts_list):
         },
     ]
     assert list(artifacts_to_remove) == expected_empty_folders
+
+
+def test_delete_least_recently_used_files():
+    artifacts = ArtifactsList.from_response(
+        [
+            {"path": "p", "name": "old.zip", "created": "2021-01-01"},
+            {"path": "p", "name": "downloaded.zip", "created": "2020-01-01", "stats": [{"downloaded": "2021-06-01"}]},
+            {"path": "p", "name": "new.zip", "created": "2021-03-01"},
+            {"path": "p", "name": "oldest.zip", "created": "2020-06-01"},
+        ]
+    )
+    removed = DeleteLeastRecentlyUsedFiles(keep=2).filter(artifacts)
+    assert [x["name"] for x in removed] == ["old.zip", "oldest.zip"]
+
+
+DUMP = [
+    {"repo": "repo", "path": ".", "name": "empty", "type": "folder", "size": 0},
+    {"repo": "repo", "path": ".", "name": "full", "type": "folder", "size": 0},
+    {"repo": "repo", "path": "full", "name": "a.zip", "type": "file", "size": 1, "created": "2000-01-01T00:00:00.000Z"},
+]
+
+
+def make_policy(*rules):
+    policy = CleanupPolicy("policy", Repo("repo"), *rules)
+    policy.init(BaseUrlSession("http://example.com"), date(2021, 4, 1))
+    policy.build_aql_query()
+    return policy
+
+
+def test_delete_empty_folders_from_dump():
+    policy = make_policy(DeleteEmptyFolders())
+    artifacts = policy.get_artifacts_from(ArtifactsList.from_response(json.loads(json.dumps(DUMP))))
+    assert len(artifacts) == 3
+
+    folders = policy.filter(artifacts)
+    assert [(x["path"], x["name"]) for x in folders] == [(".", "empty")]
+
+
+def test_file_policy_from_dump_skips_folders():
+    policy = make_policy(DeleteOlderThan(days=1))
+    artifacts = policy.get_artifacts_from(ArtifactsList.from_response(json.loads(json.dumps(DUMP))))
+    assert [x["name"] for x in artifacts] == ["a.zip"]